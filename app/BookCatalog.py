@@ -0,0 +1,103 @@
+from bisect import bisect_right
+
+import Canon
+
+# -----
+# Book Catalog
+# The books of one fileset as the DBP describes them (in one request, see `DBPManager.book_catalog()`): their order, testament,
+# chapters and the verse count of each chapter. Filesets don't all share one versification (e.g. a translation leaving out a verse),
+# so this is that fileset's own shape, where Canon is the shape of the canon in general.
+#
+# Like Canon, every verse of the fileset has an ordinal (its position among all the fileset's verses), so comparing, measuring and
+# stepping through verses of the fileset is integer arithmetic. Books can be given by any name Canon recognises, or by the fileset's
+# own book ids.
+# -----
+
+def verseCounts(info):
+    # The verse count of each chapter of a book's information, falling back to the canon's if the DBP didn't give them
+    counts = {entry["chapter"] : entry["verses"] for entry in info.get("verses_count", [])}
+    index = Canon.bookIndex(info["book_id"])
+    canon_counts = Canon.BOOKS[index][2] if index >= 0 else []
+    return [counts.get(chapter, canon_counts[chapter - 1] if chapter <= len(canon_counts) else 0) for chapter in info["chapters"]]
+
+class BookCatalog:
+    def __init__(self, books):
+        """
+        Parameters
+        ----------
+        `books` : `list`
+            The information about each book, in the fileset's order, as returned by the DBP's book endpoint (with verse counts)
+        """
+        self.books = books
+        # Book key (see `key()`) -> position in `books`
+        self.positions = {}
+        # The verse count of each chapter of each book, and the ordinal of the first verse of each book and chapter (relative to the book)
+        self.verse_counts = []
+        self.book_offsets = []
+        self.chapter_offsets = []
+        self.total_verses = 0
+        for (position, info) in enumerate(books):
+            self.positions[self.key(info["book_id"])] = position
+            counts = verseCounts(info)
+            self.verse_counts.append(counts)
+            self.book_offsets.append(self.total_verses)
+            offsets = []
+            book_verses = 0
+            for count in counts:
+                offsets.append(book_verses)
+                book_verses += count
+            self.chapter_offsets.append(offsets)
+            self.total_verses += book_verses
+
+    def key(self, book):
+        # Books are found by their place in the canon, whatever they are called, or by their exact id if the canon doesn't have them
+        index = Canon.bookIndex(book)
+        return index if index >= 0 else book
+
+    def position(self, book):
+        """
+        Returns the position of the given book in the fileset (from 0), or -1 if the fileset doesn't have it
+        """
+        return self.positions.get(self.key(book), -1)
+
+    def book(self, book):
+        """
+        Returns the DBP's information about the given book, or `None` if the fileset doesn't have it
+        """
+        position = self.position(book)
+        return self.books[position] if position >= 0 else None
+
+    def testament(self, book):
+        info = self.book(book)
+        return info.get("testament") if info is not None else None
+
+    def chapterCount(self, book):
+        position = self.position(book)
+        return len(self.verse_counts[position]) if position >= 0 else 0
+
+    def verseCount(self, book, chapter):
+        """
+        Returns the number of verses the given chapter has in this fileset, or 0 if it doesn't have it
+        """
+        position = self.position(book)
+        if position < 0 or chapter < 1 or chapter > len(self.verse_counts[position]):
+            return 0
+        return self.verse_counts[position][chapter - 1]
+
+    def ordinal(self, book, chapter, verse):
+        """
+        Returns the position of the given verse among all the verses of the fileset, or `None` if the fileset doesn't have it
+        """
+        position = self.position(book)
+        if position < 0 or chapter < 1 or chapter > len(self.verse_counts[position]) or verse < 1 or verse > self.verse_counts[position][chapter - 1]:
+            return None
+        return self.book_offsets[position] + self.chapter_offsets[position][chapter - 1] + verse - 1
+
+    def verseAt(self, ordinal):
+        """
+        Returns the (book id, chapter, verse) at the given position among all the verses of the fileset
+        """
+        position = bisect_right(self.book_offsets, ordinal) - 1
+        book_ordinal = ordinal - self.book_offsets[position]
+        chapter = bisect_right(self.chapter_offsets[position], book_ordinal)
+        return (self.books[position]["book_id"], chapter, book_ordinal - self.chapter_offsets[position][chapter - 1] + 1)
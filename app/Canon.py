@@ -0,0 +1,82 @@
+from bisect import bisect_right
+from functools import lru_cache
+import scriptures
+
+# -----
+# Canon
+# The shape of the (Protestant) canon, precomputed once, so that any verse can be turned into its position among all the verses
+# of the Bible (its "ordinal", starting from 0 for Genesis 1:1) and back. With ordinals, comparing, ordering and measuring passages
+# is just integer arithmetic.
+# -----
+
+# (full name, abbreviation, verse count of each chapter) of every book, in order
+BOOKS = [(entry[0], entry[1], entry[3]) for entry in scriptures.references.pcanon.books.values()]
+
+# The ordinal of the first verse of each book, and of each chapter within each book (relative to the book)
+BOOK_OFFSETS = []
+CHAPTER_OFFSETS = []
+TOTAL_VERSES = 0
+for (_, _, verse_counts) in BOOKS:
+    BOOK_OFFSETS.append(TOTAL_VERSES)
+    chapter_offsets = []
+    book_verses = 0
+    for verse_count in verse_counts:
+        chapter_offsets.append(book_verses)
+        book_verses += verse_count
+    CHAPTER_OFFSETS.append(chapter_offsets)
+    TOTAL_VERSES += book_verses
+
+# The USFM id of every book, in the same order, as the DBP names books (e.g. in the verse cache)
+USFM_IDS = ["GEN", "EXO", "LEV", "NUM", "DEU", "JOS", "JDG", "RUT", "1SA", "2SA", "1KI", "2KI", "1CH", "2CH", "EZR", "NEH", "EST",
+            "JOB", "PSA", "PRO", "ECC", "SNG", "ISA", "JER", "LAM", "EZK", "DAN", "HOS", "JOL", "AMO", "OBA", "JON", "MIC", "NAM",
+            "HAB", "ZEP", "HAG", "ZEC", "MAL", "MAT", "MRK", "LUK", "JHN", "ACT", "ROM", "1CO", "2CO", "GAL", "EPH", "PHP", "COL",
+            "1TH", "2TH", "1TI", "2TI", "TIT", "PHM", "HEB", "JAS", "1PE", "2PE", "1JN", "2JN", "3JN", "JUD", "REV"]
+
+# The most other spellings whose index is remembered. Spellings can come from anyone asking a question, so there is a limit.
+SPELLING_CACHE_SIZE = 4096
+
+# Book name -> index, of full names, abbreviations and USFM ids
+_book_indexes = {}
+for (index, (name, abbreviation, _)) in enumerate(BOOKS):
+    _book_indexes[USFM_IDS[index]] = index
+    _book_indexes[name] = index
+    _book_indexes[abbreviation] = index
+
+def bookIndex(book):
+    """
+    Returns the position of the given book in the canon (Genesis = 0, Exodus = 1, etc.), or -1 if it isn't recognised.
+    Full names and abbreviations are looked up directly; anything else is recognised the same way as the scriptures library does.
+    """
+    index = _book_indexes.get(book)
+    if index is None:
+        index = spellingIndex(book) if type(book) == str else -1
+    return index
+
+@lru_cache(maxsize=SPELLING_CACHE_SIZE)
+def spellingIndex(book):
+    # The index of a spelling of a book other than its full name, abbreviation or USFM id, as the scriptures library recognises it
+    book_entry = scriptures.references.get_book(book.strip())
+    return _book_indexes.get(book_entry[0], -1) if book_entry is not None else -1
+
+def ordinal(book, chapter, verse):
+    """
+    Returns the position of the given verse among all the verses of the Bible, or `None` if the book or chapter doesn't exist.
+    A verse past the end of its chapter (e.g. from a different versification) is treated as the chapter's last verse.
+    """
+    index = bookIndex(book)
+    if index < 0:
+        return None
+    verse_counts = BOOKS[index][2]
+    if chapter < 1 or chapter > len(verse_counts):
+        return None
+    verse = min(max(verse, 1), verse_counts[chapter - 1])
+    return BOOK_OFFSETS[index] + CHAPTER_OFFSETS[index][chapter - 1] + verse - 1
+
+def verseAt(ordinal):
+    """
+    Returns the (book index, chapter, verse) at the given position among all the verses of the Bible
+    """
+    index = bisect_right(BOOK_OFFSETS, ordinal) - 1
+    book_ordinal = ordinal - BOOK_OFFSETS[index]
+    chapter = bisect_right(CHAPTER_OFFSETS[index], book_ordinal)
+    return (index, chapter, book_ordinal - CHAPTER_OFFSETS[index][chapter - 1] + 1)
@@ -0,0 +1,82 @@
+import json
+import os
+import threading
+import time
+
+from VerseCache import DEFAULT_CACHE_DIR
+
+DEFAULT_CATALOG_FILE = "catalog.json"
+
+# The list of languages and Bibles on the DBP changes rarely, so a week is a safe default
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+class Catalog:
+    def __init__(self, path = None, ttl = DEFAULT_TTL):
+        """
+        A local record of which languages, and which filesetIDs for each language, the Digital Bible Platform supports.
+        It lets a `DBPManager` validate its language and version without paging through the API each time the program starts.
+        Entries older than `ttl` seconds are treated as missing, so they will be fetched again.
+
+        Parameters
+        ----------
+        [`path` : `str`]
+            The JSON file the catalog is saved in. If not given, `DEFAULT_CATALOG_FILE` in the verse cache folder is used.
+            `":memory:"` can be used for a catalog that is never saved.
+        [`ttl` : `float`]
+            How many seconds an entry stays valid
+        """
+
+        if path is None:
+            os.makedirs(DEFAULT_CACHE_DIR, exist_ok=True)
+            path = os.path.join(DEFAULT_CACHE_DIR, DEFAULT_CATALOG_FILE)
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.data = {"languages" : None, "filesets" : {}}
+        if path != ":memory:" and os.path.exists(path):
+            try:
+                with open(path, "r") as handle:
+                    self.data = json.load(handle)
+            except Exception as e:
+                # A broken catalog is just refetched
+                print("Ignoring unreadable catalog " + path + ": " + str(e))
+
+    def fresh(self, entry):
+        return entry is not None and time.time() - entry["fetched"] < self.ttl
+
+    def languages(self):
+        """
+        Returns the set of ISO language codes known to the DBP, or `None` if they aren't known or have expired
+        """
+
+        with self.lock:
+            entry = self.data["languages"]
+            return set(entry["codes"]) if self.fresh(entry) else None
+
+    def set_languages(self, codes):
+        with self.lock:
+            self.data["languages"] = {"fetched" : time.time(), "codes" : sorted(codes)}
+            self.save()
+
+    def filesets(self, lang : str):
+        """
+        Returns the set of text filesetIDs known for the given language, or `None` if they aren't known or have expired
+        """
+
+        with self.lock:
+            entry = self.data["filesets"].get(lang)
+            return set(entry["ids"]) if self.fresh(entry) else None
+
+    def set_filesets(self, lang : str, fileset_ids):
+        with self.lock:
+            self.data["filesets"][lang] = {"fetched" : time.time(), "ids" : sorted(fileset_ids)}
+            self.save()
+
+    def save(self):
+        # Called with the lock held. Write to a temporary file first so that other processes never see half a catalog
+        if self.path == ":memory:":
+            return
+        temporary_path = self.path + "." + str(os.getpid()) + ".tmp"
+        with open(temporary_path, "w") as handle:
+            json.dump(self.data, handle, indent=4)
+        os.replace(temporary_path, self.path)
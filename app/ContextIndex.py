@@ -0,0 +1,115 @@
+# -----
+# Context Index
+# An inverted index over the scripture contexts, built once and shared by the filters, so that a filter only has to look at the
+# passages which can actually score for a question, instead of comparing against every passage.
+#
+# For each member (e.g. "people"), every value found in any scripture context maps to the passages carrying it, along with how many
+# times it appears there (the "postings"). Values are compared exactly as the filters always have, so scores are unchanged.
+# For substring matching (e.g. finding significant words within the questions associated with passages), each distinct value is also
+# indexed by its character trigrams, so only values containing all the trigrams of the searched text need to be checked.
+# -----
+
+GRAM_SIZE = 3
+
+def grams(text):
+    return set(text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1))
+
+class ContextIndex:
+    def __init__(self, scripture_contexts):
+        """
+        Creates an index over the given scripture contexts. Each member is only indexed the first time it is used.
+
+        Parameters
+        ----------
+        `scripture_contexts` : `list`
+            The scripture contexts, as found in the "scripture" list of Scriptures.json
+        """
+        self.scripture_contexts = scripture_contexts
+        # Member name -> value -> {passage reference: number of times the value appears for that passage}
+        self.member_postings = {}
+        # Member name -> trigram -> set of values containing that trigram
+        self.member_grams = {}
+
+    def add(self, scripture_context):
+        """
+        Adds one more scripture context to the index, updating every member which has already been indexed
+        """
+        self.scripture_contexts.append(scripture_context)
+        for key_name in self.member_postings:
+            self.addToMember(key_name, scripture_context)
+
+    def addMembers(self, scripture_context, key_names):
+        """
+        Indexes the given members of one more scripture context without keeping the context itself, so an index can be built from
+        more contexts than can be held at once (see Loader). Only members indexed this way can be looked up afterwards.
+        """
+        for key_name in key_names:
+            self.addToMember(key_name, scripture_context, self.member_postings.setdefault(key_name, {}))
+
+    def addToMember(self, key_name, scripture_context, postings = None):
+        if postings is None:
+            postings = self.member_postings[key_name]
+        passage_ref = scripture_context["passage"]
+        for value in scripture_context[key_name]:
+            value_postings = postings.get(value)
+            if value_postings is None:
+                value_postings = postings[value] = {}
+                if key_name in self.member_grams:
+                    for gram in grams(value):
+                        self.member_grams[key_name].setdefault(gram, set()).add(value)
+            value_postings[passage_ref] = value_postings.get(passage_ref, 0) + 1
+
+    def memberPostings(self, key_name):
+        # Index the member the first time it is asked for. It is only made visible once complete, so that other threads
+        # never see it half built
+        member_postings = self.member_postings.get(key_name)
+        if member_postings is None:
+            member_postings = {}
+            for scripture_context in self.scripture_contexts:
+                self.addToMember(key_name, scripture_context, member_postings)
+            self.member_postings[key_name] = member_postings
+        return member_postings
+
+    def memberGrams(self, key_name):
+        if key_name not in self.member_grams:
+            member_grams = {}
+            for value in self.memberPostings(key_name):
+                for gram in grams(value):
+                    member_grams.setdefault(gram, set()).add(value)
+            self.member_grams[key_name] = member_grams
+        return self.member_grams[key_name]
+
+    def postings(self, key_name, value):
+        """
+        Returns the passages whose given member contains the given value
+
+        Returns
+        -------
+        `dict`
+            Passage reference -> number of times the value appears in that passage's member
+        """
+        return self.memberPostings(key_name).get(value, {})
+
+    def matchingValues(self, key_name, question_value, only_exact):
+        """
+        Returns the values of the given member, across all scripture contexts, which match the given question value.
+        If `only_exact` is True, that is just the value itself (if any passage has it), otherwise it is every value containing it.
+        """
+        postings = self.memberPostings(key_name)
+        if only_exact:
+            return [question_value] if question_value in postings else []
+
+        question_grams = grams(question_value)
+        if len(question_grams) == 0:
+            # Too short to have any trigrams, so fall back to checking each distinct value
+            return [value for value in postings if question_value in value]
+
+        # Only values having every trigram of the question value can contain it; start from the rarest trigram
+        member_grams = self.memberGrams(key_name)
+        gram_values = sorted((member_grams.get(gram, set()) for gram in question_grams), key=len)
+        candidates = set(gram_values[0])
+        for values in gram_values[1:]:
+            candidates &= values
+            if len(candidates) == 0:
+                break
+        return [value for value in candidates if question_value in value]
@@ -0,0 +1,468 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+from array import array
+from collections.abc import Mapping, Sequence
+
+from Passage import Passage, bookId, bookSpelling
+from PassageArray import PassageArray
+from ContextIndex import ContextIndex
+from Synonyms import SynonymCache
+from VerseCache import DEFAULT_CACHE_DIR
+
+# -----
+# Corpus
+# A data file (Scriptures.json or Contexts.json) compiled into a binary file which is memory-mapped when loaded, rather than decoded.
+# Everything the filters need is worked out once, when compiling, and stored in arrays which are used where they lie in the file:
+#   - every string, once (a string table), so everything else refers to strings by number
+#   - the whole JSON document, as a tree of nodes which refer to their children by position, so any one record (and any one
+#     member of it) can be read without reading anything else
+#   - for Scriptures.json, each passage already parsed and placed in the canon (the columns of a PassageArray), the postings of
+#     every member which is a list of values (as a ContextIndex would build them), and the similar words of each question type word
+#
+# The compiled file remembers the SHA-256 of the JSON it was compiled from, and `loadCorpus()` compiles it again whenever that changes.
+# -----
+
+MAGIC = b"AGCORPUS"
+FORMAT_VERSION = 1
+
+# Magic, format version, number of sections, SHA-256 of the source; then for each section its name, offset and length in bytes
+HEADER = struct.Struct("<8sII32s")
+SECTION = struct.Struct("<32sQQ")
+
+# The list of scripture contexts in Scriptures.json; the only records with passages, postings and similar words compiled
+SCRIPTURE_KEY = "scripture"
+
+# The kinds of node in the document tree, which is a sequence of unsigned 32-bit numbers. Every node starts with its kind:
+#   - null, false and true are just their kind
+#   - an integer, float or string is followed by its position in the integers, floats or string table
+#   - a list is followed by its length, then the position of each item's node
+#   - an object is followed by its number of members, then each member's name (in the string table) and the position of its node
+NULL = 0
+FALSE = 1
+TRUE = 2
+INTEGER = 3
+FLOAT = 4
+STRING = 5
+LIST = 6
+OBJECT = 7
+
+def fileHash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(block)
+    return digest.digest()
+
+class Compiler:
+    def __init__(self):
+        self.string_ids = {}
+        self.string_data = bytearray()
+        self.string_offsets = array("I", [0])
+        self.nodes = array("I")
+        self.integers = array("q")
+        self.floats = array("d")
+
+    def string(self, value):
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = self.string_ids[value] = len(self.string_ids)
+            self.string_data += value.encode("utf-8")
+            self.string_offsets.append(len(self.string_data))
+        return string_id
+
+    def node(self, value):
+        # Adds the node of the given JSON value (and all of its children), and returns its position
+        position = len(self.nodes)
+        if value is None:
+            self.nodes.append(NULL)
+        elif value is True or value is False:
+            self.nodes.append(TRUE if value else FALSE)
+        elif type(value) == int:
+            self.nodes.extend((INTEGER, len(self.integers)))
+            self.integers.append(value)
+        elif type(value) == float:
+            self.nodes.extend((FLOAT, len(self.floats)))
+            self.floats.append(value)
+        elif type(value) == str:
+            self.nodes.extend((STRING, self.string(value)))
+        elif type(value) == list:
+            self.nodes.extend((LIST, len(value)))
+            self.nodes.extend([0] * len(value))
+            for (i, item) in enumerate(value):
+                self.nodes[position + 2 + i] = self.node(item)
+        elif type(value) == dict:
+            self.nodes.extend((OBJECT, len(value)))
+            self.nodes.extend([0] * (2 * len(value)))
+            for (i, (name, member)) in enumerate(value.items()):
+                self.nodes[position + 2 + 2 * i] = self.string(name)
+                self.nodes[position + 3 + 2 * i] = self.node(member)
+        else:
+            raise Exception("Can't compile a value of type " + type(value).__name__)
+        return position
+
+    def passageSections(self, scripture_contexts):
+        # The columns of a PassageArray of every distinct passage, in the order they first appear, with books as string ids
+        passages = PassageArray()
+        books = array("I")
+        for scripture_context in scripture_contexts:
+            passage_ref = scripture_context["passage"]
+            if passage_ref in self.passage_rows:
+                continue
+            self.passage_rows[passage_ref] = len(passages)
+            passage = passages.append(Passage(passage_ref))
+            books.extend((self.string(passage.startBook), self.string(passage.endBook)))
+        return {
+            "passages.start_books" : books[0::2],
+            "passages.end_books" : books[1::2],
+            "passages.start_chapters" : passages.start_chapters,
+            "passages.end_chapters" : passages.end_chapters,
+            "passages.start_verses" : passages.start_verses,
+            "passages.end_verses" : passages.end_verses,
+            "passages.start_ordinals" : passages.start_ordinals,
+            "passages.end_ordinals" : passages.end_ordinals,
+            "passages.osis" : passages.osis,
+            "passages.reference_bytes" : passages.reference_bytes,
+            "passages.reference_offsets" : passages.reference_offsets
+        }
+
+    def postingSections(self, scripture_contexts):
+        # The postings of every member which is a list of strings in every scripture context, built just as a ContextIndex builds them
+        members = [name for name in scripture_contexts[0] if all(type(scripture_context.get(name)) == list and
+                   all(type(value) == str for value in scripture_context[name]) for scripture_context in scripture_contexts)]
+        index = ContextIndex(scripture_contexts)
+        sections = {}
+        for member in members:
+            (values, offsets, passage_ids, counts) = (array("I"), array("I", [0]), array("I"), array("I"))
+            for (value, postings) in index.memberPostings(member).items():
+                values.append(self.string(value))
+                for (passage_ref, count) in postings.items():
+                    passage_ids.append(self.string(passage_ref))
+                    counts.append(count)
+                offsets.append(len(passage_ids))
+            sections.update({"postings." + member + ".values" : values, "postings." + member + ".offsets" : offsets,
+                             "postings." + member + ".passages" : passage_ids, "postings." + member + ".counts" : counts})
+        return sections
+
+    def synonymSections(self, scripture_contexts, synonyms):
+        # The similar words of every subject and action word of the question types
+        synonyms.precompute(scripture_contexts)
+        (words, offsets, lemmas) = (array("I"), array("I", [0]), array("I"))
+        for scripture_context in scripture_contexts:
+            for question_type in scripture_context["question-types"]:
+                for member in ("subject", "action"):
+                    member_words = question_type[member]
+                    for word in [member_words] if type(member_words) == str else member_words:
+                        word_id = self.string(word)
+                        if word_id in self.synonym_words:
+                            continue
+                        self.synonym_words.add(word_id)
+                        words.append(word_id)
+                        lemmas.extend(self.string(lemma) for lemma in sorted(synonyms.lemmas(word)))
+                        offsets.append(len(lemmas))
+        return {"synonyms.words" : words, "synonyms.offsets" : offsets, "synonyms.lemmas" : lemmas}
+
+    def compile(self, document, synonyms = None):
+        """
+        Returns the named sections of the compiled document
+        """
+        self.passage_rows = {}
+        self.synonym_words = set()
+        sections = {}
+        root = self.node(document)
+        scripture_contexts = document.get(SCRIPTURE_KEY) if type(document) == dict else None
+        if scripture_contexts:
+            if synonyms is None:
+                from Utils import defaultSynonyms
+                synonyms = defaultSynonyms()
+            sections.update(self.passageSections(scripture_contexts))
+            sections.update(self.postingSections(scripture_contexts))
+            sections.update(self.synonymSections(scripture_contexts, synonyms))
+        sections.update({
+            "root" : array("I", [root]),
+            "nodes" : self.nodes,
+            "integers" : self.integers,
+            "floats" : self.floats,
+            "strings.data" : self.string_data,
+            "strings.offsets" : self.string_offsets
+        })
+        return sections
+
+def compileCorpus(source_path, path, synonyms = None):
+    """
+    Compiles the given JSON data file into a corpus file at the given path
+
+    Parameters
+    ----------
+    `source_path` : `str`
+        The JSON data file (e.g. Scriptures.json)
+    `path` : `str`
+        Where the compiled corpus is written
+    [`synonyms` : `SynonymCache`]
+        Where similar words come from; the shared one is used if not given. Only needed for Scriptures.json.
+    """
+    source_hash = fileHash(source_path)
+    with open(source_path, "r") as handle:
+        document = json.load(handle)
+    sections = Compiler().compile(document, synonyms)
+
+    # Lay the sections out after the header, each one starting on an 8 byte boundary
+    offset = HEADER.size + SECTION.size * len(sections)
+    table = []
+    for (name, data) in sections.items():
+        offset += -offset % 8
+        length = len(data) * (data.itemsize if isinstance(data, array) else 1)
+        table.append((name, offset, length, data))
+        offset += length
+
+    # Write to a temporary file first, so that a process loading the corpus never sees half a file
+    temporary_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(temporary_path, "wb") as handle:
+        handle.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(table), source_hash))
+        for (name, offset, length, _) in table:
+            handle.write(SECTION.pack(name.encode("utf-8"), offset, length))
+        for (name, offset, length, data) in table:
+            handle.write(b"\0" * (offset - handle.tell()))
+            handle.write(data.tobytes() if isinstance(data, array) else bytes(data))
+    os.replace(temporary_path, path)
+
+def loadCorpus(source_path, path = None, synonyms = None):
+    """
+    Returns the compiled corpus of the given JSON data file, compiling it first if it hasn't been, or if the JSON has changed since
+
+    Parameters
+    ----------
+    `source_path` : `str`
+        The JSON data file (e.g. Scriptures.json)
+    [`path` : `str`]
+        The compiled corpus. If not given, it is kept in the cache folder, named after the JSON file (e.g. Scriptures.corpus)
+    [`synonyms` : `SynonymCache`]
+        Where similar words come from, if compiling is necessary; the shared one is used if not given
+    """
+    if path is None:
+        os.makedirs(DEFAULT_CACHE_DIR, exist_ok=True)
+        path = os.path.join(DEFAULT_CACHE_DIR, os.path.splitext(os.path.basename(source_path))[0] + ".corpus")
+    source_hash = fileHash(source_path)
+    if os.path.exists(path):
+        try:
+            corpus = Corpus(path)
+            if corpus.source_hash == source_hash:
+                return corpus
+        except Exception as e:
+            # A broken or outdated file just means it is compiled again
+            print("Recompiling unreadable corpus " + path + ": " + str(e))
+    compileCorpus(source_path, path, synonyms)
+    return Corpus(path)
+
+class Record(Mapping):
+    def __init__(self, corpus, position):
+        # A JSON object in the corpus. Each member is only read the first time it is asked for, then kept
+        self.corpus = corpus
+        self.position = position
+        self.members = None
+        self.values = {}
+
+    def memberPositions(self):
+        if self.members is None:
+            nodes = self.corpus.nodes
+            count = nodes[self.position + 1]
+            start = self.position + 2
+            self.members = {self.corpus.string(nodes[start + 2 * i]) : nodes[start + 2 * i + 1] for i in range(count)}
+        return self.members
+
+    def __getitem__(self, name):
+        value = self.values.get(name, self)
+        if value is self:
+            value = self.values[name] = self.corpus.value(self.memberPositions()[name])
+        return value
+
+    def __iter__(self):
+        return iter(self.memberPositions())
+
+    def __len__(self):
+        return self.corpus.nodes[self.position + 1]
+
+class RecordList(Sequence):
+    def __init__(self, corpus, position):
+        # A JSON list of objects in the corpus, each of which is a Record. More records (e.g. dicts) can be appended to it
+        self.corpus = corpus
+        self.position = position
+        self.records = [None] * corpus.nodes[position + 1]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        record = self.records[i]
+        if record is None:
+            position = self.corpus.nodes[self.position + 2 + (i if i >= 0 else len(self.records) + i)]
+            record = self.records[i] = Record(self.corpus, position)
+        return record
+
+    def __len__(self):
+        return len(self.records)
+
+    def append(self, record):
+        self.records.append(record)
+
+    def fingerprint(self):
+        """
+        Returns a fingerprint of the records, which changes whenever they do: the hash of the JSON the corpus was compiled from,
+        along with any records appended since
+        """
+        digest = hashlib.sha256(self.corpus.source_hash)
+        for record in self.records[self.corpus.nodes[self.position + 1]:]:
+            digest.update(json.dumps(record, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+class Corpus:
+    def __init__(self, path):
+        """
+        Maps the compiled corpus at the given path. Nothing is read until it is used.
+
+        Raises
+        ------
+        Exception if the file isn't a compiled corpus, or was compiled by a different version of this module
+        """
+        self.path = path
+        with open(path, "rb") as handle:
+            self.map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, section_count, self.source_hash) = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise Exception(path + " is not a version " + str(FORMAT_VERSION) + " corpus")
+        self.sections = {}
+        view = memoryview(self.map)
+        for i in range(section_count):
+            (name, offset, length) = SECTION.unpack_from(self.map, HEADER.size + SECTION.size * i)
+            self.sections[name.rstrip(b"\0").decode("utf-8")] = view[offset:offset + length]
+        self.nodes = self.section("nodes", "I")
+        self.string_offsets = self.section("strings.offsets", "I")
+        self.string_data = self.sections["strings.data"]
+        self.strings = [None] * (len(self.string_offsets) - 1)
+
+    def section(self, name, typecode):
+        return self.sections[name].cast(typecode)
+
+    def string(self, string_id):
+        string = self.strings[string_id]
+        if string is None:
+            string = self.strings[string_id] = str(self.string_data[self.string_offsets[string_id]:self.string_offsets[string_id + 1]], "utf-8")
+        return string
+
+    def value(self, position):
+        """
+        Returns the JSON value of the node at the given position, as it would have been decoded from the JSON
+        """
+        nodes = self.nodes
+        kind = nodes[position]
+        if kind == STRING:
+            return self.string(nodes[position + 1])
+        elif kind == LIST:
+            return [self.value(nodes[position + 2 + i]) for i in range(nodes[position + 1])]
+        elif kind == OBJECT:
+            return {self.string(nodes[position + 2 + 2 * i]) : self.value(nodes[position + 3 + 2 * i]) for i in range(nodes[position + 1])}
+        elif kind == INTEGER:
+            return self.section("integers", "q")[nodes[position + 1]]
+        elif kind == FLOAT:
+            return self.section("floats", "d")[nodes[position + 1]]
+        return None if kind == NULL else kind == TRUE
+
+    def records(self, key):
+        """
+        Returns the list of objects in the given member of the document (e.g. "scripture" or "context"), each read only when used.
+        They can be used wherever the decoded JSON objects would be.
+        """
+        root = self.section("root", "I")[0]
+        for i in range(self.nodes[root + 1] if self.nodes[root] == OBJECT else 0):
+            if self.string(self.nodes[root + 2 + 2 * i]) == key:
+                return RecordList(self, self.nodes[root + 3 + 2 * i])
+        raise KeyError(key)
+
+    def scriptureContexts(self):
+        return self.records(SCRIPTURE_KEY)
+
+    def passages(self):
+        """
+        Returns a PassageArray of every distinct passage of the scripture contexts, in the order they first appear.
+        Its columns are used where they lie in the file; only the scores and the books are in memory, and nothing can be
+        appended to it.
+        """
+        passages = PassageArray()
+        for name in ("start_chapters", "end_chapters", "start_verses", "end_verses"):
+            setattr(passages, name, self.section("passages." + name, "H"))
+        for name in ("start_ordinals", "end_ordinals"):
+            setattr(passages, name, self.section("passages." + name, "i"))
+        passages.osis = self.section("passages.osis", "b")
+        passages.reference_bytes = self.sections["passages.reference_bytes"]
+        passages.reference_offsets = self.section("passages.reference_offsets", "I")
+        # String id -> (canon position, spelling to keep) of each book name
+        books = {}
+        for name in ("start_books", "end_books"):
+            column = array("h")
+            spellings = {}
+            for (index, string_id) in enumerate(self.section("passages." + name, "I")):
+                if string_id not in books:
+                    book = self.string(string_id)
+                    book_id = bookId(book)
+                    books[string_id] = (book_id, bookSpelling(book, book_id))
+                (book_id, spelling) = books[string_id]
+                column.append(book_id)
+                if spelling is not None:
+                    spellings[index] = spelling
+            setattr(passages, name, column)
+            setattr(passages, name[:-1] + "_spellings", spellings)
+        passages.scores = array("d", bytes(8 * len(passages.start_ordinals)))
+        return passages
+
+    def scoreMap(self):
+        """
+        Returns a map of each passage reference to its `Passage` (a view of `passages()`), as given to the filters to score
+        """
+        return self.passages().toMap()
+
+    def index(self):
+        """
+        Returns a ContextIndex of the scripture contexts, whose postings are read from the corpus rather than built
+        """
+        return CorpusIndex(self)
+
+    def memberPostings(self, member):
+        # The postings of the given member, as a ContextIndex would build them, or None if they weren't compiled
+        if ("postings." + member + ".values") not in self.sections:
+            return None
+        values = self.section("postings." + member + ".values", "I")
+        offsets = self.section("postings." + member + ".offsets", "I")
+        passage_ids = self.section("postings." + member + ".passages", "I")
+        counts = self.section("postings." + member + ".counts", "I")
+        return {self.string(values[i]) : {self.string(passage_ids[j]) : counts[j] for j in range(offsets[i], offsets[i + 1])}
+                for i in range(len(values))}
+
+    def synonyms(self):
+        """
+        Returns a SynonymCache already knowing the similar words of every question type word of the scripture contexts
+        """
+        synonyms = SynonymCache(":memory:")
+        words = self.section("synonyms.words", "I")
+        offsets = self.section("synonyms.offsets", "I")
+        lemmas = self.section("synonyms.lemmas", "I")
+        synonyms.table = {self.string(words[i]) : frozenset(self.string(lemmas[j]) for j in range(offsets[i], offsets[i + 1]))
+                          for i in range(len(words))}
+        return synonyms
+
+class CorpusIndex(ContextIndex):
+    def __init__(self, corpus):
+        super().__init__(corpus.scriptureContexts())
+        self.corpus = corpus
+        self.compiled_count = len(self.scripture_contexts)
+
+    def memberPostings(self, key_name):
+        # Members which were compiled are read from the corpus the first time they are used (along with any scripture contexts
+        # added since); any other is indexed as usual
+        if key_name not in self.member_postings:
+            member_postings = self.corpus.memberPostings(key_name)
+            if member_postings is not None:
+                for scripture_context in self.scripture_contexts[self.compiled_count:]:
+                    self.addToMember(key_name, scripture_context, member_postings)
+                self.member_postings[key_name] = member_postings
+        return super().memberPostings(key_name)
@@ -1,29 +1,245 @@
 import json
 import requests
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import Canon
+from BookCatalog import BookCatalog
+from Catalog import Catalog
+from VerseCache import VerseCache
 
 # API key is expected to be set as an environment variable. It is only available for project members
 # Please contact project admin if you don't have it
-KEY = os.environ["DBP_KEY"]
+# It is only checked when the API is actually called, so that content served from the cache (or the stand-in server) doesn't need it
+KEY = os.environ.get("DBP_KEY")
+
+# The API can be pointed somewhere else (e.g. a local stand-in server, see tools/dbpstub.py) with the DBP_HOST environment variable
+API_HOST = os.environ.get("DBP_HOST", "https://4.dbt.io/api")
+
+# The most requests to have in flight to the API at once, across all managers
+MAX_CONCURRENCY = int(os.environ.get("DBP_CONCURRENCY", 8))
 
-API_HOST = "https://4.dbt.io/api"
+# Requests answered with one of these statuses are retried, backing off 0.5s, 1s, 2s, ... (or as long as the API asks with Retry-After)
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+MAX_RETRIES = 5
 
 class APIException(Exception): ...
 class ValidityException(Exception): ...
 
+# Shared by all managers that aren't given their own cache or catalog; only opened when first needed
+_default_cache = None
+_default_catalog = None
+_session = None
+_executor = None
+# Held while one of the above is created, so that threads asking for it at once all get the same one
+_defaults_lock = threading.Lock()
+
+# One manager per (language, version) pair for the whole process, see get_manager()
+_managers = {}
+_managers_lock = threading.Lock()
+
+def default_cache():
+    """
+    Returns the process-wide `VerseCache` used by managers that weren't given one, creating it if necessary
+    """
+
+    global _default_cache
+    if _default_cache is None:
+        with _defaults_lock:
+            if _default_cache is None:
+                _default_cache = VerseCache()
+    return _default_cache
+
+def default_catalog():
+    """
+    Returns the process-wide `Catalog` used by managers that weren't given one, creating it if necessary
+    """
+
+    global _default_catalog
+    if _default_catalog is None:
+        with _defaults_lock:
+            if _default_catalog is None:
+                _default_catalog = Catalog()
+    return _default_catalog
+
+def session():
+    """
+    Returns the process-wide HTTP session used for all API calls, creating it if necessary.
+    It keeps connections to the API open between calls, and retries with backoff when the API is busy or failing.
+    """
+
+    global _session
+    if _session is None:
+        with _defaults_lock:
+            if _session is None:
+                retry = Retry(total=MAX_RETRIES, backoff_factor=0.5, status_forcelist=RETRY_STATUSES, allowed_methods=["GET"],
+                              respect_retry_after_header=True, raise_on_status=False)
+                adapter = HTTPAdapter(pool_connections=MAX_CONCURRENCY, pool_maxsize=MAX_CONCURRENCY, max_retries=retry)
+                new_session = requests.Session()
+                new_session.mount("http://", adapter)
+                new_session.mount("https://", adapter)
+                # Only shared once it is set up, as other threads use it without taking the lock
+                _session = new_session
+    return _session
+
+def executor():
+    """
+    Returns the process-wide thread pool that API calls are made concurrently on, creating it if necessary
+    """
+
+    global _executor
+    if _executor is None:
+        with _defaults_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="dbp")
+    return _executor
+
+def book_key(book : str):
+    """
+    Returns the id a book is stored under in the cache: its USFM id (as the DBP names books) if it is recognised, so that "John",
+    "Jn" and "JHN" all share the same chapters
+    """
+
+    index = Canon.bookIndex(book)
+    return Canon.USFM_IDS[index] if index >= 0 else book
+
+class RateLimiter:
+    def __init__(self, rate : float):
+        """
+        Spaces out calls (across all threads) so that no more than `rate` start each second
+        """
+
+        self.interval = 1 / rate
+        self.next_start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+def get_manager(lang : str, version : str):
+    """
+    Returns the shared `DBPManager` for the given language and version, creating it the first time it is asked for.
+    Like any `DBPManager`, it isn't validated until it is first used, so calling this costs nothing up front.
+
+    Example
+    -------
+    get_manager("ENG", "ESV")
+        Returns the manager for the English Standard Version in English, the same one every time
+    """
+
+    key = (lang, version)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = DBPManager(lang, version)
+            _managers[key] = manager
+    return manager
+
+def fetch_chapters(needed):
+    """
+    Returns every verse of each of the given chapters, which can be from any number of managers (i.e. translations). Chapters in a
+    manager's cache are read straight away; all of the others are requested from the API at the same time, so they take about as
+    long as the slowest one. Each chapter is only looked up once, however many times it is given.
+
+    Parameters
+    ----------
+    `needed` : `list` : `[(DBPManager, str, int)]`
+        The (manager, book, chapter) of each chapter
+
+    Returns
+    -------
+    `dict`
+        (manager, book, chapter) -> the (verse number, verse text) pairs of the chapter
+    """
+
+    chapters = {}
+    missing = []
+    for key in set(needed):
+        (manager, book, chapter) = key
+        verses = manager.cache.get_chapter(manager.lang + manager.version, book_key(book), chapter)
+        if verses is None:
+            missing.append(key)
+        else:
+            chapters[key] = verses
+    chapters.update(zip(missing, executor().map(lambda key: key[0].store_chapter(key[0].lang + key[0].version, key[1], key[2]), missing)))
+    return chapters
+
+def verses_in_range(verses, verse_begin, verse_end):
+    # The (verse number, verse text) pairs of a chapter from the first verse to the last (or to the end of the chapter, if it is -1)
+    return [(verse_num, verse_text) for (verse_num, verse_text) in verses if verse_num >= verse_begin and (verse_end == -1 or verse_num <= verse_end)]
+
+def aligned_passages(managers, passages):
+    """
+    Retrieves the text of several passages from several managers (e.g. one per translation) at once, side by side. Every chapter
+    needed from every manager is requested concurrently (see `fetch_chapters()`), so any number of translations take about as long
+    as one, and chapters already cached aren't requested at all.
+
+    Verses are lined up by their number. Translations don't all number their verses the same way (some leave out verses that
+    others have), so where a translation doesn't have a verse that another one does, its text for that verse is `None`.
+
+    Parameters
+    ----------
+    `managers` : `list`
+        The `DBPManager` of each translation
+    `passages` : `list`
+        Each passage is a tuple of the same arguments taken by `DBPManager.passage()`, as given to `passages_many()`
+
+    Raises
+    ------
+    ValidityException if the language or version of any manager is invalid (checked the first time only)
+    APIException if calling the applicable endpoint(s) returns a failing status code, or the returned format is unexepcted
+
+    Returns
+    -------
+    `list`
+        For each passage, in the same order as given, a list of `(chapter, verse, texts)` for every verse any translation has,
+        in order, where `texts` holds the text of that verse in each translation (in the same order as `managers`)
+    """
+
+    # Validating each manager, and reading its book catalog if needed, are done at the same time too
+    manager_ranges = list(executor().map(lambda manager: manager.passage_ranges(passages), managers))
+    chapters = fetch_chapters([(manager, book, chapter_num) for (manager, passage_ranges) in zip(managers, manager_ranges)
+                                                            for ranges in passage_ranges for (book, chapter_num, _, _) in ranges])
+    results = []
+    for i in range(len(passages)):
+        # (chapter, verse) -> the text in each translation
+        rows = {}
+        for (column, (manager, passage_ranges)) in enumerate(zip(managers, manager_ranges)):
+            for (book, chapter_num, verse_begin, verse_end) in passage_ranges[i]:
+                for (verse_num, verse_text) in verses_in_range(chapters[(manager, book, chapter_num)], verse_begin, verse_end):
+                    row = rows.get((chapter_num, verse_num))
+                    if row is None:
+                        row = rows[(chapter_num, verse_num)] = [None] * len(managers)
+                    row[column] = verse_text
+        results.append([(chapter_num, verse_num, rows[(chapter_num, verse_num)]) for (chapter_num, verse_num) in sorted(rows)])
+    return results
+
 class DBPManager:
-    def __init__(self, lang : str, version : str):
+    def __init__(self, lang : str, version : str, cache : VerseCache = None, catalog : Catalog = None):
         """
+        Creating a manager doesn't call the API. The language and version are validated the first time content is requested
+        (or when `validate()` is called), using the `Catalog` so that the API only needs to be paged through when the catalog
+        is missing or out of date. Prefer `get_manager()`, which shares one manager per language and version.
+
         Parameters
         ----------
         lang : str
             The ISO language code to use for the Bible content retrieved; should be 3 characters long
         version : str
             The translation/version code to use for the Bible content retrieved; should be 3 characters long
-        
-        Raises
-        ------
-        ValidityException if either the language or version given are invalid, or there was an error validating them
+        [cache : VerseCache]
+            Where retrieved chapters are remembered, so they are only fetched from the API once. If not given, the shared default cache is used.
+        [catalog : Catalog]
+            Where the supported languages and versions are remembered. If not given, the shared default catalog is used.
 
         Example
         -------
@@ -31,21 +247,59 @@ class DBPManager:
             This creates a manager for the English Standard Version in English  
         """
 
-        try:
-            if self.verify_language(lang):
-                self.lang = lang
-        except APIException as e:
-            raise ValidityException("Could not find language id " + lang + " in supported list. Please check language ISO code. " + str(e))
+        self.lang = lang
+        self.version = version
+        self.cache = cache if cache is not None else default_cache()
+        self.catalog = catalog if catalog is not None else default_catalog()
+        self.validated = False
+        self.validation_lock = threading.Lock()
+        # FilesetID -> BookCatalog, once it has been read from the cache or the API
+        self.book_catalogs = {}
+        self.book_catalog_lock = threading.Lock()
+
+    def validate(self):
+        """
+        Checks that this manager's language and version exist on the DBP. This only happens once per manager.
+
+        Raises
+        ------
+        ValidityException if either the language or version given are invalid, or there was an error validating them
+        """
+
+        if self.validated:
+            return
+        with self.validation_lock:
+            if self.validated:
+                return
 
-        try:
-            if self.verify_version(version):
-                self.version = version
-        except APIException as e:
-            raise ValidityException("Could not find translation/vbersion " + version + " for language " + self.lang + ". " + str(e))
+            # A fileset stored whole is known to exist, and is served without the API
+            if self.cache.is_mirrored(self.lang + self.version):
+                self.validated = True
+                return
+
+            try:
+                found = self.verify_language(self.lang)
+            except APIException as e:
+                raise ValidityException("Could not find language id " + self.lang + " in supported list. Please check language ISO code. " + str(e))
+            if not found:
+                raise ValidityException("Could not find language id " + self.lang + " in supported list. Please check language ISO code.")
+
+            try:
+                found = self.verify_version(self.version)
+            except APIException as e:
+                raise ValidityException("Could not find translation/vbersion " + self.version + " for language " + self.lang + ". " + str(e))
+            if not found:
+                raise ValidityException("Could not find translation/vbersion " + self.version + " for language " + self.lang + ".")
+
+            self.validated = True
 
     def std_params(self):
         """
         Returns the parameter values that must be included in every call to the DBP API
+
+        Raises
+        ------
+        APIException if there is no API key in the environment
         
         Returns
         -------
@@ -53,6 +307,8 @@ class DBPManager:
             Object with the necessary API request parameters
         """
 
+        if KEY is None:
+            raise APIException("Error: no API key; please set the DBP_KEY environment variable")
         params = { "v"   : 4,
                    "key" : KEY
                  }
@@ -60,7 +316,8 @@ class DBPManager:
 
     def verify_language(self, lang : str):
         """
-        Verifies that the given language code is one for which the DBP has content
+        Verifies that the given language code is one for which the DBP has content.
+        The catalog is consulted first, and only refreshed from the API if it doesn't have an up to date list of languages.
 
         Parameters
         ----------
@@ -76,12 +333,33 @@ class DBPManager:
         True if content for the given language can be found on the DBP, False otherwise
         """
 
+        languages = self.catalog.languages()
+        if languages is None:
+            languages = self.fetch_languages()
+            self.catalog.set_languages(languages)
+        return lang.lower() in languages
+
+    def fetch_languages(self):
+        """
+        Pages through the languages endpoint of the API
+
+        Raises
+        ------
+        APIException if calling the applicable endpoint(s) returns a failing status code, or the returned format is unexepcted
+
+        Returns
+        -------
+        set
+            The ISO codes of all languages for which the DBP has content
+        """
+
+        languages = set()
         max_page = -1
         page = 1
         while page <= max_page or max_page == -1:
             parameters = {"limit": 150, "page": page}
             parameters.update(self.std_params())
-            response = requests.get(os.path.join(API_HOST, "languages"), params=parameters)
+            response = session().get(os.path.join(API_HOST, "languages"), params=parameters)
             if response.status_code == 200:
                 try:
                     response_json = response.json()
@@ -91,24 +369,21 @@ class DBPManager:
                     if max_page == -1:
                         max_page = meta_data["pagination"]["total_pages"]
 
-                    # Go through each language and see if the ISO codes match
                     for language in lang_data:
-                        if language["iso"] == lang.lower():
-                            return True
+                        languages.add(language["iso"])
 
-                    # If we get here, the language id was not found yet, so go to the next page
                     page += 1
                 except Exception as e:
                     raise APIException("Error: Response to " + response.url + " has unexpected format: " + json.dumps(response.json()) + " | " + str(e))
             else:
                 raise APIException("Error: " + str(response.status_code) + " when retrieving languages with " + response.url)
-        # If we end up here then we never found the ISO code
-        return False
+        return languages
 
     def verify_version(self, version : str):
         """
         Verifies that there is content in the expected language for the given translation/version identifier.
-        This assumes that the language for this manager has already been verified
+        This assumes that the language for this manager has already been verified.
+        The catalog is consulted first, and only refreshed from the API if it doesn't have an up to date list of filesetIDs for the language.
 
         Parameters
         ----------
@@ -124,13 +399,33 @@ class DBPManager:
         True if a filesetID can be found that combines the expected language and the given version, False otherwise
         """
 
+        fileset_ids = self.catalog.filesets(self.lang)
+        if fileset_ids is None:
+            fileset_ids = self.fetch_filesets(self.lang)
+            self.catalog.set_filesets(self.lang, fileset_ids)
+        return self.lang + version in fileset_ids
+
+    def fetch_filesets(self, lang : str):
+        """
+        Pages through the Bibles endpoint of the API for the given language
+
+        Raises
+        ------
+        APIException if calling the applicable endpoint(s) returns a failing status code, or the returned format is unexepcted
+
+        Returns
+        -------
+        set
+            The plain text filesetIDs of all Bibles in the given language
+        """
+
+        fileset_ids = set()
         max_page = -1
         page = 1
-        fileset_id = self.lang + version
         while page <= max_page or max_page == -1:
-            parameters = {"language_code": self.lang, "media": "text_plain", "limit": 150, "page": page}
+            parameters = {"language_code": lang, "media": "text_plain", "limit": 150, "page": page}
             parameters.update(self.std_params())
-            response = requests.get(os.path.join(API_HOST, "bibles"), params=parameters)
+            response = session().get(os.path.join(API_HOST, "bibles"), params=parameters)
             if response.status_code == 200:
                 try:
                     response_json = response.json()
@@ -140,27 +435,24 @@ class DBPManager:
                     if max_page == -1:
                         max_page = meta_data["pagination"]["last_page"]
 
-                    # Go through each Bible and its variants, looking for a filesetID that matches our expected one
+                    # Collect the filesetIDs of each Bible and its variants
                     # Since we're only asking for plain text there will probably just be one variant for each Bible
                     for version in versions_data:
                         # There is also "dbp-vid", but that's only for video, so it won't be here cause we're only asking for text
                         variants_data = version["filesets"]["dbp-prod"]
                         for variant in variants_data:
-                            if variant["id"] == fileset_id:
-                                return True
+                            fileset_ids.add(variant["id"])
 
-                    # If we get here, the filesetID was not found yet, so go to the next page
                     page += 1
                 except Exception as e:
                     raise APIException("Error: Response to " + response.url + " has unexpected format: " + json.dumps(response.json()) + " | " + str(e))
             else:
                 raise APIException("Error: " + str(response.status_code) + " when retrieving versions with " + response.url)
-        # If we end up here then we never found the filesetID
-        return False
+        return fileset_ids
 
     def get_book_info(self, fileset_id, book):
         """
-        Queries the API for the given book in the given filesetID, and returns the associated data.
+        Returns the data about the given book in the given filesetID, from the fileset's `book_catalog()`.
         This data contains the following kind of information about the book:
             - Full and abbreviated names
             - Which Testament it is included in
@@ -185,23 +477,201 @@ class DBPManager:
             Object containing information about the number of chapters, verses, and the location of this book in the Bible
         """
 
-        parameters = {"book_id" : book, "verify_content": True, "verse_count": True}
+        info = self.book_catalog(fileset_id).book(book)
+        if info is None:
+            raise APIException("Error: no book " + book + " in " + fileset_id)
+        return info
+
+    def book_catalog(self, fileset_id):
+        """
+        Returns the `BookCatalog` of the given filesetID: the order, testament, chapters and verse counts of all of its books.
+        It is fetched from the API in one request the first time it is needed, and kept in the cache, so it is only ever fetched once.
+
+        Raises
+        ------
+        APIException if calling the applicable endpoint(s) returns a failing status code, or the returned format is unexepcted
+        """
+
+        catalog = self.book_catalogs.get(fileset_id)
+        if catalog is None:
+            with self.book_catalog_lock:
+                catalog = self.book_catalogs.get(fileset_id)
+                if catalog is None:
+                    books = self.cache.get_book_catalog(fileset_id)
+                    if books is None:
+                        books = self.fetch_book_catalog(fileset_id)
+                        self.cache.put_book_catalog(fileset_id, books)
+                    catalog = self.book_catalogs[fileset_id] = BookCatalog(books)
+        return catalog
+
+    def fetch_book_catalog(self, fileset_id):
+        """
+        Queries the API for the data about every book in the given filesetID (see `get_book_info()`), bypassing the cache
+
+        Returns
+        -------
+        list
+            The data about each book, in the fileset's order
+        """
+
+        parameters = {"verify_content": True, "verse_count": True}
         parameters.update(self.std_params())
-        response = requests.get(os.path.join(API_HOST, fileset_id, "book"), params=parameters)
+        response = session().get(os.path.join(API_HOST, fileset_id, "book"), params=parameters)
         if response.status_code == 200:
             try:
-                return response.json()["data"][0]
+                books = response.json()["data"]
+                if any("book_id" not in book_data or "chapters" not in book_data for book_data in books):
+                    raise Exception("a book has no id or chapters")
+                return books
             except Exception as e:
                 raise APIException("Error: Response to " + response.url + " has unexpected format: " + json.dumps(response.json()) + " | " + str(e))
         else:
             raise APIException("Error: " + str(response.status_code) + " when retrieving book info with " + response.url)
 
+    def fetch_chapter(self, fileset_id, book, chapter):
+        """
+        Queries the API for every verse of the given chapter, bypassing the cache
+
+        Raises
+        ------
+        APIException if calling the applicable endpoint(s) returns a failing status code, or the returned format is unexepcted
+
+        Returns
+        -------
+        `list` : `[(int, str)]`
+            The (verse number, verse text) pairs of the chapter
+        """
+
+        response = session().get(os.path.join(API_HOST, "bibles/filesets", fileset_id, book, str(chapter)), params=self.std_params())
+        if response.status_code == 200:
+            try:
+                verses = []
+                for verse in response.json()["data"]:
+                    verses.append((int(verse["verse_start"]), verse["verse_text"].strip()))
+                return verses
+            except Exception as e:
+                raise APIException("Error: Response to " + response.url + " has unexpected format: " + json.dumps(response.json()) + " | " + str(e))
+        else:
+            raise APIException("Error: " + str(response.status_code) + " when retrieving verses with " + response.url)
+
+    def store_chapter(self, fileset_id, book, chapter):
+        """
+        Fetches every verse of the given chapter from the API and caches it, returning the (verse number, verse text) pairs
+        """
+
+        verses = self.fetch_chapter(fileset_id, book, chapter)
+        self.cache.put_chapter(fileset_id, book_key(book), chapter, verses)
+        return verses
+
+    def prefetch(self, books = None, rate : float = None, progress = None):
+        """
+        Fills the cache with the whole content of this manager's fileset (or just the given books), so that later
+        passages can be served without calling the API. Chapters are fetched concurrently, in the same way as by `mirror()`, and
+        those which are already cached are not fetched again, so one that was interrupted (or partly failed) is resumed by calling
+        this again. Unlike `mirror()`, the fileset is still validated before being served, and its chapters can be evicted.
+
+        Parameters
+        ----------
+        [`books` : `list`]
+            The books to fetch (by any name Canon recognises, or their ids). If not given, every book in the fileset is fetched.
+        [`rate` : `float`]
+            The most requests to start each second, to stay under the API's rate limit. If not given, requests aren't spaced out.
+        [`progress` : `function`]
+            Called with (chapters stored, total chapters) after each chapter is stored
+
+        Raises
+        ------
+        ValidityException if this manager's language or version are invalid
+        APIException if the catalog of books can't be retrieved
+
+        Returns
+        -------
+        `dict`
+            The number of chapters asked for, how many had to be fetched, and the (book, chapter, error) of each that couldn't be
+        """
+
+        self.validate()
+        fileset_id = self.lang + self.version
+        wanted = set(book_key(book) for book in books) if books is not None else None
+        chapters = [(book_data["book_id"], chapter) for book_data in self.book_catalog(fileset_id).books
+                                                    if wanted is None or book_key(book_data["book_id"]) in wanted
+                                                    for chapter in book_data["chapters"]]
+        return self.store_chapters(fileset_id, chapters, rate, progress)
+
+    def mirror(self, rate : float = None, progress = None):
+        """
+        Stores the whole of this manager's fileset (every chapter of every book, and the information about each book) in its cache,
+        so that from then on it is served without calling the API at all, not even to validate the language and version.
+        A mirrored fileset is never evicted from the cache.
+
+        Chapters are fetched as by `prefetch()`, so an interrupted (or partly failed) mirror is resumed by calling this again.
+
+        Parameters
+        ----------
+        [`rate` : `float`]
+            The most requests to start each second, to stay under the API's rate limit. If not given, requests aren't spaced out.
+        [`progress` : `function`]
+            Called with (chapters stored, total chapters) after each chapter is stored
+
+        Raises
+        ------
+        ValidityException if this manager's language or version are invalid
+        APIException if the catalog of books can't be retrieved
+
+        Returns
+        -------
+        `dict`
+            What `prefetch()` returns, for the whole fileset. The fileset is only counted as mirrored (and served without validation)
+            once nothing failed.
+        """
+
+        self.validate()
+        fileset_id = self.lang + self.version
+        if self.cache.is_mirrored(fileset_id):
+            return {"chapters" : self.cache.chapter_count(fileset_id), "fetched" : 0, "failed" : []}
+        self.cache.start_mirror(fileset_id)
+        result = self.prefetch(rate=rate, progress=progress)
+        if len(result["failed"]) == 0:
+            self.cache.finish_mirror(fileset_id)
+        return result
+
+    def store_chapters(self, fileset_id, chapters, rate : float = None, progress = None):
+        """
+        Fetches each of the given (book, chapter) that isn't cached yet and caches it. Chapters are fetched concurrently (as many at
+        once as `DBP_CONCURRENCY`), and requests the API turns away for being too many are retried after the time it asks for.
+        Chapters that fail are recorded rather than stopping the others. See `prefetch()` for the parameters and result.
+        """
+
+        limiter = RateLimiter(rate) if rate else None
+        missing = [(book, chapter) for (book, chapter) in chapters if not self.cache.has_chapter(fileset_id, book_key(book), chapter)]
+        failed = []
+        stored = [len(chapters) - len(missing)]
+        lock = threading.Lock()
+
+        def store(book, chapter):
+            if limiter is not None:
+                limiter.wait()
+            try:
+                self.store_chapter(fileset_id, book, chapter)
+            except APIException as e:
+                with lock:
+                    failed.append((book, chapter, str(e)))
+                return
+            with lock:
+                stored[0] += 1
+                if progress is not None:
+                    progress(stored[0], len(chapters))
+
+        list(executor().map(lambda needed: store(*needed), missing))
+        return {"chapters" : len(chapters), "fetched" : len(missing) - len(failed), "failed" : failed}
+
     def passage(self, book, chapter_start = 1, chapter_finish = None, verse_start = None, verse_finish = None):
         """
         The main workhorse of the DBPManager. Retrieves the text of the given passage.
         A passage can be any length of content within a single book.
         For instance: a single verse, a range of verses in a chapter, a whole chapter, part of one chapter and part of the next, etc., up to
         the entire book.
+        Chapters are always retrieved whole and kept in the manager's `VerseCache`, so asking again for any part of them doesn't call the API.
 
         Parameters
         ----------
@@ -216,6 +686,11 @@ class DBPManager:
         `verse_end` : `int`
             The verse within the ending chapter ('chapter_finish') where the passage ends
 
+        Raises
+        ------
+        ValidityException if this manager's language or version are invalid (checked the first time only)
+        APIException if calling the applicable endpoint(s) returns a failing status code, or the returned format is unexepcted
+
         Returns
         -------
         `tuple` : `(str, [])`
@@ -235,77 +710,116 @@ class DBPManager:
         - `passage("John")` returns the whole text of John (the entire book)
         """
 
-        text = ""
-        book_list = []
-        book_info = None
-
-        # Internal helper function to return the last verse of a given chapter in the retrieved book data
-        def last_verse_in_chapter(chapter : int) -> int:
-            return book_info["verses_count"][chapter - 1]["verses"]
-
-        try:
-            # FilesetID for text-only content is just the language id with the translation appended
-            fileset_id = self.lang + self.version
-
-            # Find the last chapter in this book if necessary
-            if chapter_finish is None:
-                book_info = self.get_book_info(fileset_id, book)
-                chapter_finish = len(self.book_info["chapters"])
-
-            # The first verse of the first chapter and the last verse of the last chapter
-            if verse_start is None:
-                verse_start = 1
-            if verse_finish is None:
-                if book_info is None:
-                    book_info = self.get_book_info(fileset_id, book)
-                verse_finish = last_verse_in_chapter(chapter_finish)
-
-            chapter_num = chapter_start
-            # For each chapter, get all verses needed
-            while chapter_num <= chapter_finish:
-                # Determine the beginning and ending verses in this particular chapter
-                verse_begin = 1
-                verse_end = -1
-                if chapter_num == chapter_start:
-                    verse_begin = verse_start
-                if chapter_num == chapter_finish:
-                    verse_end = verse_finish
-
-                # If we're getting a whole book or the remainder of a book
-                if chapter_num >= chapter_start and chapter_num < chapter_finish:
-                    if book_info is None:
-                        book_info = self.get_book_info(fileset_id, book)
-                    verse_end = last_verse_in_chapter(chapter_num)
-                
-                # Query for the actual verse(s) in this chapter and verse range
-                parameters = {"verse_start" : verse_begin, "verse_end" : verse_end}
-                parameters.update(self.std_params())
-                response = requests.get(os.path.join(API_HOST, "bibles/filesets", fileset_id, book, str(chapter_num)), params=parameters)
-
-                # If the query was successful, get all the verse text together
-                chapter_text = ""
-                chapter_list = []
-                if response.status_code == 200:
-                    try:
-                        verses_info = response.json()["data"]
-                        for verse in verses_info:
-                            verse_text = verse["verse_text"].strip()
-                            chapter_text += verse_text + " "
-                            chapter_list.append(verse_text)
-                    except Exception as e:
-                        raise APIException("Error: Response to " + response.url + " has unexpected format: " + json.dumps(response.json()) + " | " + str(e))
-                else:
-                    raise APIException("Error: " + str(response.status_code) + " when retrieving verses with " + response.url)
-                
+        return self.passages_many([(book, chapter_start, chapter_finish, verse_start, verse_finish)])[0]
+
+    def passages_many(self, passages):
+        """
+        Retrieves the text of several passages at once. Every chapter needed by any of the passages is requested concurrently,
+        so the whole set takes about as long as the slowest single request rather than the sum of them all. Chapters shared by
+        several passages are only fetched once. Where a passage runs to the end of its book, the last chapter comes from the
+        fileset's `book_catalog()`, so only chapter text is ever requested once the catalog has been stored.
+
+        Parameters
+        ----------
+        `passages` : `list`
+            Each passage is a tuple of the same arguments taken by `passage()`, i.e. (book, chapter_start, chapter_finish, verse_start, verse_finish).
+            Trailing elements can be left out, in which case they take the same defaults as in `passage()`.
+
+        Raises
+        ------
+        ValidityException if this manager's language or version are invalid (checked the first time only)
+        APIException if calling the applicable endpoint(s) returns a failing status code, or the returned format is unexepcted
+
+        Returns
+        -------
+        `list`
+            For each passage, in the same order as given, the same `(str, [])` tuple returned by `passage()`
+
+        Example
+        -------
+        `passages_many([("John", 3, 3, 16, 18), ("Rom", 8, 8, 28, 28)])` returns the text of John 3:16-18 and Romans 8:28
+        """
+
+        passage_ranges = self.passage_ranges(passages)
+        chapters = fetch_chapters([(self, book, chapter_num) for ranges in passage_ranges for (book, chapter_num, _, _) in ranges])
+
+        results = []
+        for ranges in passage_ranges:
+            text = ""
+            book_list = []
+            for (book, chapter_num, verse_begin, verse_end) in ranges:
+                # Keep just the verse(s) in range from the whole chapter
+                chapter_list = [verse_text for (_, verse_text) in verses_in_range(chapters[(self, book, chapter_num)], verse_begin, verse_end)]
+
                 # Add the chapter text to the whole
-                text += chapter_text
+                text += "".join(verse_text + " " for verse_text in chapter_list)
                 book_list.append(chapter_list)
-                
-                # Go to next chapter
-                chapter_num += 1
-        except Exception as e:
-            # Rethrow the exception
-            raise e
-
-        # Return the whole text of the passage, as well as the array containing the same text
-        return (text.strip(), book_list)
+
+            # The whole text of the passage, as well as the array containing the same text
+            results.append((text.strip(), book_list))
+        return results
+
+    def passage_ranges(self, passages):
+        """
+        Validates this manager (the first time only), then splits each of the given passages into the range of verses needed from
+        each of its chapters
+
+        Parameters
+        ----------
+        `passages` : `list`
+            Each passage is a tuple of the same arguments taken by `passage()`, as given to `passages_many()`
+
+        Returns
+        -------
+        `list`
+            For each passage, in the same order as given, the ranges returned by `chapter_ranges()`
+        """
+
+        self.validate()
+
+        # FilesetID for text-only content is just the language id with the translation appended
+        fileset_id = self.lang + self.version
+        passages = [tuple(passage) + (1, None, None, None)[len(passage) - 1:] for passage in passages]
+
+        # Passages running to the end of their book need to know its last chapter, from the catalog (fetched at most once, ever)
+        book_catalog = self.book_catalog(fileset_id) if any(passage[2] is None for passage in passages) else None
+        return [self.chapter_ranges(passage, book_catalog) for passage in passages]
+
+    def chapter_ranges(self, passage, book_catalog):
+        """
+        Splits the given passage into the range of verses needed from each of its chapters
+
+        Parameters
+        ----------
+        `passage` : `tuple`
+            (book, chapter_start, chapter_finish, verse_start, verse_finish), as taken by `passage()`
+        `book_catalog` : `BookCatalog`
+            The catalog of the fileset's books, needed if `chapter_finish` is `None`
+
+        Returns
+        -------
+        `list` : `[(str, int, int, int)]`
+            For each chapter, (book, chapter, first verse, last verse), where a last verse of -1 means the end of the chapter
+        """
+
+        (book, chapter_start, chapter_finish, verse_start, verse_finish) = passage
+
+        # Find the last chapter in this book if necessary
+        if chapter_finish is None:
+            chapter_finish = book_catalog.chapterCount(book)
+            if chapter_finish == 0:
+                raise APIException("Error: no book " + book + " in " + self.lang + self.version)
+
+        # The first verse of the first chapter and the last verse of the last chapter.
+        # Since chapters are always retrieved whole, running to the end of a chapter doesn't need its verse count
+        if verse_start is None:
+            verse_start = 1
+        if verse_finish is None:
+            verse_finish = -1
+
+        ranges = []
+        for chapter_num in range(chapter_start, chapter_finish + 1):
+            verse_begin = verse_start if chapter_num == chapter_start else 1
+            verse_end = verse_finish if chapter_num == chapter_finish else -1
+            ranges.append((book, chapter_num, verse_begin, verse_end))
+        return ranges
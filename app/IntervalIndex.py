@@ -0,0 +1,70 @@
+# -----
+# Interval Index
+# Finds which passages contain, or overlap, a given range of verses in logarithmic time, rather than by checking every passage.
+#
+# Passages are kept as (start ordinal, end ordinal) intervals (see Canon), sorted by start, and arranged as an implicit balanced
+# binary tree over that sorted list: the middle interval of any range is the node, the halves on either side are its subtrees.
+# Each node also records the largest end ordinal in its subtree, so whole subtrees which end before the searched range are skipped.
+# -----
+
+class IntervalIndex:
+    def __init__(self, passages):
+        """
+        Builds the index over the given passages. Passages whose books or chapters aren't recognised can't be placed, so are left out.
+
+        Parameters
+        ----------
+        `passages` : `iterable`
+            The `Passage`s to index
+        """
+        self.passages = sorted((passage for passage in passages if passage.resolved()), key=lambda passage: (passage.startOrdinal, passage.endOrdinal))
+        self.starts = [passage.startOrdinal for passage in self.passages]
+        self.ends = [passage.endOrdinal for passage in self.passages]
+        self.max_ends = list(self.ends)
+        self.buildMaxEnds(0, len(self.starts))
+
+    def buildMaxEnds(self, low, high):
+        # Fill in the largest end in the subtree rooted at the middle of [low, high), and return it
+        if low >= high:
+            return -1
+        middle = (low + high) // 2
+        self.max_ends[middle] = max(self.ends[middle], self.buildMaxEnds(low, middle), self.buildMaxEnds(middle + 1, high))
+        return self.max_ends[middle]
+
+    def __len__(self):
+        return len(self.passages)
+
+    def overlapping(self, start, end):
+        """
+        Returns every indexed passage having at least one verse between the given start and end ordinals (inclusive), in canonical order
+        """
+        found = []
+        self.search(0, len(self.starts), start, end, found)
+        return found
+
+    def search(self, low, high, start, end, found):
+        if low >= high:
+            return
+        middle = (low + high) // 2
+        # Nothing in this subtree reaches the searched range
+        if self.max_ends[middle] < start:
+            return
+        self.search(low, middle, start, end, found)
+        # Everything from here on starts after the searched range
+        if self.starts[middle] > end:
+            return
+        if self.ends[middle] >= start:
+            found.append(self.passages[middle])
+        self.search(middle + 1, high, start, end, found)
+
+    def containing(self, start, end):
+        """
+        Returns every indexed passage which includes all the verses between the given start and end ordinals (inclusive)
+        """
+        return [passage for passage in self.overlapping(start, start) if passage.endOrdinal >= end]
+
+    def within(self, start, end):
+        """
+        Returns every indexed passage which lies entirely between the given start and end ordinals (inclusive)
+        """
+        return [passage for passage in self.overlapping(start, end) if passage.startOrdinal >= start and passage.endOrdinal <= end]
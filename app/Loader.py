@@ -0,0 +1,259 @@
+import json
+import sys
+
+from ContextIndex import ContextIndex
+from PassageArray import PassageArray
+from filters import OSIS_REFERENCE
+
+# -----
+# Loader
+# Reads the entries of a data file one at a time, rather than decoding the whole file at once like `Utils.readJson`, so files far
+# larger than memory can be loaded. Two layouts are understood:
+#   - JSON, with the entries in a list member of the top-level object, like Scriptures.json ({"scripture": [...]}) and
+#     Contexts.json ({"context": [...]})
+#   - JSON Lines (a file ending in .jsonl), with one entry per line
+#
+# Each entry is checked against the members the filters expect of it (see SCHEMAS), so a bad entry is reported where it is,
+# instead of failing somewhere in a filter later. `streamIndex()` builds a ContextIndex (and the passages to score) straight from
+# the entries, so only the index is ever held, never the entries themselves.
+# -----
+
+class LoaderException(Exception): ...
+
+CHUNK_SIZE = 1 << 16
+
+# The members of scripture contexts indexed by `streamIndex()`: those compared by the simple comparison filters
+INDEXED_MEMBERS = ("people", "places", "actions", "questions")
+
+def isString(value):
+    return type(value) == str
+
+def isStringList(value):
+    return type(value) == list and all(type(item) == str for item in value)
+
+def isStringOrList(value):
+    return isString(value) or isStringList(value)
+
+def isQuestionType(value):
+    return type(value) == dict and isString(value.get("type")) and isStringOrList(value.get("subject")) and isStringOrList(value.get("action"))
+
+def isQuestionTypeList(value):
+    return type(value) == list and all(isQuestionType(item) for item in value)
+
+def isOsisReference(value):
+    # Surrounding spaces are tolerated, as they are everywhere else references are read
+    return isString(value) and OSIS_REFERENCE.match(value.strip()) is not None
+
+def oneOf(*allowed):
+    return lambda value: value in allowed
+
+# Member -> (check, what the check expects), for each kind of entry, named after the list they are found in
+SCRIPTURE_SCHEMA = {
+    "passage" : (isOsisReference, "an OSIS reference"),
+    "scripture-section" : (oneOf("OT", "NT"), "\"OT\" or \"NT\""),
+    "questions" : (isStringList, "a list of strings"),
+    "question-types" : (isQuestionTypeList, "a list of question types"),
+    "people" : (isStringList, "a list of strings"),
+    "places" : (isStringList, "a list of strings"),
+    "actions" : (isStringList, "a list of strings")
+}
+
+CONTEXT_SCHEMA = {
+    "question-text" : (isString, "a string"),
+    "signficant-words" : (isStringList, "a list of strings"),
+    "scripture-section" : (oneOf("OT", "NT", "Both", "Neither"), "\"OT\", \"NT\", \"Both\" or \"Neither\""),
+    "people" : (isStringList, "a list of strings"),
+    "places" : (isStringList, "a list of strings"),
+    "actions" : (isStringList, "a list of strings"),
+    "question-type" : (isQuestionType, "a question type"),
+    "verse-in-the-question" : (isStringOrList, "a string or a list of strings")
+}
+
+SCHEMAS = {
+    "scripture" : SCRIPTURE_SCHEMA,
+    "context" : CONTEXT_SCHEMA
+}
+
+def validate(entry, schema):
+    """
+    Raises a LoaderException describing the first member of the given entry which isn't what the schema expects, if there is one
+    """
+    if type(entry) != dict:
+        raise LoaderException("Entry is not an object")
+    for (member, (check, expected)) in schema.items():
+        if member not in entry:
+            raise LoaderException("Missing \"" + member + "\"")
+        if not check(entry[member]):
+            raise LoaderException("\"" + member + "\" should be " + expected + ", not " + json.dumps(entry[member])[:80])
+
+class JsonStream:
+    def __init__(self, handle, chunk_size = CHUNK_SIZE):
+        # Decodes JSON values one at a time from the given text file, holding no more than a chunk (or one value) of it at once
+        self.handle = handle
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def read(self):
+        # Adds the next chunk of the file to the buffer, dropping what has already been decoded. Returns False at the end of the file
+        if self.eof:
+            return False
+        chunk = self.handle.read(self.chunk_size)
+        if chunk == "":
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self):
+        # The next character which isn't whitespace (without consuming it), or "" at the end of the file
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position].isspace():
+                self.position += 1
+            if self.position < len(self.buffer) or not self.read():
+                return self.buffer[self.position:self.position + 1]
+
+    def expect(self, characters):
+        character = self.peek()
+        if character == "" or character not in characters:
+            raise LoaderException("Expected one of " + json.dumps(characters) + " but found " + json.dumps(character or "the end of the file"))
+        self.position += 1
+        return character
+
+    def value(self):
+        # Decodes the next whole value, reading more of the file until it is complete
+        self.peek()
+        while True:
+            try:
+                (value, end) = self.decoder.raw_decode(self.buffer, self.position)
+                # A number at the very end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise LoaderException("Invalid JSON: " + str(e))
+            self.read()
+
+    def items(self, key):
+        """
+        Yields each item of the list in the given member of the top-level object (or of the first list member, if `key` is None)
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            return
+        while True:
+            name = self.value()
+            self.expect(":")
+            if (key is None or name == key) and self.peek() == "[":
+                self.expect("[")
+                if self.peek() != "]":
+                    while True:
+                        yield self.value()
+                        if self.expect(",]") == "]":
+                            break
+                else:
+                    self.expect("]")
+                return
+            # Any other member is decoded and dropped
+            self.value()
+            if self.expect(",}") == "}":
+                break
+        if key is not None:
+            raise LoaderException("No list \"" + key + "\" found")
+
+def jsonLines(handle, path, skip_invalid = False):
+    """
+    Yields the entries of a JSON Lines file, one per line, leaving out blank lines
+
+    Parameters
+    ----------
+    `handle` : file
+        The open file
+    `path` : `str`
+        The file's path, for messages
+    [`skip_invalid` : `bool`]
+        If True, lines which aren't valid JSON are reported and left out, rather than raising an exception
+
+    Raises
+    ------
+    LoaderException (unless `skip_invalid`) if a line isn't valid JSON
+    """
+    for (number, line) in enumerate(handle, 1):
+        if line.isspace():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            message = path + ", line " + str(number) + ": " + str(e)
+            if not skip_invalid:
+                raise LoaderException(message)
+            print("Skipping " + message)
+
+def iterEntries(path, key = None, schema = None, skip_invalid = False, chunk_size = CHUNK_SIZE):
+    """
+    Yields the entries of the given data file one at a time, checking each against a schema
+
+    Parameters
+    ----------
+    `path` : `str`
+        The data file: JSON (like Scriptures.json), or JSON Lines if it ends in .jsonl
+    [`key` : `str`]
+        For JSON, the member of the top-level object holding the entries (e.g. "scripture"); the first list found is used if not given.
+        It also selects the schema from SCHEMAS, for JSON Lines too.
+    [`schema` : `dict`]
+        The schema to check entries against, instead of the one for `key`. If neither gives one, entries aren't checked.
+    [`skip_invalid` : `bool`]
+        If True, entries which don't match the schema (and lines of a JSON Lines file which aren't valid JSON) are reported and left
+        out, rather than raising an exception
+    [`chunk_size` : `int`]
+        How many characters to read at a time
+
+    Raises
+    ------
+    LoaderException if the file isn't valid JSON, or (unless `skip_invalid`) an entry doesn't match the schema
+    """
+    if schema is None:
+        schema = SCHEMAS.get(key)
+    with open(path, "r", encoding="utf-8") as handle:
+        if path.endswith(".jsonl"):
+            entries = jsonLines(handle, path, skip_invalid)
+        else:
+            entries = JsonStream(handle, chunk_size).items(key)
+        for (number, entry) in enumerate(entries, 1):
+            if schema is not None:
+                try:
+                    validate(entry, schema)
+                except LoaderException as e:
+                    message = path + ", entry " + str(number) + ": " + str(e)
+                    if not skip_invalid:
+                        raise LoaderException(message)
+                    print("Skipping " + message)
+                    continue
+            yield entry
+
+def streamIndex(path, key = "scripture", members = INDEXED_MEMBERS, skip_invalid = False):
+    """
+    Builds a ContextIndex of the given members of the scripture contexts in the given data file, and a PassageArray of the passages
+    they are for, reading the contexts one at a time. The contexts themselves aren't kept, so only the given members can be looked up
+    in the index, but the memory needed is that of the index rather than of the file.
+
+    Returns
+    -------
+    `tuple` : `(ContextIndex, PassageArray)`
+        The index, and every distinct passage in the order they first appear (for scoring, through `PassageArray.toMap()`)
+    """
+    index = ContextIndex([])
+    passages = PassageArray()
+    seen = set()
+    for scripture_context in iterEntries(path, key, skip_invalid=skip_invalid):
+        # The same reference is shared by every posting of the passage, rather than each holding its own copy
+        passage_ref = scripture_context["passage"] = sys.intern(scripture_context["passage"])
+        index.addMembers(scripture_context, members)
+        if passage_ref not in seen:
+            seen.add(passage_ref)
+            passages.append(passage_ref)
+    return (index, passages)
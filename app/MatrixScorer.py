@@ -0,0 +1,397 @@
+import threading
+import time
+import numpy as np
+
+from ContextIndex import ContextIndex
+from Passage import Passage
+from ResultCache import questionKey
+from Utils import defaultSynonyms
+from filters import *
+
+# -----
+# Matrix Scorer
+# An alternative to letting each filter add to the score of each Passage one at a time. Every passage is a row of a set of
+# feature matrices (one column per distinct value seen in the scripture contexts), and a question is encoded as a vector over
+# the same columns, so a filter's contribution to every passage's score is a single matrix-vector product:
+#   - people, places, actions, questions (or any other member compared by a SimpleComparisonFilter):
+#     the number of times each value appears for the passage
+#   - scripture-section: the number of times the passage is marked "OT" and "NT"
+#   - question-types: one row per question type of a passage (rather than per passage), with its type, subject words,
+#     action words, and the similar words of both. The capped score of each row is then added up per passage.
+#
+# The filters in filters.py are each expressed as a weight (1 by default) on the scores of the columns they compare,
+# and give exactly the same scores as the filters do themselves.
+#
+# Many questions can be scored at once: they are encoded as the rows of a matrix, so each filter is one matrix product for
+# the whole batch. Scores are returned in arrays belonging to the caller and nothing about a question is kept, so one
+# MatrixScorer can be shared by any number of threads.
+# -----
+
+SECTION_COLUMNS = ["OT", "NT"]
+
+# The vector a question's "scripture-section" is encoded as, over SECTION_COLUMNS. Same passage section scores +1, opposite -1
+SECTION_VECTORS = {
+    "OT" : [1, -1],
+    "NT" : [-1, 1],
+    "Both" : [1, 1]
+}
+
+# What QuestionTypeFilter adds for a matching type, for each matching (or similar) subject or action word, and the most
+# that the subject and the action can each add
+TYPE_SCORE = 1
+WORD_SCORE = 0.5
+WORD_SCORE_MAX = 2
+
+# Filters which don't score anything (yet), and so contribute nothing
+NO_OP_FILTERS = (RelatingToFilter, SituationFilter)
+
+def asList(entry):
+    return [entry] if type(entry) == str else entry
+
+class Vocabulary:
+    def __init__(self):
+        # Value -> column
+        self.columns = {}
+
+    def column(self, value):
+        # The column of the value, adding it if it's new
+        column = self.columns.get(value)
+        if column is None:
+            column = self.columns[value] = len(self.columns)
+        return column
+
+    def __len__(self):
+        return len(self.columns)
+
+    def matrix(self, values_list, binary = False):
+        # Encode each list of values as a row over this vocabulary; values that aren't in it can't match anything, so they are left out
+        matrix = np.zeros((len(values_list), len(self.columns)))
+        for (row, values) in enumerate(values_list):
+            for value in values:
+                column = self.columns.get(value)
+                if column is not None:
+                    if binary:
+                        matrix[row, column] = 1
+                    else:
+                        matrix[row, column] += 1
+        return matrix
+
+class MatrixScorer:
+    def __init__(self, scripture_contexts, index = None, synonyms = None):
+        """
+        Builds the feature matrices for the given scripture contexts. The members compared by simple comparison filters
+        are only turned into matrices the first time they are used.
+
+        Parameters
+        ----------
+        `scripture_contexts` : `list`
+            The scripture contexts, as found in the "scripture" list of Scriptures.json
+        [`index` : `ContextIndex`]
+            The index of the scripture contexts, used to find values for substring comparisons. One is created if not given.
+        [`synonyms` : `SynonymCache`]
+            Where similar words come from. The shared one is used if not given.
+        """
+
+        self.scripture_contexts = scripture_contexts
+        self.index = index if index is not None else ContextIndex(scripture_contexts)
+        self.synonyms = synonyms if synonyms is not None else defaultSynonyms()
+        self.synonyms.precompute(scripture_contexts)
+
+        # One row per distinct passage, in the order they first appear
+        self.passage_refs = []
+        self.rows = {}
+        for scripture_context in scripture_contexts:
+            passage_ref = scripture_context["passage"]
+            if passage_ref not in self.rows:
+                self.rows[passage_ref] = len(self.passage_refs)
+                self.passage_refs.append(passage_ref)
+
+        # The position of each passage in the Bible, to break ties between equal scores
+        canonical_order = sorted(range(len(self.passage_refs)), key=lambda row: Passage(self.passage_refs[row]).canonicalKey())
+        self.canonical_ranks = np.empty(len(self.passage_refs), dtype=np.intp)
+        self.canonical_ranks[canonical_order] = np.arange(len(self.passage_refs))
+
+        # Member name -> (Vocabulary, passages x values matrix)
+        self.member_matrices = {}
+        self.member_lock = threading.Lock()
+
+        self.section_matrix = np.zeros((len(self.passage_refs), len(SECTION_COLUMNS)))
+        for scripture_context in scripture_contexts:
+            section = scripture_context["scripture-section"]
+            if section in SECTION_COLUMNS:
+                self.section_matrix[self.rows[scripture_context["passage"]], SECTION_COLUMNS.index(section)] += 1
+
+        self.buildQuestionTypes()
+
+    def buildQuestionTypes(self):
+        # The passage row that each question type belongs to, and the values of each of its parts
+        owners = []
+        parts = {"type" : [], "subject" : [], "subject-similar" : [], "action" : [], "action-similar" : []}
+        for scripture_context in self.scripture_contexts:
+            for question_type in scripture_context["question-types"]:
+                owners.append(self.rows[scripture_context["passage"]])
+                parts["type"].append([question_type["type"]])
+                for member in ("subject", "action"):
+                    words = asList(question_type[member])
+                    parts[member].append(set(words))
+                    parts[member + "-similar"].append(self.synonyms.expand(words))
+
+        self.type_owners = np.array(owners, dtype=np.intp)
+        self.type_vocabularies = {}
+        self.type_matrices = {}
+        for (part, part_values) in parts.items():
+            vocabulary = Vocabulary()
+            for values in part_values:
+                for value in values:
+                    vocabulary.column(value)
+            matrix = np.zeros((len(owners), len(vocabulary)))
+            for (row, values) in enumerate(part_values):
+                for value in values:
+                    matrix[row, vocabulary.column(value)] = 1
+            self.type_vocabularies[part] = vocabulary
+            self.type_matrices[part] = matrix
+
+    def memberMatrix(self, key_name):
+        with self.member_lock:
+            if key_name not in self.member_matrices:
+                vocabulary = Vocabulary()
+                member_postings = self.index.memberPostings(key_name)
+                for value in member_postings:
+                    vocabulary.column(value)
+                matrix = np.zeros((len(self.passage_refs), len(vocabulary)))
+                for (value, postings) in member_postings.items():
+                    column = vocabulary.column(value)
+                    for (passage_ref, count) in postings.items():
+                        matrix[self.rows[passage_ref], column] = count
+                self.member_matrices[key_name] = (vocabulary, matrix)
+            return self.member_matrices[key_name]
+
+    def comparisonScores(self, question_key_name, scripture_key_name, only_exact, question_contexts):
+        """
+        The scores a `SimpleComparisonFilter` comparing the given members would give every passage for each of the given questions
+        """
+
+        (vocabulary, matrix) = self.memberMatrix(scripture_key_name)
+        question_values_list = [question_context[question_key_name] for question_context in question_contexts]
+        if not only_exact:
+            # Each question value counts once for every scripture value it is found in
+            question_values_list = [[value for question_value in question_values
+                                           for value in self.index.matchingValues(scripture_key_name, question_value, False)]
+                                    for question_values in question_values_list]
+        return vocabulary.matrix(question_values_list) @ matrix.T
+
+    def sectionScores(self, question_contexts):
+        """
+        The scores the `ScriptureSectionFilter` would give every passage for each of the given questions
+        """
+
+        section_vectors = np.array([SECTION_VECTORS.get(question_context["scripture-section"], [0, 0]) for question_context in question_contexts])
+        return section_vectors @ self.section_matrix.T
+
+    def questionTypeScores(self, question_contexts):
+        """
+        The scores the `QuestionTypeFilter` would give every passage for each of the given questions
+        """
+
+        question_types = [question_context["question-type"] for question_context in question_contexts]
+        # Questions x question types of passages
+        scores = TYPE_SCORE * (self.type_vocabularies["type"].matrix([[question_type["type"]] for question_type in question_types], True) @ self.type_matrices["type"].T)
+        for member in ("subject", "action"):
+            words_list = [asList(question_type[member]) for question_type in question_types]
+            member_score = self.type_vocabularies[member].matrix(words_list, True) @ self.type_matrices[member].T
+            similar_list = [self.synonyms.expand(words) for words in words_list]
+            member_score += self.type_vocabularies[member + "-similar"].matrix(similar_list, True) @ self.type_matrices[member + "-similar"].T
+            scores += np.minimum(WORD_SCORE * member_score, WORD_SCORE_MAX)
+
+        # Add up the question types of each passage
+        passage_scores = np.zeros((len(question_contexts), len(self.passage_refs)))
+        np.add.at(passage_scores.T, self.type_owners, scores.T)
+        return passage_scores
+
+    def referenceScores(self, filter, question_contexts):
+        """
+        The scores the given `VerseInQuestionFilter` would give every passage for each of the given questions.
+        Only the few passages near a referenced verse score, so these come straight from the filter's own index.
+        """
+
+        scores = np.zeros((len(question_contexts), len(self.passage_refs)))
+        for (row, question_context) in enumerate(question_contexts):
+            for (passage_ref, score) in filter.referenceScores(question_context).items():
+                scores[row, self.rows[passage_ref]] += score
+        return scores
+
+    def textScores(self, filter, question_contexts):
+        """
+        The scores the given `TextRelevanceFilter` would give every passage for each of the given questions.
+        Only passages whose text contains one of the question's words score, so these come straight from the filter's text index.
+        """
+
+        scores = np.zeros((len(question_contexts), len(self.passage_refs)))
+        for (row, question_context) in enumerate(question_contexts):
+            for (passage_ref, score) in filter.textScores(question_context).items():
+                scores[row, self.rows[passage_ref]] += score
+        return scores
+
+    def similarityScores(self, filter, question_contexts):
+        """
+        The scores the given `QuestionSimilarityFilter` would give every passage for each of the given questions.
+        Only passages with a question similar enough score, so these come straight from the filter's similarity index.
+        """
+
+        scores = np.zeros((len(question_contexts), len(self.passage_refs)))
+        for (row, question_context) in enumerate(question_contexts):
+            for (passage_ref, score) in filter.similarityScores(question_context).items():
+                scores[row, self.rows[passage_ref]] += score
+        return scores
+
+    def filterScores(self, filter, question_contexts):
+        """
+        The scores the given filter (and its sub-filters) would give every passage for each of the given questions
+
+        Returns
+        -------
+        `numpy.ndarray`
+            One row per question, one column per passage (in the same order as `passage_refs`)
+
+        Raises
+        ------
+        Exception if the filter is of a kind that can't be expressed with the feature matrices
+        """
+
+        if isinstance(filter, SimpleComparisonFilter):
+            scores = self.comparisonScores(filter.question_key_name, filter.scripture_key_name, filter.only_exact, question_contexts)
+        elif isinstance(filter, ScriptureSectionFilter):
+            scores = self.sectionScores(question_contexts)
+        elif isinstance(filter, QuestionTypeFilter):
+            scores = self.questionTypeScores(question_contexts)
+        elif isinstance(filter, VerseInQuestionFilter):
+            scores = self.referenceScores(filter, question_contexts)
+        elif isinstance(filter, QuestionSimilarityFilter):
+            scores = self.similarityScores(filter, question_contexts)
+        elif isinstance(filter, TextRelevanceFilter):
+            scores = self.textScores(filter, question_contexts)
+        elif isinstance(filter, NO_OP_FILTERS) or type(filter) in (Filter, QuestionComparisonFilter):
+            scores = np.zeros((len(question_contexts), len(self.passage_refs)))
+        else:
+            raise Exception("Filter " + type(filter).__name__ + " can't be scored with a MatrixScorer")
+
+        for sub_filter in filter.sub_filters:
+            scores = scores + self.filterScores(sub_filter, question_contexts)
+        return scores
+
+    def scoreBatch(self, filters, question_contexts, weights = None, timings = None):
+        """
+        Scores every passage for each of the given questions, as the given filters would
+
+        Parameters
+        ----------
+        `filters` : `list`
+            The filters to apply
+        `question_contexts` : `list`
+            The questions, as found in the "context" list of Contexts.json
+        [`weights` : `dict`]
+            Filter class name -> how much that filter's scores count. Filters that aren't in it count once.
+        [`timings` : `dict`]
+            If given, the seconds spent on each filter are added to it, by filter class name
+
+        Returns
+        -------
+        `numpy.ndarray`
+            One row per question, one column per passage (in the same order as `passage_refs`)
+        """
+
+        scores = np.zeros((len(question_contexts), len(self.passage_refs)))
+        if len(question_contexts) == 0:
+            return scores
+        for filter in filters:
+            weight = 1 if weights is None else weights.get(type(filter).__name__, 1)
+            if weight != 0:
+                start = time.perf_counter()
+                scores += weight * self.filterScores(filter, question_contexts)
+                if timings is not None:
+                    name = type(filter).__name__
+                    timings[name] = timings.get(name, 0) + time.perf_counter() - start
+        return scores
+
+    def score(self, filters, question_context, weights = None):
+        """
+        Scores every passage for the given question, as the given filters would
+
+        Returns
+        -------
+        `numpy.ndarray`
+            The score of each passage, in the same order as `passage_refs`
+        """
+
+        return self.scoreBatch(filters, [question_context], weights)[0]
+
+    def rank(self, question_contexts, k, filters = None, weights = None, cache = None):
+        """
+        Finds the best `k` passages for each of the given questions. Safe to call from several threads at once.
+
+        Parameters
+        ----------
+        `question_contexts` : `list`
+            The questions, as found in the "context" list of Contexts.json
+        `k` : `int`
+            How many passages to return for each question
+        [`filters` : `list`]
+            The filters to score with; if not given, the same default filters as main.py are used
+        [`weights` : `dict`]
+            Filter class name -> how much that filter's scores count. Filters that aren't in it count once.
+        [`cache` : `ResultCache`]
+            If given, questions already ranked (as far as the members the filters read go) are taken from it, and only the others
+            are scored (and added to it)
+
+        Returns
+        -------
+        `list`
+            For each question, in the same order as given, the (passage reference, score) of its top passages, highest first
+
+        Example
+        -------
+        `scorer.rank(question_contexts[0:2], 3)` returns the three best passages for each of the first two questions, like
+        `[[("1Sam.1.10", 11.0), ("John.11.34-John.11.35", 10.0), ...], [...]]`
+        """
+
+        if filters is None:
+            filters = self.defaultFilters()
+        if cache is None:
+            scores = self.scoreBatch(filters, question_contexts, weights)
+            return [self.top(question_scores, k) for question_scores in scores]
+
+        fields = cache.useFilters(filters, weights)
+        keys = [questionKey(question_context, fields, filters) + ":" + str(k) for question_context in question_contexts]
+        results = [cache.get(key) for key in keys]
+        # Only the questions which weren't cached are scored, together
+        missing = [i for (i, result) in enumerate(results) if result is None]
+        if len(missing) > 0:
+            scores = self.scoreBatch(filters, [question_contexts[i] for i in missing], weights)
+            for (i, question_scores) in zip(missing, scores):
+                results[i] = self.top(question_scores, k)
+                cache.put(keys[i], results[i])
+        return results
+
+    def defaultFilters(self, text_index = None, scanner = None):
+        # The filters only describe what to compare here, so they don't need a map of passages to score
+        return defaultFilters(self.scripture_contexts, None, self.index, self.synonyms, text_index, scanner)
+
+    def top(self, scores, k):
+        """
+        Returns the passages with the `k` highest of the given scores, highest first (passages with equal scores in the order they appear in the Bible)
+
+        Returns
+        -------
+        `list` : `[(str, float)]`
+            The (passage reference, score) of each of the top passages
+        """
+
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        # Only the top k need to be sorted; argpartition puts them (in no particular order) at the front
+        candidates = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        # Make sure that anything tied with the k-th score is considered too, so ties are broken by canonical order rather than by chance
+        candidates = np.union1d(candidates, np.nonzero(scores == scores[candidates].min())[0])
+        ordered = candidates[np.lexsort((self.canonical_ranks[candidates], -scores[candidates]))][:k]
+        return [(self.passage_refs[row], float(scores[row])) for row in ordered]
@@ -0,0 +1,112 @@
+import threading
+import time
+from bisect import bisect_left
+
+# -----
+# Metrics
+# Latency histograms, kept per named stage (e.g. a filter, or waiting in a queue), so it's easy to see where the time goes.
+# Each histogram counts how many observations fall at or under each of a fixed set of bounds, as well as their count and total.
+# -----
+
+# Bucket bounds, in seconds: from 100 microseconds to 10 seconds, in steps of roughly 2.5x
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Histogram:
+    def __init__(self, buckets = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # One count per bucket, and a last one for anything over the largest bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """
+        Returns an estimate of the given quantile (e.g. 0.99): the bound of the bucket it falls in (or None if nothing was observed).
+        A quantile over the largest bound is given as that bound, since there's no bound above it; `snapshot()` marks it as such.
+        """
+        with self.lock:
+            if self.count == 0:
+                return None
+            rank = q * self.count
+            seen = 0
+            for (i, count) in enumerate(self.counts):
+                seen += count
+                if seen >= rank and count > 0:
+                    return self.buckets[min(i, len(self.buckets) - 1)]
+            return self.buckets[-1]
+
+    def snapshot(self):
+        """
+        Returns the histogram as an object: its count, sum, the cumulative count at or under each bucket bound, and how many were over
+        the largest bound. A quantile which falls among those is reported as the largest bound, with "p50-overflow" or "p99-overflow" set.
+        """
+        with self.lock:
+            cumulative = []
+            seen = 0
+            for count in self.counts:
+                seen += count
+                cumulative.append(seen)
+            (count, total) = (self.count, self.sum)
+        return {
+            "count" : count,
+            "sum" : total,
+            "buckets" : {str(bound) : cumulative[i] for (i, bound) in enumerate(self.buckets)},
+            "overflow" : count - cumulative[-2],
+            "p50" : self.quantile(0.5),
+            "p50-overflow" : count > 0 and cumulative[-2] < 0.5 * count,
+            "p99" : self.quantile(0.99),
+            "p99-overflow" : count > 0 and cumulative[-2] < 0.99 * count
+        }
+
+class Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+class Metrics:
+    def __init__(self):
+        # Stage name -> Histogram, created the first time the stage is observed
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def observe(self, name, seconds):
+        self.histogram(name).observe(seconds)
+
+    def timer(self, name):
+        """
+        Returns a context manager which observes how long its block takes, in the given stage
+
+        Example
+        -------
+        `with metrics.timer("score"): ...`
+        """
+        return Timer(self.histogram(name))
+
+    def snapshot(self):
+        """
+        Returns every stage's histogram as an object (see `Histogram.snapshot()`), by stage name
+        """
+        with self.lock:
+            histograms = dict(self.histograms)
+        return {name : histogram.snapshot() for (name, histogram) in sorted(histograms.items())}
@@ -1,12 +1,93 @@
-from DBPManager import DBPManager
+from DBPManager import get_manager, aligned_passages
 from collections import OrderedDict
+import heapq
 
 import scriptures
+import Canon
+
+# Books are held as their position in the canon (see `Canon.bookIndex()`), so each passage holds two small ints rather than its own
+# copies of the names. A passage always gives back its book exactly as it was written, so a spelling other than the canon's own
+# abbreviation (e.g. "Isaiah" rather than "Isa"), or one the canon doesn't recognise, is kept on the passage as well.
+
+def bookId(book):
+    """
+    Returns the position of the given book in the canon, or -1 if it isn't recognised (or is `None`)
+    """
+    return Canon.bookIndex(book) if book is not None else -1
+
+def bookName(book_id):
+    """
+    Returns the canon's abbreviation of the book at the given position (`None` for -1)
+    """
+    return Canon.BOOKS[book_id][1] if book_id >= 0 else None
+
+def bookSpelling(book, book_id):
+    """
+    Returns how the given book needs to be kept besides its id: `None` if `bookName()` gives it back, otherwise the book itself
+    """
+    return None if book_id >= 0 and book == Canon.BOOKS[book_id][1] else book
 
 def passageKey(passage):
     return passage.score
 
+def rankKey(passage):
+    # Highest score first; passages with the same score are in canonical order
+    return (-passage.score, passage.canonicalKey())
+
+def topPassages(passages, k):
+    """
+    Returns the `k` highest scoring of the given `Passage`s, highest first. Passages with equal scores are returned in the order
+    they appear in the Bible. Only the top `k` are ever sorted, so this is much cheaper than sorting all the passages.
+    """
+    return heapq.nsmallest(k, passages, key=rankKey)
+
+def passageTexts(passages, dbp_manager = None):
+    """
+    Retrieves the text of all the given `Passage`s together, which is much faster than calling `text()` on each of them in turn,
+    as all of the chapters involved are requested from the DBP at the same time.
+
+    Parameters
+    ----------
+    `passages` : `list`
+        The `Passage`s to get the text of
+    [`dbp_manager` : `DBPManager`]
+        The manager from which Scripture text can be retrieved; if not given, the shared English Standard Version one is used
+
+    Returns
+    -------
+    `list`
+        The text of each passage, in the same order as given
+    """
+    if dbp_manager is None:
+        dbp_manager = get_manager("ENG", "ESV")
+    results = dbp_manager.passages_many([(passage.startBook, passage.startChapter, passage.endChapter, passage.startVerse, passage.endVerse) for passage in passages])
+    return [text for (text, _) in results]
+
+def passageTranslations(passages, dbp_managers):
+    """
+    Retrieves the text of all the given `Passage`s in each of the given translations together, side by side. Every chapter needed,
+    in every translation, is requested from the DBP at the same time (unless it is cached), so several translations take about
+    as long as one.
+
+    Parameters
+    ----------
+    `passages` : `list`
+        The `Passage`s to get the text of
+    `dbp_managers` : `list`
+        The manager of each translation (e.g. `[get_manager("ENG", "ESV"), get_manager("SPN", "RVR")]`)
+
+    Returns
+    -------
+    `list`
+        For each passage, in the same order as given, what `Passage.texts()` returns
+    """
+    return aligned_passages(dbp_managers, [(passage.startBook, passage.startChapter, passage.endChapter, passage.startVerse, passage.endVerse) for passage in passages])
+
 class Passage:
+    # Passages are created for every entry of a corpus, so they only hold these fields, with no per-instance dict
+    __slots__ = ("startBookId", "endBookId", "startBookSpelling", "endBookSpelling", "startChapter", "endChapter", "startVerse", "endVerse", "startOrdinal", "endOrdinal",
+                 "reference", "score", "osis", "_hash")
+
     def __init__(self, reference, score=0):
         """
         Creates a `Passage` from the given reference. An optional score can also be provided for use with ranking algorithms.
@@ -35,9 +116,9 @@ class Passage:
         ------
         Exception if reference is invalid
         """
-        self.startRef = None
-        self.endRef = None
+        self.osis = False
         self.score = score
+        self._hash = None
         try:
             if type(reference) == tuple:
                 self.startBook = self.endBook = reference[0]
@@ -50,27 +131,64 @@ class Passage:
                 # This is assumed to be in OSIS reference format
                 # Ex. John.3.16-John.3.18 is OSIS for John 3:16-18
                 self.reference = reference
-                refParts = reference.split('-')
-                self.startRef = refParts[0]
-                self.endRef = refParts[1] if len(refParts) > 1 else None
+                self.osis = True
+                endRef = self.endRef
                 startRefParts = self.startRef.split('.')
                 self.startBook = startRefParts[0]
                 self.startChapter = int(startRefParts[1])
                 self.startVerse = int(startRefParts[2])
-                if self.endRef == None:
+                if endRef == None:
                     self.endBook = self.startBook
                     self.endChapter = self.startChapter
                     self.endVerse = self.startVerse
                 else:
-                    endRefParts = self.endRef.split('.')
+                    endRefParts = endRef.split('.')
                     self.endBook = endRefParts[0]
                     self.endChapter = int(endRefParts[1])
                     self.endVerse = int(endRefParts[2])
+
+            # Resolve the passage once to its positions among all the verses of the Bible, so that comparing passages is just
+            # comparing integers. These are None if the book or chapter isn't recognised.
+            self.startOrdinal = Canon.ordinal(self.startBook, self.startChapter, self.startVerse)
+            self.endOrdinal = Canon.ordinal(self.endBook, self.endChapter, self.endVerse)
         except Exception as e:
             print("Exception parsing passage " + str(reference) + ": " + str(e))
             self.clear()
             raise e
 
+    @property
+    def startBook(self):
+        spelling = self.startBookSpelling
+        return spelling if spelling is not None else bookName(self.startBookId)
+
+    @startBook.setter
+    def startBook(self, book):
+        self.startBookId = bookId(book)
+        self.startBookSpelling = bookSpelling(book, self.startBookId)
+
+    @property
+    def endBook(self):
+        spelling = self.endBookSpelling
+        return spelling if spelling is not None else bookName(self.endBookId)
+
+    @endBook.setter
+    def endBook(self, book):
+        self.endBookId = bookId(book)
+        self.endBookSpelling = bookSpelling(book, self.endBookId)
+
+    @property
+    def startRef(self):
+        # The start of an OSIS reference (e.g. John.3.16 of John.3.16-John.3.18); None if the passage wasn't created from one
+        return self.reference.split('-')[0] if self.osis else None
+
+    @property
+    def endRef(self):
+        # The end of an OSIS reference (e.g. John.3.18 of John.3.16-John.3.18); None if there is no end part
+        if not self.osis:
+            return None
+        refParts = self.reference.split('-')
+        return refParts[1] if len(refParts) > 1 else None
+
     def __eq__(self, other):
         if not isinstance(other, Passage):
             return False
@@ -82,7 +200,10 @@ class Passage:
         return self.reference
 
     def __hash__(self):
-        return hash(str(self))
+        # The reference never changes once created, so its hash is only worked out once
+        if self._hash is None:
+            self._hash = hash(str(self))
+        return self._hash
 
     def includes(self, other):
         if not isinstance(other, Passage):
@@ -92,43 +213,45 @@ class Passage:
         if self == other:
             return True
         
-        # Get the numerical order of each book (i.e. Genesis = 0, Exodus = 1, etc.)
-        self_start_book_order = self.book_order(self.startBook)
-        self_end_book_order = self.book_order(self.endBook)
-        other_start_book_order = self.book_order(other.startBook)
-        other_end_book_order = self.book_order(other.endBook)
-
-        # We're going to determine if this passage starts before and ends after the given passage, which means the given passage is
-        # included within it 
-        starts_before = False
-        ends_after = False
-
-        if self_start_book_order < other_start_book_order:
-            starts_before = True
-        elif self_start_book_order == other_start_book_order:
-            if self.startChapter < other.startChapter:
-                starts_before = True
-            elif self.startChapter == other.startChapter:
-                if self.startVerse <= other.startVerse:
-                    starts_before = True
-
-        if self_end_book_order > other_end_book_order:
-            ends_after = True
-        elif self_end_book_order == other_end_book_order:
-            if self.endChapter > other.endChapter:
-                ends_after = True
-            elif self.endChapter == other.endChapter:
-                if self.endVerse >= other.endVerse:
-                    ends_after = True
-
+        if not self.resolved() or not other.resolved():
+            return False
         # If this passage both starts before and ends after the given one, then it includes it
-        return starts_before and ends_after
+        return self.startOrdinal <= other.startOrdinal and self.endOrdinal >= other.endOrdinal
+
+    def overlaps(self, other):
+        """
+        Returns True if this passage and the given one have at least one verse in common
+        """
+        if not isinstance(other, Passage) or not self.resolved() or not other.resolved():
+            return False
+        return self.startOrdinal <= other.endOrdinal and other.startOrdinal <= self.endOrdinal
+
+    def distance(self, other):
+        """
+        Returns the number of verses between the end of one passage and the start of the other (0 if they overlap or are adjacent),
+        or `None` if either passage isn't recognised
+        """
+        if not isinstance(other, Passage) or not self.resolved() or not other.resolved():
+            return None
+        if self.overlaps(other):
+            return 0
+        return max(other.startOrdinal - self.endOrdinal, self.startOrdinal - other.endOrdinal) - 1
+
+    def resolved(self):
+        """
+        Returns True if the passage's book and chapters are recognised, so it has a position in the Bible
+        """
+        return self.startOrdinal is not None and self.endOrdinal is not None
+
+    def __lt__(self, other):
+        # Passages sort in the order they appear in the Bible
+        return self.canonicalKey() < other.canonicalKey()
 
-    def text(self, dbp_manager = DBPManager("ENG", "ESV")):
+    def text(self, dbp_manager = None):
         """
         Retrieves the text this `Passage` represents, using the given Digitial Bible Platform Manager (`DBPManager`).
         This manager defines the language and translation to use. The `Passage` will use this as the means by which to get the Scripture text.
-        If no `DBPManager` is provided, a default one will be created using the English Standard Version in US-English.
+        If no `DBPManager` is provided, the shared one for the English Standard Version in US-English is used.
 
         Parameters
         ----------
@@ -139,9 +262,37 @@ class Passage:
         ------
         Exception if reference is invalid or there was some other error retrieving the text
         """
+        if dbp_manager is None:
+            dbp_manager = get_manager("ENG", "ESV")
         (text, _) = dbp_manager.passage(self.startBook, self.startChapter, self.endChapter, self.startVerse, self.endVerse)
         return text
 
+    def texts(self, dbp_managers):
+        """
+        Retrieves the text this `Passage` represents in each of the given translations at once, lined up verse by verse.
+        Where a translation doesn't have a verse that another one does (as their versifications differ), its text is `None`.
+
+        Parameters
+        ----------
+        `dbp_managers` : `list`
+            The manager of each translation
+
+        Raises
+        ------
+        Exception if reference is invalid or there was some other error retrieving the text
+
+        Returns
+        -------
+        `list` : `[(int, int, [str])]`
+            The (chapter, verse, text in each translation) of every verse of the passage, in order
+
+        Example
+        -------
+        `Passage("John.3.16-John.3.17").texts([get_manager("ENG", "ESV"), get_manager("SPN", "RVR")])`
+            Returns `[(3, 16, [<ESV text>, <RVR text>]), (3, 17, [<ESV text>, <RVR text>])]`
+        """
+        return passageTranslations([self], dbp_managers)[0]
+
     def ref_osis(self):
         book_start = scriptures.references.get_book(self.startBook)
         book_end = scriptures.references.get_book(self.endBook)
@@ -173,19 +324,21 @@ class Passage:
 			"verse-end" : self.endVerse
         }
 
+    def canonicalKey(self):
+        """
+        Returns a key which sorts passages in the order they appear in the Bible (passages in unknown books go last)
+        """
+        return (self.startOrdinal if self.startOrdinal is not None else Canon.TOTAL_VERSES,
+                self.endOrdinal if self.endOrdinal is not None else Canon.TOTAL_VERSES,
+                self.reference)
+
     def book_order(self, book):
-        index = 0
-        # ordered_books = OrderedDict(scriptures.references.pcanon.books)
-        for key in scriptures.references.pcanon.books:
-            book_entry = scriptures.references.pcanon.books[key]
-            # Compare to the full name (index 0) and abbreviation (index 1)
-            if book == book_entry[0] or book == book_entry[1]:
-                return index
-            index = index + 1
-        return -1
+        # The position of the book in the canon (i.e. Genesis = 0, Exodus = 1, etc.), or -1 if it isn't recognised
+        return Canon.bookIndex(book)
 
     def clear(self):
         # Clear fields except string reference itself
         self.startBook = self.endBook = None
         self.startChapter = self.endChapter = None
-        self.startVerse = self.endVerse = None
\ No newline at end of file
+        self.startVerse = self.endVerse = None
+        self.startOrdinal = self.endOrdinal = None
\ No newline at end of file
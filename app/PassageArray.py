@@ -0,0 +1,192 @@
+from array import array
+
+from Passage import Passage, bookId
+import Canon
+
+# -----
+# Passage Array
+# Holds a whole corpus of passages in parallel typed arrays (one per field) instead of one object per passage, so that even
+# every verse of the Bible takes a few MB. Reading an entry gives a `PassageView`: a `Passage` whose fields are read from, and whose
+# score is written to, the arrays, so it can be used anywhere a `Passage` is (filters, ranking, fetching text, etc.).
+# -----
+
+class PassageView(Passage):
+    # Only the position in the array is held; every field of the passage comes from the array itself
+    __slots__ = ("passages", "index")
+
+    def __init__(self, passages, index):
+        self.passages = passages
+        self.index = index
+
+    def __hash__(self):
+        return hash(self.reference)
+
+    @property
+    def startBookId(self):
+        return self.passages.start_books[self.index]
+
+    @property
+    def endBookId(self):
+        return self.passages.end_books[self.index]
+
+    @property
+    def startBookSpelling(self):
+        return self.passages.start_book_spellings.get(self.index)
+
+    @property
+    def endBookSpelling(self):
+        return self.passages.end_book_spellings.get(self.index)
+
+    @property
+    def startChapter(self):
+        return self.passages.start_chapters[self.index]
+
+    @property
+    def endChapter(self):
+        return self.passages.end_chapters[self.index]
+
+    @property
+    def startVerse(self):
+        return self.passages.start_verses[self.index]
+
+    @property
+    def endVerse(self):
+        return self.passages.end_verses[self.index]
+
+    @property
+    def startOrdinal(self):
+        ordinal = self.passages.start_ordinals[self.index]
+        return ordinal if ordinal >= 0 else None
+
+    @property
+    def endOrdinal(self):
+        ordinal = self.passages.end_ordinals[self.index]
+        return ordinal if ordinal >= 0 else None
+
+    @property
+    def osis(self):
+        return self.passages.osis[self.index] == 1
+
+    @property
+    def reference(self):
+        return self.passages.reference(self.index)
+
+    @property
+    def score(self):
+        return self.passages.scores[self.index]
+
+    @score.setter
+    def score(self, score):
+        self.passages.scores[self.index] = score
+
+class PassageArray:
+    def __init__(self, passages = ()):
+        """
+        Creates a columnar array holding the given passages (or none)
+
+        Parameters
+        ----------
+        [`passages` : `iterable`]
+            The `Passage`s, or references (anything `Passage` accepts), to start with
+        """
+        self.start_books = array("h")
+        self.end_books = array("h")
+        # Index -> book, for the few passages whose book isn't written as the canon abbreviates it (see `Passage.bookSpelling()`)
+        self.start_book_spellings = {}
+        self.end_book_spellings = {}
+        self.start_chapters = array("H")
+        self.end_chapters = array("H")
+        self.start_verses = array("H")
+        self.end_verses = array("H")
+        # -1 where the passage isn't recognised (i.e. the ordinal is None)
+        self.start_ordinals = array("i")
+        self.end_ordinals = array("i")
+        self.scores = array("d")
+        self.osis = array("b")
+        # Every reference string, encoded back to back; reference i is reference_bytes[reference_offsets[i]:reference_offsets[i + 1]]
+        self.reference_bytes = bytearray()
+        self.reference_offsets = array("I", [0])
+        self.extend(passages)
+
+    @classmethod
+    def everyVerse(cls):
+        """
+        Returns an array holding one passage for every verse of the Bible, in order, each with an OSIS reference (e.g. Gen.1.1)
+        """
+        passages = cls()
+        ordinal = 0
+        for (name, abbreviation, verse_counts) in Canon.BOOKS:
+            book_id = bookId(abbreviation)
+            for (chapter, verse_count) in enumerate(verse_counts, 1):
+                for verse in range(1, verse_count + 1):
+                    passages.appendFields(abbreviation + "." + str(chapter) + "." + str(verse), True, book_id, book_id, None, None,
+                                          chapter, chapter, verse, verse, ordinal, ordinal, 0)
+                    ordinal += 1
+        return passages
+
+    def appendFields(self, reference, osis, start_book_id, end_book_id, start_book_spelling, end_book_spelling, start_chapter, end_chapter,
+                     start_verse, end_verse, start_ordinal, end_ordinal, score):
+        if start_book_spelling is not None:
+            self.start_book_spellings[len(self)] = start_book_spelling
+        if end_book_spelling is not None:
+            self.end_book_spellings[len(self)] = end_book_spelling
+        self.start_books.append(start_book_id)
+        self.end_books.append(end_book_id)
+        self.start_chapters.append(start_chapter or 0)
+        self.end_chapters.append(end_chapter or 0)
+        self.start_verses.append(start_verse or 0)
+        self.end_verses.append(end_verse or 0)
+        self.start_ordinals.append(start_ordinal if start_ordinal is not None else -1)
+        self.end_ordinals.append(end_ordinal if end_ordinal is not None else -1)
+        self.scores.append(score)
+        self.osis.append(1 if osis else 0)
+        self.reference_bytes += reference.encode("utf-8")
+        self.reference_offsets.append(len(self.reference_bytes))
+
+    def append(self, passage, score = None):
+        """
+        Adds the given `Passage` (or reference, in any form `Passage` accepts) to the end of the array, and returns its view.
+        If a score is given it replaces the passage's own.
+        """
+        if not isinstance(passage, Passage):
+            passage = Passage(passage)
+        self.appendFields(passage.reference, passage.osis, passage.startBookId, passage.endBookId, passage.startBookSpelling,
+                          passage.endBookSpelling, passage.startChapter, passage.endChapter, passage.startVerse, passage.endVerse, passage.startOrdinal, passage.endOrdinal,
+                          passage.score if score is None else score)
+        return PassageView(self, len(self) - 1)
+
+    def extend(self, passages):
+        for passage in passages:
+            self.append(passage)
+
+    def reference(self, index):
+        return str(self.reference_bytes[self.reference_offsets[index]:self.reference_offsets[index + 1]], "utf-8")
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("PassageArray index out of range")
+        return PassageView(self, index)
+
+    def __iter__(self):
+        for index in range(0, len(self)):
+            yield PassageView(self, index)
+
+    def toMap(self):
+        """
+        Returns a map of each reference to its `PassageView`, in the same form as the scripture score map given to the filters.
+        Scores the filters give the views are kept in this array.
+        """
+        return {passage.reference: passage for passage in self}
+
+    def nbytes(self):
+        """
+        Returns the number of bytes taken up by the contents of the arrays
+        """
+        columns = [self.start_books, self.end_books, self.start_chapters, self.end_chapters, self.start_verses, self.end_verses,
+                   self.start_ordinals, self.end_ordinals, self.scores, self.osis, self.reference_offsets]
+        return sum(column.itemsize * len(column) for column in columns) + len(self.reference_bytes)
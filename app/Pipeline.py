@@ -0,0 +1,97 @@
+from Passage import Passage, topPassages
+from ResultCache import questionKey
+
+# -----
+# Pipeline
+# Runs a question through a list of filters, and selects the best passages once they've all been scored.
+# -----
+
+def settled(passages, k, span):
+    """
+    Returns True if the top `k` of the given passages (and their order) can no longer change when every score may still move by
+    up to `span` relative to any other: each of the top `k + 1` scores must be more than `span` above the next one
+    """
+    top = topPassages(passages, k + 1)
+    # Each passage in the top k has to stay ahead of the one after it (if there is one)
+    for i in range(0, min(k, len(top) - 1)):
+        if top[i].score - top[i + 1].score <= span:
+            return False
+    return True
+
+def rankPassages(filters, question_context, passages, k, early_exit = False, cache = None):
+    """
+    Applies each of the given filters to the given question, then returns the `k` highest scoring passages, highest first.
+    Passages with equal scores are returned in the order they appear in the Bible.
+
+    Parameters
+    ----------
+    `filters` : `list`
+        The filters to apply, in order; they adjust the scores of the passages
+    `question_context` : `dict`
+        The question, as found in the "context" list of Contexts.json
+    `passages` : `iterable`
+        The `Passage`s being scored by the filters (i.e. the values of the scripture map they were given)
+    `k` : `int`
+        How many passages to return
+    [`early_exit` : `bool`]
+        If True, filters stop being applied as soon as the remaining ones can't change which passages are in the top `k`, or their order.
+        The returned passages are the same, but their scores will only include the filters that were applied.
+    [`cache` : `ResultCache`]
+        If given, the top passages of a question the filters have already scored (as far as the members they read go) are taken
+        from it, without applying any filters, and those of any other question are added to it. Passages from the cache are new
+        `Passage`s, with the scores they had, rather than those being scored. What is cached has to depend on the question alone,
+        so with a cache every passage's score is set back to 0 before the filters are applied.
+
+    Returns
+    -------
+    `list`
+        The top `k` `Passage`s
+    """
+    if cache is not None:
+        fields = cache.useFilters(filters)
+        key = questionKey(question_context, fields, filters) + ":" + str(k) + (":early" if early_exit else "")
+        cached = cache.get(key)
+        if cached is not None:
+            return [Passage(passage_ref, score) for (passage_ref, score) in cached]
+        passages = list(passages)
+        for passage in passages:
+            passage.score = 0
+        top = rankPassages(filters, question_context, passages, k, early_exit)
+        cache.put(key, [(passage.reference, passage.score) for passage in top])
+        return top
+
+    passages = list(passages)
+    if early_exit:
+        # How far the filters after each one could still move any passage's score down and up
+        remaining_bounds = [(0, 0)] * (len(filters) + 1)
+        for i in range(len(filters) - 1, -1, -1):
+            (lowest, highest) = filters[i].scoreBounds(question_context)
+            remaining_bounds[i] = (remaining_bounds[i + 1][0] + lowest, remaining_bounds[i + 1][1] + highest)
+
+    for i in range(0, len(filters)):
+        filters[i].process(question_context)
+        if early_exit and i < len(filters) - 1:
+            (lowest, highest) = remaining_bounds[i + 1]
+            # One passage could gain the most while another loses the most
+            if settled(passages, k, highest - lowest):
+                break
+
+    return topPassages(passages, k)
+
+def explainPassages(filters, question_context, passages):
+    """
+    Returns why each of the given passages (e.g. the top ones returned by `rankPassages()`) got its score, by applying the filters again
+    for just those passages with a trace (see `Filter.explain()`). The passages' scores aren't changed, so ranking itself can run
+    without any trace, at full speed, and only the passages which are shown are explained.
+
+    Returns
+    -------
+    `dict`
+        Passage reference -> the TraceEvents of that passage, in the order the filters emitted them
+    """
+    passage_refs = [passage if type(passage) == str else passage.reference for passage in passages]
+    explanations = {passage_ref : [] for passage_ref in passage_refs}
+    for filter in filters:
+        for event in filter.explain(question_context, passage_refs):
+            explanations[event.passage].append(event)
+    return explanations
@@ -0,0 +1,156 @@
+import functools
+import os
+import threading
+import time
+
+# -----
+# Profile
+# How long each filter takes, and how much work it does, added up per filter class: how many times it was applied, its wall time
+# (with and without its sub-filters), its CPU time, how many passages it looked at and how many it scored, and how many similar
+# word lookups it made (and how many of those were answered from a cache).
+#
+# Every filter's `process()` is measured automatically (see `Filter.__init_subclass__()`), but only while profiling is enabled,
+# either with `profiler.enable()` or by setting the FILTER_PROFILE environment variable to 1. When it isn't, each call to a filter
+# costs one extra check, so it can stay built in.
+# -----
+
+# The counters of each filter, in the order they are reported: (name, what it counts, how it is exported)
+COUNTERS = [
+    ("calls", "Times the filter was applied", "filter_calls_total"),
+    ("wall", "Wall time, including sub-filters, in seconds", "filter_wall_seconds_total"),
+    ("self", "Wall time, not including sub-filters, in seconds", "filter_self_seconds_total"),
+    ("cpu", "CPU time of the applying thread, including sub-filters, in seconds", "filter_cpu_seconds_total"),
+    ("scanned", "Passages (or postings) looked at", "filter_passages_scanned_total"),
+    ("scored", "Changes made to passage scores", "filter_passages_scored_total"),
+    ("synonym-lookups", "Similar word lookups", "filter_synonym_lookups_total"),
+    ("synonym-hits", "Similar word lookups answered from a cache", "filter_synonym_cache_hits_total")
+]
+
+class Frame:
+    # A filter being applied, and how long its sub-filters have taken so far
+    __slots__ = ("filter", "child_wall")
+
+    def __init__(self, filter):
+        self.filter = filter
+        self.child_wall = 0.0
+
+class Profiler:
+    def __init__(self, enabled = False):
+        self.enabled = enabled
+        # Filter class name -> counter name -> total
+        self.stats = {}
+        self.lock = threading.Lock()
+        # The filters being applied on each thread, innermost last
+        self.local = threading.local()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def add(self, filter, counts):
+        name = type(filter).__name__
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = {counter : 0 for (counter, _, _) in COUNTERS}
+            for (counter, value) in counts.items():
+                stats[counter] += value
+
+    def count(self, filter, scanned, scored):
+        """
+        Adds to how many passages the given filter looked at and scored; called by filters at the end of `process()`
+        """
+        if self.enabled:
+            self.add(filter, {"scanned" : scanned, "scored" : scored})
+
+    def measure(self, filter, process, question_context):
+        # Applies the filter, timing it (and counting its similar word lookups). A filter calling its parent class's process() is only timed once.
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        if len(stack) > 0 and stack[-1].filter is filter:
+            return process(filter, question_context)
+
+        synonyms = getattr(filter, "synonyms", None)
+        synonyms_before = synonymCounts(synonyms)
+        frame = Frame(filter)
+        stack.append(frame)
+        (wall_start, cpu_start) = (time.perf_counter(), time.thread_time())
+        try:
+            return process(filter, question_context)
+        finally:
+            (wall, cpu) = (time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+            stack.pop()
+            if len(stack) > 0:
+                stack[-1].child_wall += wall
+            synonyms_after = synonymCounts(synonyms)
+            self.add(filter, {
+                "calls" : 1,
+                "wall" : wall,
+                "self" : wall - frame.child_wall,
+                "cpu" : cpu,
+                "synonym-lookups" : synonyms_after[0] - synonyms_before[0],
+                "synonym-hits" : synonyms_after[1] - synonyms_before[1]
+            })
+
+    def snapshot(self):
+        """
+        Returns the counters of every filter class, by class name
+        """
+        with self.lock:
+            return {name : dict(stats) for (name, stats) in sorted(self.stats.items())}
+
+    def report(self):
+        """
+        Returns the counters of every filter class as a text table, the filters taking the most time (not counting sub-filters) first
+        """
+        stats = sorted(self.snapshot().items(), key=lambda item: -item[1]["self"])
+        lines = ["filter".ljust(28) + "calls".rjust(8) + "wall ms".rjust(12) + "self ms".rjust(12) + "cpu ms".rjust(12) + "ms/call".rjust(10) +
+                 "scanned".rjust(12) + "scored".rjust(12) + "synonyms".rjust(10) + "hits".rjust(10)]
+        for (name, counters) in stats:
+            lines.append(name.ljust(28) + str(counters["calls"]).rjust(8) + format(counters["wall"] * 1000, ".2f").rjust(12) +
+                         format(counters["self"] * 1000, ".2f").rjust(12) + format(counters["cpu"] * 1000, ".2f").rjust(12) +
+                         format(counters["wall"] * 1000 / max(counters["calls"], 1), ".3f").rjust(10) + str(counters["scanned"]).rjust(12) +
+                         str(counters["scored"]).rjust(12) + str(counters["synonym-lookups"]).rjust(10) + str(counters["synonym-hits"]).rjust(10))
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """
+        Returns the counters of every filter class in the Prometheus text exposition format, labelled by filter
+        """
+        stats = self.snapshot()
+        lines = []
+        for (counter, description, metric) in COUNTERS:
+            lines.append("# HELP " + metric + " " + description)
+            lines.append("# TYPE " + metric + " counter")
+            for (name, counters) in stats.items():
+                lines.append(metric + "{filter=\"" + name + "\"} " + str(counters[counter]))
+        return "\n".join(lines) + "\n"
+
+def synonymCounts(synonyms):
+    # (lookups, lookups answered from a cache) made of the given SynonymCache so far
+    if synonyms is None:
+        return (0, 0)
+    stats = synonyms.stats()
+    return (stats["lookups"], stats["precomputed-hits"] + stats["question-cache-hits"])
+
+def profiled(process):
+    """
+    Wraps a filter's `process()` so that it is measured while profiling is enabled
+    """
+    @functools.wraps(process)
+    def wrapper(filter, question_context):
+        if not profiler.enabled:
+            return process(filter, question_context)
+        return profiler.measure(filter, process, question_context)
+    wrapper.profiled = True
+    return wrapper
+
+# The profiler every filter reports to
+profiler = Profiler(os.environ.get("FILTER_PROFILE", "0") == "1")
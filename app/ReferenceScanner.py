@@ -0,0 +1,352 @@
+import re
+from collections import deque, namedtuple
+
+import scriptures
+import Canon
+from Passage import Passage
+
+# -----
+# Reference Scanner
+# Finds the passages of Scripture a question's text refers to, in one pass over the text:
+#   - references written out as usual, e.g. "John 3:16", "1 Cor. 13:4-7", "Song of Solomon 2", "Ps 23:1-24:2", in any case.
+#     Every name and abbreviation of every book the scriptures library recognises is searched for at once, with an Aho-Corasick
+#     automaton, and the chapter and verses are read from just after each name found.
+#   - quotations, e.g. "in the beginning god created the heaven", given a QuoteIndex of the text of a fileset: every run of
+#     SHINGLE_SIZE words in the text is looked up in it, and the verses with enough runs in common are taken to be quoted.
+# Either way, the time taken depends only on the length of the text, not on how many books, names or verses are known.
+# -----
+
+# How many words each run (shingle) of a quotation is, how many runs a verse needs in common with the text to be taken as quoted,
+# and how many verses a run can be in before it is too common to say which of them is being quoted
+SHINGLE_SIZE = 4
+MIN_QUOTE_SHINGLES = 2
+MAX_POSTINGS = 8
+
+# Other names books are often called by, which the scriptures library doesn't know
+EXTRA_NAMES = {"Song of Songs" : "Song of Solomon", "Revelations" : "Revelation of Jesus Christ", "Psalm" : "Psalms"}
+
+# What follows a book's name: the chapter, then optionally the verse, then optionally the end of a range (a verse, chapter, or both)
+REFERENCE_TAIL = re.compile(r"\.?[ \t]*(\d{1,3})(?:[ \t]*[:.][ \t]*(\d{1,3}))?(?:[ \t]*[-–—][ \t]*(\d{1,3})(?:[ \t]*[:.][ \t]*(\d{1,3}))?)?")
+
+WORD = re.compile(r"\w+(?:'\w+)?")
+
+class ScannedReference(namedtuple("ScannedReference", ["start", "end", "startOrdinal", "endOrdinal", "kind"])):
+    # A passage found in a text: where it was found (start and end positions), the canonical ordinals of its first and last verses,
+    # and whether it was a "reference" or a "quote"
+    __slots__ = ()
+
+    def reference(self):
+        # The passage as an OSIS reference
+        return osisReference(self.startOrdinal) + ("-" + osisReference(self.endOrdinal) if self.endOrdinal != self.startOrdinal else "")
+
+def osisReference(ordinal):
+    (book, chapter, verse) = Canon.verseAt(ordinal)
+    return Canon.BOOKS[book][1] + "." + str(chapter) + "." + str(verse)
+
+def expandPattern(pattern):
+    """
+    Returns every string matched by one of the scriptures library's book name patterns, which only use literals, non-capturing groups,
+    alternatives, optional parts, `\\s` and negative lookbehinds (which are left out)
+    """
+    (strings, _) = expandAlternatives(pattern, 0)
+    return strings
+
+def expandAlternatives(pattern, position):
+    strings = set()
+    while True:
+        (sequence, position) = expandSequence(pattern, position)
+        strings |= sequence
+        if position < len(pattern) and pattern[position] == "|":
+            position += 1
+            continue
+        return (strings, position)
+
+def expandSequence(pattern, position):
+    strings = {""}
+    while position < len(pattern) and pattern[position] not in "|)":
+        if pattern.startswith("(?<!", position):
+            # Lookbehinds don't match anything themselves; skip to the end of the group
+            depth = 0
+            while True:
+                depth += {"(" : 1, ")" : -1}.get(pattern[position], 0)
+                position += 1
+                if depth == 0:
+                    break
+            continue
+        if pattern.startswith("(?:", position):
+            (item, position) = expandAlternatives(pattern, position + 3)
+            position += 1
+        elif pattern.startswith("\\s", position):
+            (item, position) = ({" "}, position + 2)
+        else:
+            (item, position) = ({pattern[position]}, position + 1)
+        if position < len(pattern) and pattern[position] == "?":
+            item = item | {""}
+            position += 1
+        strings = {prefix + suffix for prefix in strings for suffix in item}
+    return (strings, position)
+
+class Automaton:
+    def __init__(self, words):
+        """
+        An Aho-Corasick automaton finding every occurrence of any of the given words (a dict of word -> value) in a text, in one pass
+        """
+        # For each state: its transitions, the state to fall back to, and the (length, value) of every word ending there
+        self.transitions = [{}]
+        self.fallbacks = [0]
+        self.outputs = [[]]
+        for (word, value) in words.items():
+            state = 0
+            for character in word:
+                next_state = self.transitions[state].get(character)
+                if next_state is None:
+                    next_state = self.transitions[state][character] = len(self.transitions)
+                    self.transitions.append({})
+                    self.fallbacks.append(0)
+                    self.outputs.append([])
+                state = next_state
+            self.outputs[state].append((len(word), value))
+
+        # Breadth first, so that every state's fallback is worked out before its children's
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for (character, next_state) in self.transitions[state].items():
+                fallback = self.fallbacks[state]
+                while fallback > 0 and character not in self.transitions[fallback]:
+                    fallback = self.fallbacks[fallback]
+                fallback = self.transitions[fallback].get(character, 0)
+                self.fallbacks[next_state] = fallback if fallback != next_state else 0
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fallbacks[next_state]]
+                queue.append(next_state)
+
+    def matches(self, text):
+        """
+        Yields the (start, end, value) of every occurrence of a word in the given text
+        """
+        state = 0
+        for (position, character) in enumerate(text):
+            while state > 0 and character not in self.transitions[state]:
+                state = self.fallbacks[state]
+            state = self.transitions[state].get(character, 0)
+            for (length, value) in self.outputs[state]:
+                yield (position + 1 - length, position + 1, value)
+
+def lowered(text):
+    # The text in lower case, character for character (the few characters which become longer in lower case are left as they are)
+    return "".join(character.lower() if len(character.lower()) == 1 else character for character in text)
+
+# Built the first time it is needed, and shared
+_book_automaton = None
+
+def bookAutomaton():
+    """
+    Returns the automaton finding every name of every book (in lower case), giving the book's index in the canon
+    """
+    global _book_automaton
+    if _book_automaton is None:
+        names = {}
+        for entry in scriptures.references.pcanon.books.values():
+            index = Canon.bookIndex(entry[0])
+            for name in expandPattern(entry[2]) | {entry[0], entry[1]}:
+                names[name.lower()] = index
+        for (name, book) in EXTRA_NAMES.items():
+            names[name.lower()] = Canon.bookIndex(book)
+        _book_automaton = Automaton(names)
+    return _book_automaton
+
+class QuoteIndex:
+    def __init__(self, shingle_size = SHINGLE_SIZE, max_postings = MAX_POSTINGS):
+        """
+        An index of every run of `shingle_size` words in the text of a Bible, to recognise verses quoted in a question.
+        Fill it with `addChapter()` (or build it from the verse cache with `quoteIndex()`).
+        """
+        self.shingle_size = shingle_size
+        self.max_postings = max_postings
+        # Hash of a run of words -> the ordinal of the verse it is in, or a tuple of them if it is in several (empty if in too many)
+        self.shingles = {}
+        self.verse_count = 0
+
+    def words(self, text):
+        # The (word in lower case, start, end) of every word of the text
+        return [(match.group().lower(), match.start(), match.end()) for match in WORD.finditer(text)]
+
+    def addVerse(self, ordinal, text):
+        words = [word for (word, _, _) in self.words(text)]
+        for i in range(len(words) - self.shingle_size + 1):
+            key = hash(" ".join(words[i:i + self.shingle_size]))
+            postings = self.shingles.get(key)
+            if postings is None:
+                self.shingles[key] = ordinal
+            elif type(postings) == int:
+                if postings != ordinal:
+                    self.shingles[key] = (postings, ordinal)
+            elif 0 < len(postings) and ordinal not in postings:
+                self.shingles[key] = postings + (ordinal,) if len(postings) < self.max_postings else ()
+        self.verse_count += 1
+
+    def fingerprint(self):
+        # Changes whenever verses are added, so anything scored with the index can tell (see `Filter.configuration()`)
+        return [self.shingle_size, self.verse_count, len(self.shingles)]
+
+    def addChapter(self, book, chapter, verses):
+        """
+        Adds the (verse number, verse text) pairs of the given chapter. Returns False if the book or chapter isn't in the canon.
+        """
+        first = Canon.ordinal(book, chapter, 1)
+        if first is None:
+            return False
+        for (verse, text) in verses:
+            self.addVerse(Canon.ordinal(book, chapter, verse), text)
+        return True
+
+    def scan(self, text):
+        """
+        Returns a ScannedReference for every verse (or run of verses) quoted in the given text
+        """
+        words = self.words(text)
+        # Verse ordinal -> (start of the first run of words it has in common with the text, end of the last, how many runs)
+        found = {}
+        for i in range(len(words) - self.shingle_size + 1):
+            postings = self.shingles.get(hash(" ".join(word for (word, _, _) in words[i:i + self.shingle_size])))
+            if postings is None:
+                continue
+            for ordinal in ((postings,) if type(postings) == int else postings):
+                (start, _, count) = found.get(ordinal, (words[i][1], 0, 0))
+                found[ordinal] = (start, words[i + self.shingle_size - 1][2], count + 1)
+
+        quotes = []
+        for ordinal in sorted(ordinal for (ordinal, (_, _, count)) in found.items() if count >= MIN_QUOTE_SHINGLES):
+            (start, end, _) = found[ordinal]
+            # A quotation running on into the next verse is one passage: the runs of the two verses overlap in the text, or there are
+            # no words between them (only spaces and punctuation, such as the full stop ending the first verse)
+            if len(quotes) > 0 and quotes[-1].endOrdinal == ordinal - 1 and (start <= quotes[-1].end or WORD.search(text, quotes[-1].end, start) is None):
+                previous = quotes.pop()
+                (start, end) = (min(start, previous.start), max(end, previous.end))
+                quotes.append(ScannedReference(start, end, previous.startOrdinal, ordinal, "quote"))
+            else:
+                quotes.append(ScannedReference(start, end, ordinal, ordinal, "quote"))
+        return quotes
+
+def quoteIndex(cache, fileset_id, shingle_size = SHINGLE_SIZE):
+    """
+    Returns a QuoteIndex of every chapter of the given fileset held in the given VerseCache (see `DBPManager.prefetch()`)
+    """
+    index = QuoteIndex(shingle_size)
+    for (book, chapter, verses) in cache.cached_chapters(fileset_id):
+        index.addChapter(book, chapter, verses)
+    return index
+
+class ReferenceScanner:
+    def __init__(self, quotes = None):
+        """
+        Parameters
+        ----------
+        [`quotes` : `QuoteIndex`]
+            The verse text to recognise quotations of; only references are recognised if not given
+        """
+        self.automaton = bookAutomaton()
+        self.quotes = quotes
+
+    def references(self, text):
+        """
+        Returns a ScannedReference for every reference (a book's name followed by a chapter, and maybe verses) in the given text
+        """
+        # Every book name found, by where it starts, longest first
+        candidates = {}
+        for (start, end, book) in self.automaton.matches(lowered(text)):
+            # A name has to be a word (or words) of its own
+            if (start > 0 and text[start - 1].isalnum()) or (end < len(text) and text[end].isalpha()):
+                continue
+            candidates.setdefault(start, []).append((end, book))
+
+        references = []
+        position = 0
+        # In the order they start (going through positions rather than sorting, so this stays linear in the length of the text)
+        for start in range(len(text)):
+            if start < position or start not in candidates:
+                continue
+            for (end, book) in sorted(candidates[start], reverse=True):
+                reference = self.readReference(text, start, end, book)
+                if reference is not None:
+                    references.append(reference)
+                    position = reference.end
+                    break
+        return references
+
+    def readReference(self, text, start, end, book):
+        # Reads the chapter and verses after the name of a book, returning None if there aren't any (or they aren't in the book)
+        match = REFERENCE_TAIL.match(text, end)
+        if match is None:
+            return None
+        (chapter, verse, range_end, range_end_verse) = [int(group) if group is not None else None for group in match.groups()]
+        # Without a verse, it is more likely to be a name than a reference unless it is capitalised (e.g. "job 2" vs "Job 2")
+        if verse is None and not (text[start].isupper() or text[start].isdigit()):
+            return None
+        verse_counts = Canon.BOOKS[book][2]
+        if verse is None and len(verse_counts) == 1:
+            # Books of one chapter are referred to by verse alone (e.g. "Jude 3", "Jude 3-5")
+            (chapter, verse) = (1, chapter)
+            (end_chapter, end_verse) = (1, range_end if range_end is not None else verse)
+        elif verse is None:
+            # A chapter, or range of chapters
+            (end_chapter, end_verse) = (range_end if range_end is not None else chapter, None)
+            verse = 1
+        elif range_end_verse is not None:
+            (end_chapter, end_verse) = (range_end, range_end_verse)
+        else:
+            (end_chapter, end_verse) = (chapter, range_end if range_end is not None else verse)
+        if not (1 <= chapter <= end_chapter <= len(verse_counts)):
+            return None
+        if end_verse is None:
+            end_verse = verse_counts[end_chapter - 1]
+        if verse > verse_counts[chapter - 1] or end_verse > verse_counts[end_chapter - 1]:
+            return None
+        start_ordinal = Canon.ordinal(Canon.BOOKS[book][0], chapter, verse)
+        end_ordinal = Canon.ordinal(Canon.BOOKS[book][0], end_chapter, end_verse)
+        if end_ordinal < start_ordinal:
+            return None
+        return ScannedReference(start, match.end(), start_ordinal, end_ordinal, "reference")
+
+    def scan(self, text):
+        """
+        Returns every reference and quotation found in the given text, as ScannedReferences in the order they appear
+        """
+        found = self.references(text)
+        if self.quotes is not None:
+            found.extend(self.quotes.scan(text))
+            found.sort(key=lambda reference: reference.start)
+        return found
+
+    def passages(self, text):
+        """
+        Returns every passage referenced or quoted in the given text, as Passages, each once, in the order they first appear
+        """
+        seen = set()
+        passages = []
+        for reference in self.scan(text):
+            if (reference.startOrdinal, reference.endOrdinal) not in seen:
+                seen.add((reference.startOrdinal, reference.endOrdinal))
+                passages.append(Passage(reference.reference()))
+        return passages
+
+# Shared by filters which aren't given a scanner of their own; recognises references only
+_reference_scanner = None
+
+def referenceScanner():
+    global _reference_scanner
+    if _reference_scanner is None:
+        _reference_scanner = ReferenceScanner()
+    return _reference_scanner
+
+def quoteScanner(fileset_id, cache = None):
+    """
+    Returns a ReferenceScanner recognising quotations of the given fileset as well as references, if any of its chapters are in the
+    given VerseCache (the shared one, if not given), otherwise the shared scanner of references only
+    """
+    if cache is None:
+        from DBPManager import default_cache
+        cache = default_cache()
+    if cache.chapter_count(fileset_id) == 0:
+        return referenceScanner()
+    return ReferenceScanner(quoteIndex(cache, fileset_id))
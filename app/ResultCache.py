@@ -0,0 +1,160 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+
+# -----
+# Result Cache
+# Remembers the top passages found for each question, so a question asked again (or one differing only in members the filters
+# don't read, or in the order of its lists) is answered without scoring anything.
+#
+# Questions are keyed by a hash of just the members the filters read (see `Filter.questionFields()`), with every list sorted,
+# as the order of a list never changes a score. Members a filter only reads for what it finds in them (e.g. the verses referenced
+# in the question's text) are keyed by what it found instead (see `Filter.questionValues()`). Entries expire after a time to live, and the least recently used are dropped once
+# the cache is full.
+#
+# Everything cached belongs to a scope: a fingerprint of the scripture contexts and of the filters (their classes and settings,
+# see `Filter.configuration()`). Whenever it is used with a different scope (e.g. after the corpus is compiled again, or with
+# different filters or weights), everything cached before is dropped.
+# -----
+
+DEFAULT_MAX_ENTRIES = 4096
+# Seconds an entry is kept; None keeps entries until they are evicted or the scope changes
+DEFAULT_TTL = 600
+
+def plain(value):
+    # The value as plain dicts and lists (e.g. records read from a compiled corpus), which can be turned into JSON
+    if isinstance(value, Mapping):
+        return {name : plain(member) for (name, member) in value.items()}
+    if isinstance(value, Sequence) and not isinstance(value, str):
+        return [plain(item) for item in value]
+    return value
+
+def canonical(value):
+    # The (plain) value with the items of every list in a fixed order
+    if isinstance(value, dict):
+        return {name : canonical(member) for (name, member) in value.items()}
+    if isinstance(value, list):
+        return sorted((canonical(item) for item in value), key=lambda item: json.dumps(item, sort_keys=True))
+    return value
+
+def questionKey(question_context, fields = None, filters = ()):
+    """
+    Returns the canonical hash of the given members of a question context (or of all of them, if `fields` is None), and of what
+    the given filters make of the question (see `Filter.questionValues()`). Questions with the same key are scored the same by
+    filters which only read those members.
+    """
+    if fields is None:
+        fields = question_context.keys()
+    content = {field : canonical(plain(question_context.get(field))) for field in fields}
+    for filter in filters:
+        content.update(canonical(plain(filter.questionValues(question_context))))
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+def contextsFingerprint(scripture_contexts):
+    """
+    Returns a fingerprint of the given scripture contexts, which changes whenever they do. Those read from a compiled corpus use
+    the hash of the JSON it was compiled from, so they cost nothing to fingerprint. Other lists can be changed in place at any time,
+    so they are hashed in full every time (which costs about as much as scoring one question against them).
+    """
+    if hasattr(scripture_contexts, "fingerprint"):
+        return scripture_contexts.fingerprint()
+    digest = hashlib.sha256()
+    for scripture_context in scripture_contexts:
+        digest.update(json.dumps(plain(scripture_context), sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+def filtersFingerprint(filters, weights = None):
+    """
+    Returns a fingerprint of the given filters (and how much each counts), which changes if any of them would score differently
+    """
+    return hashlib.sha256(json.dumps([[filter.configuration() for filter in filters], weights], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def questionFields(filters):
+    """
+    Returns every member of a question context that the given filters read, or None if any filter doesn't say
+    """
+    fields = set()
+    for filter in filters:
+        filter_fields = filter.questionFields()
+        if filter_fields is None:
+            return None
+        fields.update(filter_fields)
+    return sorted(fields)
+
+class ResultCache:
+    def __init__(self, max_entries = DEFAULT_MAX_ENTRIES, ttl = DEFAULT_TTL):
+        """
+        Parameters
+        ----------
+        [`max_entries` : `int`]
+            The most results to keep; the least recently used are dropped first
+        [`ttl` : `float`]
+            How many seconds a result is kept for; None to keep them until they are dropped
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.scope = None
+        # Key -> (time it expires, result), least recently used first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def use(self, scope):
+        """
+        Sets the scope of everything cached from now on, dropping what was cached in any other scope
+        """
+        if scope != self.scope:
+            with self.lock:
+                if scope != self.scope:
+                    self.entries.clear()
+                    self.scope = scope
+
+    def useFilters(self, filters, weights = None):
+        """
+        Sets the scope to the given filters and the scripture contexts they score, see `use()`. Returns the question members they read.
+        """
+        self.use(contextsFingerprint(filters[0].scripture_contexts) + filtersFingerprint(filters, weights) if len(filters) > 0 else "")
+        return questionFields(filters)
+
+    def get(self, key):
+        """
+        Returns the result cached with the given key, or None if there isn't one (or it has expired)
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                (expires, result) = entry
+                if expires is None or expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, result):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl if self.ttl is not None else None, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """
+        Returns the number of entries, hits, misses and evictions
+        """
+        with self.lock:
+            return {"entries" : len(self.entries), "hits" : self.hits, "misses" : self.misses, "evictions" : self.evictions}
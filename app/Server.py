@@ -0,0 +1,364 @@
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os.path import realpath
+
+import Utils
+from Corpus import loadCorpus
+from Loader import LoaderException, validate, CONTEXT_SCHEMA
+from MatrixScorer import MatrixScorer
+from Metrics import Metrics
+from Passage import Passage, passageTexts
+from Pipeline import explainPassages
+from ReferenceScanner import quoteScanner, referenceScanner
+from ResultCache import ResultCache, questionKey, DEFAULT_MAX_ENTRIES, DEFAULT_TTL
+
+# A long-running answering service: the corpus, indexes and similar words are loaded once, and then questions are answered over HTTP
+# (on a TCP port, a Unix socket, or both) for as long as it runs, instead of every answer paying for a cold start like main.py.
+#
+# Questions arriving close together are scored together, as one batch (see MatrixScorer), by a pool of worker threads.
+# The top passages of each question are remembered (see ResultCache), so a question asked again is answered without being scored.
+# How long each stage takes (waiting for a batch, each filter, selecting the top passages, the whole request) is kept in latency histograms.
+#
+# Usage:
+#   python3 Server.py [--host <host>] [--port <port>] [--unix <socket path>] [--workers <count>] [--batch-size <count>] [--batch-wait-ms <ms>]
+#                     [--cache-size <count>] [--cache-ttl <seconds>] [--max-body <bytes>] [--quotes <fileset>]
+# Example:
+#   python3 Server.py --port 8080
+#   curl -X POST localhost:8080/answer -d '{"question-text": ..., "people": [], ...}'
+#
+# Endpoints:
+#   POST /answer   A question context (as in Contexts.json), giving {"passages": [{"passage": ..., "score": ...}, ...]}.
+#                  Or {"questions": [...], "k": 3, "texts": false, "explain": false}, giving {"results": [[...], ...]}, one list per question.
+#                  "k", "texts" and "explain" can be given alongside a single question context too.
+#                  With "texts", the text of each passage is included too (fetched from the DBP).
+#                  With "explain", why each passage got its score is included too (worked out for just the returned passages).
+#   GET /metrics   The latency histograms of every stage
+#   GET /health    Whether the service is up, how many passages it is answering from, and how often answers came from the cache
+
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 4
+DEFAULT_BATCH_SIZE = 16
+# How long the first question of a batch waits for others to join it
+DEFAULT_BATCH_WAIT = 0.005
+DEFAULT_K = 3
+# The largest request body accepted, in bytes
+DEFAULT_MAX_BODY = 8 * 1024 * 1024
+# The fileset whose verses are recognised when quoted in a question, if any of it is in the verse cache
+DEFAULT_QUOTE_FILESET = "ENGESV"
+# How many connections can be waiting to be accepted
+BACKLOG = 1024
+
+REASONS = {200 : "OK", 400 : "Bad Request", 404 : "Not Found", 405 : "Method Not Allowed", 413 : "Payload Too Large", 431 : "Request Header Fields Too Large",
+           500 : "Internal Server Error"}
+
+# The members of a request which say how to answer, rather than being part of a question
+OPTIONS = ("k", "texts", "explain")
+
+class RequestException(Exception): ...
+
+class AnsweringService:
+    def __init__(self, scripture_path = None, workers = DEFAULT_WORKERS, batch_size = DEFAULT_BATCH_SIZE, batch_wait = DEFAULT_BATCH_WAIT,
+                 cache_size = DEFAULT_MAX_ENTRIES, cache_ttl = DEFAULT_TTL, max_body = DEFAULT_MAX_BODY, quote_fileset = DEFAULT_QUOTE_FILESET):
+        """
+        Loads the scripture corpus and builds everything needed to score questions against it
+
+        Parameters
+        ----------
+        [`scripture_path` : `str`]
+            The scripture contexts to answer from; Scriptures.json if not given
+        [`workers` : `int`]
+            How many batches can be scored at once
+        [`batch_size` : `int`]
+            The most questions scored together
+        [`batch_wait` : `float`]
+            How many seconds the first question of a batch waits for others to join it
+        [`cache_size` : `int`]
+            How many questions' answers to remember; 0 to always score
+        [`cache_ttl` : `float`]
+            How many seconds an answer is remembered for
+        [`max_body` : `int`]
+            The largest request body accepted, in bytes; larger requests are answered with 413
+        [`quote_fileset` : `str`]
+            The fileset whose cached verses are recognised when quoted in a question (see `ReferenceScanner.quoteScanner()`);
+            None to recognise references only
+        """
+        if scripture_path is None:
+            scripture_path = Utils.datasetsPath(realpath(__file__), "Scriptures.json", "hack2021")
+        self.metrics = Metrics()
+        with self.metrics.timer("load"):
+            corpus = loadCorpus(scripture_path)
+            self.scorer = MatrixScorer(corpus.scriptureContexts(), corpus.index(), corpus.synonyms())
+            scanner = quoteScanner(quote_fileset) if quote_fileset is not None else referenceScanner()
+            self.filters = self.scorer.defaultFilters(scanner=scanner)
+            self.cache = ResultCache(cache_size, cache_ttl) if cache_size > 0 else None
+            # The corpus and filters don't change while the service runs, so neither does the cache's scope
+            self.cache_fields = self.cache.useFilters(self.filters) if self.cache is not None else None
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_body = max_body
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # Explaining briefly swaps the filters' scripture maps (see `Filter.explain()`), so only one explanation is worked out at a time
+        self.explain_lock = threading.Lock()
+        self.servers = []
+        self.tasks = []
+
+    async def start(self, host = None, port = None, unix_path = None):
+        """
+        Starts answering on the given TCP host and port, and/or the given Unix socket
+        """
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(self.workers)
+        self.tasks.append(asyncio.ensure_future(self.batcher()))
+        if port is not None:
+            self.servers.append(await asyncio.start_server(self.handleConnection, host, port, backlog=BACKLOG))
+        if unix_path is not None:
+            if os.path.exists(unix_path):
+                os.remove(unix_path)
+            self.servers.append(await asyncio.start_unix_server(self.handleConnection, unix_path, backlog=BACKLOG))
+        return self
+
+    async def stop(self):
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        for task in self.tasks:
+            task.cancel()
+        self.executor.shutdown(wait=True)
+
+    def ports(self):
+        # The TCP ports being listened on (useful when started on port 0)
+        return [socket.getsockname()[1] for server in self.servers for socket in server.sockets if type(socket.getsockname()) == tuple]
+
+    # ----------
+    # Scoring
+    # ----------
+
+    async def answer(self, question_contexts, k = DEFAULT_K):
+        """
+        Returns the top `k` (passage reference, score) of each of the given questions, which are scored in batches with any other
+        questions waiting at the same time
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for question_context in question_contexts:
+            future = loop.create_future()
+            cached = self.cache.get(self.cacheKey(question_context, k)) if self.cache is not None else None
+            if cached is not None:
+                future.set_result(cached)
+            else:
+                await self.queue.put((question_context, k, future, time.perf_counter()))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    def cacheKey(self, question_context, k):
+        return questionKey(question_context, self.cache_fields, self.filters) + ":" + str(k)
+
+    async def batcher(self):
+        # Gathers waiting questions into batches, and hands each one to a worker as soon as one is free
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            if self.batch_wait > 0 and len(batch) < self.batch_size:
+                await asyncio.sleep(self.batch_wait)
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            await self.slots.acquire()
+            work = loop.run_in_executor(self.executor, self.scoreBatch, batch)
+            work.add_done_callback(lambda done, batch=batch: self.finishBatch(batch, done))
+
+    def finishBatch(self, batch, done):
+        self.slots.release()
+        exception = done.exception()
+        for (i, (_, _, future, _)) in enumerate(batch):
+            if future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(done.result()[i])
+        if exception is None and self.cache is not None:
+            for (i, (question_context, k, _, _)) in enumerate(batch):
+                self.cache.put(self.cacheKey(question_context, k), done.result()[i])
+
+    def scoreBatch(self, batch):
+        # Runs on a worker thread
+        started = time.perf_counter()
+        for (_, _, _, enqueued) in batch:
+            self.metrics.observe("queue", started - enqueued)
+        timings = {}
+        with self.metrics.timer("score"):
+            scores = self.scorer.scoreBatch(self.filters, [question_context for (question_context, _, _, _) in batch], None, timings)
+        # Filters are timed for the whole batch at once
+        for (name, seconds) in timings.items():
+            self.metrics.observe("filter." + name, seconds)
+        with self.metrics.timer("top"):
+            return [self.scorer.top(question_scores, k) for (question_scores, (_, k, _, _)) in zip(scores, batch)]
+
+    def texts(self, ranked):
+        # The text of every ranked passage of every question, fetched together
+        passages = [Passage(passage_ref) for results in ranked for (passage_ref, _) in results]
+        with self.metrics.timer("texts"):
+            texts = iter(passageTexts(passages))
+        return [[next(texts) for _ in results] for results in ranked]
+
+    def explain(self, question_contexts, ranked):
+        # Why each ranked passage of every question got its score
+        with self.explain_lock, self.metrics.timer("explain"):
+            return [explainPassages(self.filters, question_context, [passage_ref for (passage_ref, _) in results])
+                    for (question_context, results) in zip(question_contexts, ranked)]
+
+    # ----------
+    # HTTP
+    # ----------
+
+    async def handleConnection(self, reader, writer):
+        try:
+            while True:
+                # A line longer than the stream's limit makes readline() raise ValueError, leaving the rest of the line unread, so the
+                # connection can't be read any further
+                try:
+                    request_line = await reader.readline()
+                except ValueError:
+                    await self.respond(writer, "HTTP/1.1", 400, {"error" : "Request line too long"}, False)
+                    break
+                if not request_line:
+                    break
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3:
+                    break
+                (method, target, version) = parts
+                headers = {}
+                try:
+                    while True:
+                        line = (await reader.readline()).decode("latin-1")
+                        if line in ("\r\n", "\n", ""):
+                            break
+                        (name, _, value) = line.partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                except ValueError:
+                    await self.respond(writer, version, 431, {"error" : "Header line too long"}, False)
+                    break
+                # Without a usable length the end of the body isn't known, so the connection can't carry another request
+                try:
+                    length = int(headers.get("content-length", "0"))
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self.respond(writer, version, 400, {"error" : "Invalid Content-Length"}, False)
+                    break
+                if length > self.max_body:
+                    await self.respond(writer, version, 413, {"error" : "Bodies can be at most " + str(self.max_body) + " bytes"}, False)
+                    break
+                body = await reader.readexactly(length)
+
+                started = time.perf_counter()
+                (status, payload) = await self.route(method, target.split("?")[0], body)
+                self.metrics.observe("request", time.perf_counter() - started)
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                await self.respond(writer, version, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, version, status, payload, keep_alive):
+        content = json.dumps(payload).encode("utf-8")
+        writer.write((version + " " + str(status) + " " + REASONS[status] + "\r\n" +
+                      "Content-Type: application/json\r\n" +
+                      "Content-Length: " + str(len(content)) + "\r\n" +
+                      "Connection: " + ("keep-alive" if keep_alive else "close") + "\r\n\r\n").encode("latin-1") + content)
+        await writer.drain()
+
+    async def route(self, method, path, body):
+        try:
+            if path == "/answer":
+                if method != "POST":
+                    return (405, {"error" : "Use POST"})
+                return (200, await self.answerRequest(body))
+            elif path == "/metrics":
+                return (200, self.metrics.snapshot())
+            elif path == "/health":
+                return (200, dict({"status" : "ok", "passages" : len(self.scorer.passage_refs)},
+                                  **({"cache" : self.cache.stats()} if self.cache is not None else {})))
+            return (404, {"error" : "No such endpoint " + path})
+        except RequestException as e:
+            return (400, {"error" : str(e)})
+        except Exception as e:
+            print("Error answering " + path + ": " + str(e))
+            return (500, {"error" : str(e)})
+
+    async def answerRequest(self, body):
+        try:
+            request = json.loads(body)
+        except ValueError as e:
+            raise RequestException("Invalid JSON: " + str(e))
+        if type(request) != dict:
+            raise RequestException("Expected an object")
+        single = "questions" not in request
+        # The options of a single question are given alongside its context, so they aren't part of it
+        question_contexts = [{member : value for (member, value) in request.items() if member not in OPTIONS}] if single else request["questions"]
+        if type(question_contexts) != list:
+            raise RequestException("\"questions\" should be a list")
+        k = request.get("k", DEFAULT_K)
+        if type(k) != int or k < 1:
+            raise RequestException("\"k\" should be a positive whole number")
+        for option in ("texts", "explain"):
+            if type(request.get(option, False)) != bool:
+                raise RequestException("\"" + option + "\" should be true or false")
+        for (i, question_context) in enumerate(question_contexts):
+            try:
+                validate(question_context, CONTEXT_SCHEMA)
+            except LoaderException as e:
+                raise RequestException("Question " + str(i + 1) + ": " + str(e))
+
+        ranked = await self.answer(question_contexts, k)
+        texts = None
+        if request.get("texts", False):
+            texts = await asyncio.get_running_loop().run_in_executor(self.executor, self.texts, ranked)
+        explanations = None
+        if request.get("explain", False):
+            explanations = await asyncio.get_running_loop().run_in_executor(self.executor, self.explain, question_contexts, ranked)
+        results = []
+        for (i, passages) in enumerate(ranked):
+            results.append([dict({"passage" : passage_ref, "score" : score},
+                                 **({"text" : texts[i][j]} if texts else {}),
+                                 **({"reasons" : [str(event) for event in explanations[i][passage_ref]]} if explanations else {}))
+                            for (j, (passage_ref, score)) in enumerate(passages)])
+        return {"passages" : results[0]} if single else {"results" : results}
+
+async def serve(arguments):
+    service = AnsweringService(workers=arguments.workers, batch_size=arguments.batch_size, batch_wait=arguments.batch_wait_ms / 1000,
+                               cache_size=arguments.cache_size, cache_ttl=arguments.cache_ttl, max_body=arguments.max_body,
+                               quote_fileset=arguments.quotes or None)
+    await service.start(arguments.host, arguments.port, arguments.unix)
+    print("Answering on " + ", ".join(([arguments.host + ":" + str(arguments.port)] if arguments.port else []) + ([arguments.unix] if arguments.unix else [])))
+    await asyncio.Event().wait()
+
+if __name__ == "__main__":
+    import nltk
+    parser = argparse.ArgumentParser(description="Answers questions with passages of Scripture, over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="0 to listen on the Unix socket only")
+    parser.add_argument("--unix", default=None, help="Path of a Unix socket to listen on as well")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--batch-wait-ms", type=float, default=DEFAULT_BATCH_WAIT * 1000)
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_ENTRIES, help="0 to score every question")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_TTL)
+    parser.add_argument("--max-body", type=int, default=DEFAULT_MAX_BODY, help="The largest request body accepted, in bytes")
+    parser.add_argument("--quotes", default=DEFAULT_QUOTE_FILESET, help="The cached fileset whose verses are recognised when quoted; \"\" for none")
+    arguments = parser.parse_args()
+    if arguments.port == 0:
+        arguments.port = None
+    # WordNet is needed if the scriptures have to be compiled
+    nltk.download('wordnet')
+    asyncio.run(serve(arguments))
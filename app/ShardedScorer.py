@@ -0,0 +1,161 @@
+import heapq
+import multiprocessing
+import os
+import threading
+from os.path import realpath
+
+import Utils
+from Corpus import Corpus, loadCorpus
+from ContextIndex import ContextIndex
+from MatrixScorer import MatrixScorer
+from Passage import Passage
+
+# -----
+# Sharded Scorer
+# Scores questions across several processes, so every core is used. The passages are split into shards (every listing of
+# a passage goes to the same shard, so it scores exactly as it would unsharded), each held by its own worker process with its own
+# MatrixScorer. A batch of questions is sent to every worker at once, each returns the top passages of its shard, and those are
+# merged into the overall top passages.
+#
+# The workers don't receive the corpus: each maps the same compiled corpus file (see Corpus), so it is read from disk once and its
+# pages are shared between all of them. Only the questions and the top passages of each shard pass between processes.
+# -----
+
+def shardOf(row, row_count, shard_count):
+    # Passages are split into contiguous runs (in the order they first appear) of about the same size
+    return row * shard_count // max(row_count, 1)
+
+def shardContexts(corpus, shard, shard_count):
+    # The scripture contexts of the passages in the given shard
+    scripture_contexts = corpus.scriptureContexts()
+    rows = {}
+    for scripture_context in scripture_contexts:
+        rows.setdefault(scripture_context["passage"], len(rows))
+    return [scripture_context for scripture_context in scripture_contexts
+            if shardOf(rows[scripture_context["passage"]], len(rows), shard_count) == shard]
+
+def shardWorker(connection, corpus_path, shard, shard_count):
+    # Runs in each worker process: builds a scorer over its shard, then ranks each batch of questions it is sent until told to stop
+    try:
+        corpus = Corpus(corpus_path)
+        scripture_contexts = shardContexts(corpus, shard, shard_count)
+        scorer = MatrixScorer(scripture_contexts, ContextIndex(scripture_contexts), corpus.synonyms())
+        filters = scorer.defaultFilters()
+        connection.send(("ready", len(scorer.passage_refs)))
+    except Exception as e:
+        connection.send(("error", "Shard " + str(shard) + " failed to load: " + str(e)))
+        return
+
+    while True:
+        message = connection.recv()
+        if message[0] == "stop":
+            break
+        (_, question_contexts, k, weights) = message
+        try:
+            scores = scorer.scoreBatch(filters, question_contexts, weights)
+            # The canonical key goes with each passage, so that ties are broken in the same way when the shards are merged
+            results = [[(passage_ref, score, Passage(passage_ref).canonicalKey()) for (passage_ref, score) in scorer.top(question_scores, k)]
+                       for question_scores in scores]
+            connection.send(("ok", results))
+        except Exception as e:
+            connection.send(("error", "Shard " + str(shard) + ": " + str(e)))
+
+def mergeKey(result):
+    (_, score, canonical_key) = result
+    return (-score, canonical_key)
+
+class ShardedScorer:
+    def __init__(self, scripture_path = None, shards = None, corpus_path = None):
+        """
+        Starts the worker processes, each of which loads and indexes its shard of the scripture contexts
+
+        Parameters
+        ----------
+        [`scripture_path` : `str`]
+            The scripture contexts to score; Scriptures.json if not given. It is compiled into a corpus first, if necessary.
+        [`shards` : `int`]
+            How many shards (and worker processes) to split the passages into; one per core if not given
+        [`corpus_path` : `str`]
+            The compiled corpus to use, instead of compiling `scripture_path`
+
+        Raises
+        ------
+        Exception if a worker fails to load its shard
+        """
+        if corpus_path is None:
+            if scripture_path is None:
+                scripture_path = Utils.datasetsPath(realpath(__file__), "Scriptures.json", "hack2021")
+            corpus_path = loadCorpus(scripture_path).path
+        self.shard_count = shards if shards is not None else os.cpu_count() or 1
+        # Batches are sent to every worker and answered in order, so only one batch can be out at a time
+        self.lock = threading.Lock()
+        self.connections = []
+        self.processes = []
+        for shard in range(self.shard_count):
+            (connection, worker_connection) = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=shardWorker, args=(worker_connection, corpus_path, shard, self.shard_count), daemon=True)
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+        self.passage_count = sum(self.receiveAll())
+
+    def receiveAll(self):
+        # One reply from every shard, read before raising any error, so that no reply is left to be taken for the next request's
+        replies = [connection.recv() for connection in self.connections]
+        for (status, result) in replies:
+            if status == "error":
+                raise Exception(result)
+        return [result for (_, result) in replies]
+
+    def rank(self, question_contexts, k, weights = None):
+        """
+        Finds the best `k` passages for each of the given questions, with the same filters as main.py, just as `MatrixScorer.rank()` does.
+        Safe to call from several threads at once, though their batches are scored one after another.
+
+        Parameters
+        ----------
+        `question_contexts` : `list`
+            The questions, as found in the "context" list of Contexts.json
+        `k` : `int`
+            How many passages to return for each question
+        [`weights` : `dict`]
+            Filter class name -> how much that filter's scores count. Filters that aren't in it count once.
+
+        Returns
+        -------
+        `list`
+            For each question, in the same order as given, the (passage reference, score) of its top passages, highest first
+        """
+        # Questions read from a compiled corpus are turned back into plain objects to be sent
+        question_contexts = [dict(question_context) for question_context in question_contexts]
+        with self.lock:
+            for connection in self.connections:
+                connection.send(("rank", question_contexts, k, weights))
+            shard_results = self.receiveAll()
+        merged = []
+        for i in range(len(question_contexts)):
+            candidates = [result for results in shard_results for result in results[i]]
+            merged.append([(passage_ref, score) for (passage_ref, score, _) in heapq.nsmallest(k, candidates, key=mergeKey)])
+        return merged
+
+    def close(self):
+        """
+        Stops the worker processes
+        """
+        with self.lock:
+            for connection in self.connections:
+                try:
+                    connection.send(("stop",))
+                except (BrokenPipeError, OSError):
+                    pass
+            for process in self.processes:
+                process.join()
+            self.connections = []
+            self.processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+        return False
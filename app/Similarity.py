@@ -0,0 +1,271 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import zlib
+import numpy as np
+
+from VerseCache import DEFAULT_CACHE_DIR
+
+# -----
+# Similarity
+# Finds the questions, among those listed for each passage in the scripture contexts, which are most similar to a new question,
+# entirely in-process.
+#
+# Every question is turned into a TF-IDF weighted vector of its words and pairs of adjacent words. Rather than keeping a vocabulary,
+# each word (or pair) is hashed into one of a fixed number of dimensions, so vectors of questions never seen before line up with the
+# corpus without any lookup. Vectors are normalised, so the similarity of two questions is the dot product of their vectors
+# (their cosine similarity, from 0 for nothing in common to 1 for the same words).
+#
+# Nearest neighbours are found by comparing against every question in one matrix product when there are few enough of them, and
+# otherwise through an inverted file (IVF) index: the questions are clustered, and only the clusters closest to the new question are
+# searched.
+# -----
+
+# Each corpus has its own file, named after (the start of) the fingerprint of its questions
+DEFAULT_SIMILARITY_FILE = "similarity.{}.npz"
+
+DIMENSIONS = 4096
+
+# Above this many questions, an IVF index is used rather than comparing against every one
+IVF_THRESHOLD = 20000
+# How many clusters of the IVF index are searched for each question
+IVF_PROBES = 8
+IVF_ITERATIONS = 10
+IVF_SAMPLE_PER_CLUSTER = 64
+
+# How many of the nearest questions are looked at first when scoring passages; more are looked at while they are still similar enough
+NEAREST_QUESTIONS = 50
+
+WORD = re.compile(r"[a-z0-9']+")
+
+def features(text):
+    """
+    Returns the words of the given text, and each pair of adjacent words
+    """
+    words = WORD.findall(text.lower())
+    return words + [words[i] + " " + words[i + 1] for i in range(len(words) - 1)]
+
+def bucket(feature, dimensions):
+    # A hash which is the same in every process, so saved vectors stay valid
+    return zlib.crc32(feature.encode("utf-8")) % dimensions
+
+def termCounts(texts, dimensions):
+    # One row per text, of how many times each dimension's features appear
+    counts = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for (row, text) in enumerate(texts):
+        for feature in features(text):
+            counts[row, bucket(feature, dimensions)] += 1
+    return counts
+
+def normalise(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+def topRows(similarities, rows, k):
+    # The (rows, similarities) of the k highest similarities, highest first
+    if k < len(similarities):
+        best = np.argpartition(-similarities, k - 1)[:k]
+        rows = rows[best]
+        similarities = similarities[best]
+    order = np.argsort(-similarities, kind="stable")
+    return (rows[order], similarities[order])
+
+def fingerprint(question_pairs, dimensions):
+    # Identifies the questions (and how they were vectorised), so a saved index is only used for the same corpus
+    digest = hashlib.sha256(json.dumps([dimensions, question_pairs]).encode("utf-8"))
+    return digest.hexdigest()
+
+class BruteForceIndex:
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def search(self, vector, k):
+        return topRows(self.matrix @ vector, np.arange(len(self.matrix)), k)
+
+class IVFIndex:
+    def __init__(self, matrix, centroids = None, assignments = None, probes = IVF_PROBES):
+        """
+        Clusters the rows of the given (normalised) matrix, unless the clusters are given, and files every row under its cluster
+        """
+        self.matrix = matrix
+        self.probes = probes
+        if centroids is None:
+            (centroids, assignments) = self.cluster(matrix, max(1, int(math.sqrt(len(matrix)))))
+        self.centroids = centroids
+        self.assignments = assignments
+        # The rows of each cluster are together in list_rows; those of cluster c start at list_offsets[c]
+        self.list_rows = np.argsort(assignments, kind="stable")
+        self.list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=len(centroids)))))
+
+    def cluster(self, matrix, count):
+        # Spherical k-means: rows are assigned to the centroid they are most similar to, and centroids are the normalised mean of their rows
+        # The centroids are trained on a sample of the rows, which places them about as well in a fraction of the time
+        random = np.random.default_rng(0)
+        sample = matrix[random.choice(len(matrix), min(len(matrix), IVF_SAMPLE_PER_CLUSTER * count), replace=False)]
+        centroids = sample[:count]
+        for _ in range(IVF_ITERATIONS):
+            (assignments, sums) = self.assign(sample, centroids, True)
+            # A cluster left empty keeps its old centroid
+            empty = np.bincount(assignments, minlength=count) == 0
+            sums[empty] = centroids[empty]
+            centroids = normalise(sums)
+        return (centroids, self.assign(matrix, centroids))
+
+    def assign(self, matrix, centroids, with_sums = False, chunk = 4096):
+        # The cluster of each row, and (if asked for) the sum of the rows of each cluster. Rows are taken a chunk at a time to bound memory
+        assignments = np.empty(len(matrix), dtype=np.intp)
+        sums = np.zeros_like(centroids)
+        for start in range(0, len(matrix), chunk):
+            rows = matrix[start:start + chunk]
+            assignments[start:start + chunk] = np.argmax(rows @ centroids.T, axis=1)
+            if with_sums:
+                # Adding up the rows of each cluster as a product with a one-hot matrix is far faster than adding them one by one
+                membership = np.zeros((len(centroids), len(rows)), dtype=matrix.dtype)
+                membership[assignments[start:start + chunk], np.arange(len(rows))] = 1
+                sums += membership @ rows
+        return (assignments, sums) if with_sums else assignments
+
+    def search(self, vector, k):
+        probed = np.argsort(-(self.centroids @ vector))[:self.probes]
+        rows = np.concatenate([self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probed])
+        return topRows(self.matrix[rows] @ vector, rows, k)
+
+class SimilarityIndex:
+    def __init__(self, scripture_contexts, path = None, dimensions = DIMENSIONS, ivf_threshold = IVF_THRESHOLD):
+        """
+        Vectorises the questions associated with each passage in the given scripture contexts, and indexes them for nearest-neighbour
+        search. The vectors (and the index) are saved, and loaded again instead of being rebuilt as long as the questions haven't changed.
+
+        Parameters
+        ----------
+        `scripture_contexts` : `list`
+            The scripture contexts, as found in the "scripture" list of Scriptures.json
+        [`path` : `str`]
+            The file the vectors are saved in and loaded from. If not given, `DEFAULT_SIMILARITY_FILE` in the cache folder is used,
+            so each corpus keeps its own.
+            `":memory:"` can be used for vectors that are never saved.
+        [`dimensions` : `int`]
+            How many dimensions words are hashed into
+        [`ivf_threshold` : `int`]
+            Above this many questions, an IVF index is used rather than comparing against every question
+        """
+
+        self.dimensions = dimensions
+        # One (passage reference, question) pair per row of the matrix
+        question_pairs = [(scripture_context["passage"], question) for scripture_context in scripture_contexts
+                                                                    for question in scripture_context["questions"]]
+        self.passage_refs = [passage_ref for (passage_ref, _) in question_pairs]
+        self.questions = [question for (_, question) in question_pairs]
+        self.fingerprint = fingerprint(question_pairs, dimensions)
+        if path is None:
+            os.makedirs(DEFAULT_CACHE_DIR, exist_ok=True)
+            path = os.path.join(DEFAULT_CACHE_DIR, DEFAULT_SIMILARITY_FILE.format(self.fingerprint[:16]))
+        self.path = path
+        use_ivf = len(question_pairs) > ivf_threshold
+
+        if not self.load(use_ivf):
+            counts = termCounts(self.questions, dimensions)
+            # Smoothed inverse document frequency: features found in fewer questions count for more
+            document_frequencies = np.count_nonzero(counts, axis=0)
+            self.idf = (np.log((1 + len(counts)) / (1 + document_frequencies)) + 1).astype(np.float32)
+            self.matrix = self.weigh(counts)
+            self.index = IVFIndex(self.matrix) if use_ivf else BruteForceIndex(self.matrix)
+            self.save()
+
+    def weigh(self, counts):
+        # Sublinear term frequency (a word said twice doesn't count double) times inverse document frequency, normalised
+        weighted = np.zeros_like(counts)
+        np.log(counts, out=weighted, where=counts > 0)
+        weighted[counts > 0] += 1
+        return normalise(weighted * self.idf)
+
+    def load(self, use_ivf):
+        if self.path == ":memory:" or not os.path.exists(self.path):
+            return False
+        try:
+            with np.load(self.path, allow_pickle=False) as saved:
+                if str(saved["fingerprint"]) != self.fingerprint or ("centroids" in saved) != use_ivf:
+                    return False
+                self.idf = saved["idf"]
+                self.matrix = saved["matrix"]
+                if use_ivf:
+                    self.index = IVFIndex(self.matrix, saved["centroids"], saved["assignments"])
+                else:
+                    self.index = BruteForceIndex(self.matrix)
+            return True
+        except Exception as e:
+            # A broken file just means the questions are vectorised again
+            print("Ignoring unreadable similarity index " + self.path + ": " + str(e))
+            return False
+
+    def save(self):
+        if self.path == ":memory:":
+            return
+        arrays = {"fingerprint" : np.array(self.fingerprint), "idf" : self.idf, "matrix" : self.matrix}
+        if isinstance(self.index, IVFIndex):
+            arrays["centroids"] = self.index.centroids
+            arrays["assignments"] = self.index.assignments
+        # Write to a temporary file first, so a reader never sees half a file
+        temporary_path = self.path + "." + str(os.getpid()) + ".tmp"
+        with open(temporary_path, "wb") as handle:
+            np.savez(handle, **arrays)
+        os.replace(temporary_path, self.path)
+
+    def vector(self, text):
+        """
+        Returns the normalised TF-IDF vector of the given text
+        """
+        return self.weigh(termCounts([text], self.dimensions))[0]
+
+    def nearest(self, vector, k = NEAREST_QUESTIONS):
+        """
+        Returns the (passage reference, question, similarity) of the (at most) `k` questions most similar to the given vector, most similar first
+        """
+        if len(self.questions) == 0:
+            return []
+        (rows, similarities) = self.index.search(vector, k)
+        return [(self.passage_refs[row], self.questions[row], float(similarity)) for (row, similarity) in zip(rows, similarities)]
+
+    def passageSimilarities(self, vector, threshold, k = NEAREST_QUESTIONS):
+        """
+        Returns the passages having a question with a similarity of at least `threshold` to the given vector. The `k` nearest questions
+        are looked at first, and `k` is doubled for as long as the last of them is still similar enough, so no passage is left out for
+        having its question just past the first `k`.
+
+        Returns
+        -------
+        `dict`
+            Passage reference -> similarity of its most similar question
+        """
+        k = max(1, k)
+        while True:
+            nearest = self.nearest(vector, k)
+            # Fewer than k means every question there is to search was looked at
+            if len(nearest) < k or nearest[-1][2] < threshold:
+                break
+            k *= 2
+        similarities = {}
+        for (passage_ref, _, similarity) in nearest:
+            if similarity >= threshold and similarity > similarities.get(passage_ref, 0):
+                similarities[passage_ref] = similarity
+        return similarities
+
+# Indexes already built (or loaded) in this process, by the fingerprint of their questions
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def similarityIndex(scripture_contexts):
+    """
+    Returns the process-wide SimilarityIndex of the questions of the given scripture contexts, creating (or loading) it if necessary
+    """
+    question_pairs = [(scripture_context["passage"], question) for scripture_context in scripture_contexts
+                                                                for question in scripture_context["questions"]]
+    key = fingerprint(question_pairs, DIMENSIONS)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = SimilarityIndex(scripture_contexts)
+        return _indexes[key]
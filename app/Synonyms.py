@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+from functools import lru_cache
+from nltk.corpus import wordnet
+
+from VerseCache import DEFAULT_CACHE_DIR
+
+DEFAULT_SYNONYMS_FILE = "synonyms.json"
+
+# How many expansions of words not known ahead of time (i.e. from questions) to remember
+QUESTION_CACHE_SIZE = 4096
+
+class SynonymCache:
+    def __init__(self, path = None, question_cache_size = QUESTION_CACHE_SIZE):
+        """
+        Remembers the similar words (the WordNet lemma names of all the synsets) of each word, so that WordNet only has to be
+        asked about a word once. Words from the scripture contexts are expanded ahead of time with `precompute()` and saved to disk,
+        so a new process starts with them already known. Any other word (i.e. from a question) is expanded on first use and kept
+        in a least-recently-used cache.
+
+        Parameters
+        ----------
+        [`path` : `str`]
+            The JSON file the precomputed expansions are saved in and loaded from. If not given, `DEFAULT_SYNONYMS_FILE` in the
+            cache folder is used. `":memory:"` can be used for expansions that are never saved.
+        [`question_cache_size` : `int`]
+            How many expansions of words which weren't precomputed to remember
+        """
+
+        if path is None:
+            os.makedirs(DEFAULT_CACHE_DIR, exist_ok=True)
+            path = os.path.join(DEFAULT_CACHE_DIR, DEFAULT_SYNONYMS_FILE)
+        self.path = path
+        self.lock = threading.Lock()
+        # Word -> frozenset of similar words, for every precomputed word
+        self.table = {}
+        self.lookups = 0
+        self.table_hits = 0
+        self.cachedLookup = lru_cache(maxsize=question_cache_size)(self.wordnetLemmas)
+        if path != ":memory:" and os.path.exists(path):
+            try:
+                with open(path, "r") as handle:
+                    self.table = {word : frozenset(lemmas) for (word, lemmas) in json.load(handle).items()}
+            except Exception as e:
+                # A broken file just means the words are expanded again
+                print("Ignoring unreadable synonyms " + path + ": " + str(e))
+
+    def wordnetLemmas(self, word):
+        lemmas = set()
+        for synset in wordnet.synsets(word):
+            lemmas.update(synset.lemma_names())
+        return frozenset(lemmas)
+
+    def lemmas(self, word):
+        """
+        Returns the set of words similar to the given word
+        """
+
+        self.lookups += 1
+        lemmas = self.table.get(word)
+        if lemmas is not None:
+            self.table_hits += 1
+            return lemmas
+        return self.cachedLookup(word)
+
+    def expand(self, words):
+        """
+        Returns the set of words similar to any of the given words
+        """
+
+        similar = set()
+        for word in words:
+            similar.update(self.lemmas(word))
+        return similar
+
+    def precompute(self, scripture_contexts):
+        """
+        Expands every subject and action of the question types in the given scripture contexts, and saves the expansions if there were new ones
+
+        Returns
+        -------
+        `int`
+            The number of words which had to be looked up in WordNet
+        """
+
+        added = 0
+        with self.lock:
+            for scripture_context in scripture_contexts:
+                for question_type in scripture_context["question-types"]:
+                    for member in ("subject", "action"):
+                        words = question_type[member]
+                        for word in [words] if type(words) == str else words:
+                            if word not in self.table:
+                                self.table[word] = self.wordnetLemmas(word)
+                                added += 1
+            if added > 0:
+                self.save()
+        return added
+
+    def save(self):
+        if self.path == ":memory:":
+            return
+        # Write to a temporary file first so that other processes never see half the expansions
+        temporary_path = self.path + "." + str(os.getpid()) + ".tmp"
+        with open(temporary_path, "w") as handle:
+            json.dump({word : sorted(lemmas) for (word, lemmas) in self.table.items()}, handle, indent=4)
+        os.replace(temporary_path, self.path)
+
+    def stats(self):
+        """
+        Returns the number of lookups, and how they were answered
+
+        Returns
+        -------
+        dict
+            Object with the number of lookups, precomputed hits, question cache hits and misses (i.e. WordNet lookups)
+        """
+
+        question_info = self.cachedLookup.cache_info()
+        return {
+            "lookups" : self.lookups,
+            "precomputed-hits" : self.table_hits,
+            "question-cache-hits" : question_info.hits,
+            "wordnet-lookups" : question_info.misses,
+            "precomputed-words" : len(self.table)
+        }
@@ -0,0 +1,490 @@
+import hashlib
+import heapq
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from itertools import accumulate
+from nltk.stem import PorterStemmer
+
+import Canon
+from ReferenceScanner import osisReference
+from VerseCache import DEFAULT_CACHE_DIR
+
+# -----
+# Text Index
+# An inverted index of what the verses of a Bible say, built from the chapters of a fileset held in the VerseCache, so passages
+# can be searched (and scored) by their text without calling the DBP.
+#
+# Words are lowercased and stemmed (Porter), so "forgive", "forgiven" and "forgiveness" are the same term. Each term has a posting
+# for every time it occurs: the verse's ordinal (see Canon) and the word's position within the verse, so phrases (words at
+# consecutive positions) can be searched as well as words. Verses are ranked with BM25.
+#
+# Chapters are indexed one at a time, and only once: each chapter's checksum is kept, so updating the index from the cache only reads
+# the chapters added (or changed) since. The index is saved as a binary file of arrays which is memory-mapped when loaded, like a
+# compiled corpus (see Corpus); chapters added after loading are kept apart in memory until it is saved again.
+# -----
+
+MAGIC = b"AGTEXTIX"
+FORMAT_VERSION = 1
+
+# Magic, format version, number of sections; then for each section its name, offset and length in bytes
+HEADER = struct.Struct("<8sII")
+SECTION = struct.Struct("<32sQQ")
+
+# BM25's term frequency saturation and document length normalisation
+K1 = 1.2
+B = 0.75
+
+# A word, possibly with an apostrophe (e.g. God's, don't)
+WORD = re.compile(r"[a-z0-9]+(?:['’][a-z]+)?")
+# A phrase within a query, e.g. "born again"
+PHRASE = re.compile(r"\"([^\"]*)\"")
+
+_stemmer = PorterStemmer()
+# Word -> its stem; there are only so many words in a Bible, and stemming each one every time it is seen would be most of the work
+_stems = {}
+
+def stem(word):
+    term = _stems.get(word)
+    if term is None:
+        term = _stems[word] = _stemmer.stem(word)
+    return term
+
+def terms(text):
+    """
+    Returns the terms of the given text, in order: its words lowercased, without possessive 's, and stemmed
+    """
+    found = []
+    for word in WORD.findall(text.lower()):
+        word = word.replace("’", "'")
+        if word.endswith("'s"):
+            word = word[:-2]
+        found.append(stem(word.replace("'", "")))
+    return found
+
+def chapterRange(book, chapter):
+    # The (first, last) ordinal of the given chapter, or None if it isn't in the canon
+    first = Canon.ordinal(book, chapter, 1)
+    if first is None:
+        return None
+    return (first, first + Canon.BOOKS[Canon.bookIndex(book)][2][chapter - 1] - 1)
+
+class TextIndex:
+    def __init__(self, path = None):
+        """
+        Parameters
+        ----------
+        [`path` : `str`]
+            Where the index is saved; if a saved index is there, it is memory-mapped. If not given, the index is only kept in memory.
+
+        Raises
+        ------
+        Exception if the file isn't a saved text index, or was saved by a different version of this module
+        """
+        self.path = path
+        self.map = None
+        # The saved postings: term id -> where its postings start in `saved_ordinals` and `saved_positions`, by ordinal then position
+        self.saved_terms = []
+        self.saved_term_ids = None
+        self.saved_offsets = array("I", [0])
+        self.saved_ordinals = array("I")
+        self.saved_positions = array("H")
+        # (first, last) ordinals of saved chapters which have been indexed again since, so their saved postings are out of date
+        self.replaced = []
+        # Term -> (ordinals, positions) of chapters indexed since loading, in the order they were added
+        self.added = {}
+        # How many words each verse has (0 for verses not indexed)
+        self.lengths = array("H", bytes(2 * Canon.TOTAL_VERSES))
+        # First ordinal of every indexed chapter -> checksum of its text
+        self.chapters = {}
+        self.lock = threading.Lock()
+        self.changed()
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def changed(self):
+        # Forget everything worked out from the postings, after they change
+        self.length_sums = None
+        self.verse_counts = None
+        self.document_frequencies = {}
+        self.fingerprint_value = None
+
+    def load(self, path):
+        with open(path, "rb") as handle:
+            self.map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, section_count) = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise Exception(path + " is not a version " + str(FORMAT_VERSION) + " text index")
+        view = memoryview(self.map)
+        sections = {}
+        for i in range(section_count):
+            (name, offset, length) = SECTION.unpack_from(self.map, HEADER.size + SECTION.size * i)
+            sections[name.rstrip(b"\0").decode("utf-8")] = view[offset:offset + length]
+        term_offsets = sections["terms.offsets"].cast("I")
+        term_data = sections["terms.data"]
+        self.saved_terms = [str(term_data[term_offsets[i]:term_offsets[i + 1]], "utf-8") for i in range(len(term_offsets) - 1)]
+        self.saved_term_ids = None
+        self.saved_offsets = sections["postings.offsets"].cast("I")
+        self.saved_ordinals = sections["postings.ordinals"].cast("I")
+        self.saved_positions = sections["postings.positions"].cast("H")
+        # The lengths change as chapters are added, so they are copied out of the file
+        self.lengths = array("H", sections["lengths"].tobytes())
+        self.chapters = dict(zip(sections["chapters.ordinals"].cast("I"), sections["chapters.checksums"].cast("I")))
+        self.replaced = []
+        self.added = {}
+        self.changed()
+
+    def termIds(self):
+        # Saved term -> its id, only worked out when first needed
+        if self.saved_term_ids is None:
+            self.saved_term_ids = {term : term_id for (term_id, term) in enumerate(self.saved_terms)}
+        return self.saved_term_ids
+
+    def addChapter(self, book, chapter, verses):
+        """
+        Indexes the given chapter, unless it is already indexed with the same text
+
+        Parameters
+        ----------
+        `book` : `str`
+            The book, by any name Canon recognises (including the DBP's book ids)
+        `chapter` : `int`
+        `verses` : `list` : `[(int, str)]`
+            The (verse number, text) of each verse of the chapter
+
+        Returns
+        -------
+        `bool`
+            Whether the chapter had to be indexed
+        """
+        chapter_range = chapterRange(book, chapter)
+        if chapter_range is None:
+            return False
+        (first, last) = chapter_range
+        checksum = zlib.crc32("\n".join(str(verse) + " " + text for (verse, text) in verses).encode("utf-8"))
+        with self.lock:
+            if self.chapters.get(first) == checksum:
+                return False
+            if first in self.chapters:
+                self.removeChapter(first, last)
+            for (verse, text) in verses:
+                ordinal = Canon.ordinal(book, chapter, verse)
+                # Verses past the end of the chapter (from a different versification) carry on from the chapter's last verse
+                position = self.lengths[ordinal]
+                for term in terms(text):
+                    postings = self.added.get(term)
+                    if postings is None:
+                        postings = self.added[term] = (array("I"), array("H"))
+                    postings[0].append(ordinal)
+                    postings[1].append(min(position, 0xFFFF))
+                    position += 1
+                self.lengths[ordinal] = min(position, 0xFFFF)
+            self.chapters[first] = checksum
+            self.changed()
+        return True
+
+    def removeChapter(self, first, last):
+        # Drops the postings of an indexed chapter (which is being indexed again)
+        if self.map is not None and (first, last) not in self.replaced:
+            insort(self.replaced, (first, last))
+        for (term, (ordinals, positions)) in list(self.added.items()):
+            kept = [i for i in range(len(ordinals)) if not first <= ordinals[i] <= last]
+            if len(kept) < len(ordinals):
+                self.added[term] = (array("I", [ordinals[i] for i in kept]), array("H", [positions[i] for i in kept]))
+        for ordinal in range(first, last + 1):
+            self.lengths[ordinal] = 0
+        del self.chapters[first]
+
+    def update(self, cache, fileset_id):
+        """
+        Indexes every chapter of the given fileset held in the given VerseCache that isn't indexed yet (or has changed)
+
+        Returns
+        -------
+        `int`
+            The number of chapters that had to be indexed
+        """
+        return sum(1 for (book, chapter, verses) in cache.cached_chapters(fileset_id) if self.addChapter(book, chapter, verses))
+
+    def isReplaced(self, ordinal):
+        # Whether the saved postings of the given verse are out of date
+        i = bisect_right(self.replaced, (ordinal, math.inf)) - 1
+        return i >= 0 and self.replaced[i][1] >= ordinal
+
+    def occurrences(self, term, start = 0, end = None):
+        """
+        Returns the (ordinal, position) of every occurrence of the given term in the verses between the given ordinals (inclusive), in order
+        """
+        if end is None:
+            end = Canon.TOTAL_VERSES - 1
+        found = []
+        term_id = self.termIds().get(term)
+        if term_id is not None:
+            (low, high) = (self.saved_offsets[term_id], self.saved_offsets[term_id + 1])
+            first = bisect_left(self.saved_ordinals, start, low, high)
+            last = bisect_right(self.saved_ordinals, end, first, high)
+            found = list(zip(self.saved_ordinals[first:last].tolist(), self.saved_positions[first:last].tolist()))
+            if len(self.replaced) > 0:
+                found = [occurrence for occurrence in found if not self.isReplaced(occurrence[0])]
+        added = self.added.get(term)
+        if added is not None:
+            found.extend(occurrence for occurrence in zip(added[0], added[1]) if start <= occurrence[0] <= end)
+            found.sort()
+        return found
+
+    def verseFrequencies(self, term, start = 0, end = None):
+        """
+        Returns how many times the given term occurs in each verse (that it occurs in) between the given ordinals, by ordinal
+        """
+        return Counter(ordinal for (ordinal, _) in self.occurrences(term, start, end))
+
+    def phraseFrequencies(self, phrase, start = 0, end = None):
+        """
+        Returns how many times the given phrase (its terms at consecutive positions) occurs in each verse (that it occurs in) between
+        the given ordinals, by ordinal
+        """
+        phrase_terms = terms(phrase)
+        if len(phrase_terms) == 0:
+            return Counter()
+        following = [set(self.occurrences(term, start, end)) for term in phrase_terms[1:]]
+        return Counter(ordinal for (ordinal, position) in self.occurrences(phrase_terms[0], start, end)
+                       if all((ordinal, position + i + 1) in occurrences for (i, occurrences) in enumerate(following)))
+
+    def statistics(self):
+        # The running totals of words and of indexed verses up to each ordinal, so those of any range of verses are one subtraction
+        if self.length_sums is None:
+            self.length_sums = [0] + list(accumulate(self.lengths))
+            self.verse_counts = [0] + list(accumulate(1 if length > 0 else 0 for length in self.lengths))
+        return (self.length_sums, self.verse_counts)
+
+    def verseCount(self):
+        return self.statistics()[1][-1]
+
+    def averageLength(self):
+        (length_sums, verse_counts) = self.statistics()
+        return length_sums[-1] / verse_counts[-1] if verse_counts[-1] > 0 else 0
+
+    def documentFrequency(self, term):
+        # How many verses the term occurs in
+        frequency = self.document_frequencies.get(term)
+        if frequency is None:
+            frequency = self.document_frequencies[term] = len(self.verseFrequencies(term))
+        return frequency
+
+    def idf(self, term):
+        # BM25's inverse document frequency, which is never negative
+        frequency = self.documentFrequency(term)
+        return math.log(1 + (self.verseCount() - frequency + 0.5) / (frequency + 0.5))
+
+    def bm25(self, idf, frequency, relative_length):
+        # A term's contribution to a score, given how long the text is compared to the average
+        return idf * frequency * (K1 + 1) / (frequency + K1 * (1 - B + B * relative_length))
+
+    def search(self, query, k = 10, within = None):
+        """
+        Returns the verses best matching the given query, by BM25 score. Phrases in double quotes must occur in every verse returned.
+
+        Parameters
+        ----------
+        `query` : `str`
+            Words and "quoted phrases" to search for, e.g. `love "one another"`
+        [`k` : `int`]
+            The most verses to return
+        [`within` : `Passage`]
+            Only verses in this passage are searched
+
+        Returns
+        -------
+        `list` : `[(str, float)]`
+            The (OSIS reference, score) of each verse found, highest scoring first
+        """
+        (start, end) = (within.startOrdinal, within.endOrdinal) if within is not None else (0, Canon.TOTAL_VERSES - 1)
+        phrases = PHRASE.findall(query)
+        candidates = None
+        for phrase in phrases:
+            verses = set(self.phraseFrequencies(phrase, start, end))
+            candidates = verses if candidates is None else candidates & verses
+        average = self.averageLength()
+        scores = {}
+        for term in dict.fromkeys(terms(PHRASE.sub(" ", query)) + [term for phrase in phrases for term in terms(phrase)]):
+            idf = self.idf(term)
+            for (ordinal, frequency) in self.verseFrequencies(term, start, end).items():
+                if candidates is None or ordinal in candidates:
+                    scores[ordinal] = scores.get(ordinal, 0) + self.bm25(idf, frequency, self.lengths[ordinal] / average)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [(osisReference(ordinal), score) for (ordinal, score) in best]
+
+    def passageScores(self, words, passage_index):
+        """
+        Returns the BM25 score of each passage whose text contains any of the given words, each passage's verses counting as one text.
+        A passage's length is compared to the average length of as many verses, so longer passages aren't held back just for being longer.
+
+        Parameters
+        ----------
+        `words` : `list`
+            The words to score by
+        `passage_index` : `IntervalIndex`
+            The passages to score
+
+        Returns
+        -------
+        `(dict, int)`
+            Passage reference -> score, and how many verses containing a word were looked at
+        """
+        (length_sums, verse_counts) = self.statistics()
+        average = self.averageLength()
+        frequencies = {}
+        scanned = 0
+        query_terms = list(dict.fromkeys(term for word in words for term in terms(word)))
+        for (i, term) in enumerate(query_terms):
+            verse_frequencies = self.verseFrequencies(term)
+            scanned += len(verse_frequencies)
+            for (ordinal, frequency) in verse_frequencies.items():
+                for passage in passage_index.overlapping(ordinal, ordinal):
+                    passage_frequencies = frequencies.get(passage)
+                    if passage_frequencies is None:
+                        passage_frequencies = frequencies[passage] = [0] * len(query_terms)
+                    passage_frequencies[i] += frequency
+        idfs = [self.idf(term) for term in query_terms]
+        scores = {}
+        for (passage, passage_frequencies) in frequencies.items():
+            (start, end) = (passage.startOrdinal, passage.endOrdinal + 1)
+            relative_length = (length_sums[end] - length_sums[start]) / ((verse_counts[end] - verse_counts[start]) * average)
+            scores[passage.reference] = sum(self.bm25(idf, frequency, relative_length) for (idf, frequency) in zip(idfs, passage_frequencies) if frequency > 0)
+        return (scores, scanned)
+
+    def maxScore(self, words):
+        """
+        Returns the most any text could score for the given words: BM25 approaches it as each word occurs more and more often
+        """
+        return sum(self.idf(term) * (K1 + 1) for term in dict.fromkeys(term for word in words for term in terms(word)))
+
+    def fingerprint(self):
+        """
+        Returns a fingerprint of the indexed chapters, which changes whenever any are added or change
+        """
+        if self.fingerprint_value is None:
+            self.fingerprint_value = hashlib.sha256(repr(sorted(self.chapters.items())).encode("utf-8")).hexdigest()
+        return self.fingerprint_value
+
+    def save(self, path = None):
+        """
+        Saves the index (to the path it was loaded from, if none is given), then maps the saved file
+        """
+        path = path if path is not None else self.path
+        with self.lock:
+            all_terms = sorted(set(self.saved_terms) | set(self.added))
+            term_data = bytearray()
+            term_offsets = array("I", [0])
+            offsets = array("I", [0])
+            ordinals = array("I")
+            positions = array("H")
+            for term in all_terms:
+                term_data += term.encode("utf-8")
+                term_offsets.append(len(term_data))
+                for (ordinal, position) in self.occurrences(term):
+                    ordinals.append(ordinal)
+                    positions.append(position)
+                offsets.append(len(ordinals))
+            chapters = sorted(self.chapters.items())
+            sections = {
+                "terms.data" : term_data,
+                "terms.offsets" : term_offsets,
+                "postings.offsets" : offsets,
+                "postings.ordinals" : ordinals,
+                "postings.positions" : positions,
+                "lengths" : self.lengths,
+                "chapters.ordinals" : array("I", [first for (first, _) in chapters]),
+                "chapters.checksums" : array("I", [checksum for (_, checksum) in chapters])
+            }
+
+            # Lay the sections out after the header, each one starting on an 8 byte boundary
+            offset = HEADER.size + SECTION.size * len(sections)
+            table = []
+            for (name, data) in sections.items():
+                offset += -offset % 8
+                length = len(data) * (data.itemsize if isinstance(data, array) else 1)
+                table.append((name, offset, length, data))
+                offset += length
+
+            # Write to a temporary file first, so that a process loading the index never sees half a file
+            temporary_path = path + "." + str(os.getpid()) + ".tmp"
+            with open(temporary_path, "wb") as handle:
+                handle.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(table)))
+                for (name, offset, length, _) in table:
+                    handle.write(SECTION.pack(name.encode("utf-8"), offset, length))
+                for (name, offset, length, data) in table:
+                    handle.write(b"\0" * (offset - handle.tell()))
+                    handle.write(data.tobytes() if isinstance(data, array) else bytes(data))
+            os.replace(temporary_path, path)
+            self.path = path
+            self.load(path)
+
+def textIndexPath(fileset_id):
+    # Where the text index of the given fileset is saved, in the cache folder
+    return os.path.join(DEFAULT_CACHE_DIR, "text-" + fileset_id + ".index")
+
+def loadTextIndex(fileset_id, path = None):
+    """
+    Returns the saved text index of the given fileset, or None if there isn't one (or it can't be read)
+    """
+    path = path if path is not None else textIndexPath(fileset_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        return TextIndex(path)
+    except Exception as e:
+        print("Ignoring unreadable text index " + path + ": " + str(e))
+        return None
+
+# Indexes already loaded in this process, by path
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def textIndex(cache, fileset_id, path = None):
+    """
+    Returns the process-wide text index of the given fileset: the saved one, with any chapters cached since it was saved added (and
+    saved), or a new one of every cached chapter
+
+    Parameters
+    ----------
+    `cache` : `VerseCache`
+        Where the fileset's chapters are cached (see `DBPManager.prefetch()`)
+    `fileset_id` : `str`
+    [`path` : `str`]
+        Where the index is saved. If not given, it is kept in the cache folder, named after the fileset.
+    """
+    if path is None:
+        os.makedirs(DEFAULT_CACHE_DIR, exist_ok=True)
+        path = textIndexPath(fileset_id)
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = _indexes[path] = loadTextIndex(fileset_id, path) or TextIndex()
+        if index.update(cache, fileset_id) > 0 or not os.path.exists(path):
+            index.save(path)
+        return index
+
+# Indexes the chapters of a fileset in the verse cache (fetch them first with DBPManager.prefetch()), and searches them
+# Usage:
+#   python3 TextIndex.py <fileset id> [<query>]
+# Example:
+#   python3 TextIndex.py ENGESV "love \"one another\""
+if __name__ == "__main__":
+    from VerseCache import VerseCache
+    if len(sys.argv) < 2:
+        print("Usage: python3 TextIndex.py <fileset id> [<query>]")
+        sys.exit(1)
+    text_index = textIndex(VerseCache(), sys.argv[1])
+    print("Indexed " + str(len(text_index.chapters)) + " chapters (" + str(text_index.verseCount()) + " verses) of " + sys.argv[1])
+    if len(sys.argv) > 2:
+        for (reference, score) in text_index.search(sys.argv[2]):
+            print(reference + " " + format(score, ".3f"))
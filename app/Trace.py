@@ -0,0 +1,54 @@
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+# -----
+# Trace
+# Why passages got their scores. A filter given a sink (see `Filter.setTrace()`) emits an event for every change it makes to a
+# passage's score: which passage, which filter, by how much, and the reason. Filters without a sink don't build any events at all,
+# so scoring costs nothing extra unless a trace is asked for.
+#
+# The reason is kept as a format string and its arguments, and only turned into text when the event is printed.
+# -----
+
+class TraceEvent(namedtuple("TraceEvent", ["passage", "filter", "delta", "reason", "arguments"])):
+    __slots__ = ()
+
+    def explanation(self):
+        return self.reason.format(*self.arguments)
+
+    def __str__(self):
+        return self.passage + ": " + ("+" if self.delta >= 0 else "") + str(self.delta) + " from " + self.filter + " because " + self.explanation()
+
+class TraceSink(ABC):
+    # Where a filter sends its events; each kind of sink decides what to do with them
+    @abstractmethod
+    def emit(self, event): ...
+
+class PrintSink(TraceSink):
+    # Prints every event as it happens
+    def emit(self, event):
+        print(str(event))
+
+class ListSink(TraceSink):
+    def __init__(self, passage_refs = None):
+        # Keeps the events, of every passage or only of the given ones
+        self.passage_refs = set(passage_refs) if passage_refs is not None else None
+        self.events = []
+
+    def emit(self, event):
+        if self.passage_refs is None or event.passage in self.passage_refs:
+            self.events.append(event)
+
+class ScratchScore:
+    # Stands in for a passage while explaining, so that the real passage's score isn't changed
+    __slots__ = ("reference", "score")
+
+    def __init__(self, reference):
+        self.reference = reference
+        self.score = 0
+
+class ScratchMap(dict):
+    # A scripture map giving a new ScratchScore for every passage it is asked for
+    def __missing__(self, passage_ref):
+        score = self[passage_ref] = ScratchScore(passage_ref)
+        return score
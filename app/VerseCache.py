@@ -0,0 +1,279 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Where the cache lives unless told otherwise; can be moved with the DBP_CACHE_DIR environment variable
+DEFAULT_CACHE_DIR = os.environ.get("DBP_CACHE_DIR", os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "data", "cache"))
+DEFAULT_CACHE_FILE = "verses.db"
+
+# Roughly 8 full Bibles worth of verses
+DEFAULT_MAX_VERSES = 250000
+
+class VerseCache:
+    def __init__(self, path = None, max_verses = DEFAULT_MAX_VERSES):
+        """
+        A local, persistent store of Scripture text, addressed by (filesetID, book, chapter, verse).
+        Text is always stored a whole chapter at a time, so that a chapter is either fully present or absent, and any verse
+        range within it can be answered without going back to the API.
+
+        Once the number of stored verses goes over `max_verses`, the least recently used chapters are evicted. Filesets stored
+        whole (see `DBPManager.mirror()`) are never evicted, and don't count towards `max_verses`.
+
+        Parameters
+        ----------
+        [`path` : `str`]
+            The SQLite file to keep the verses in. If not given, `DEFAULT_CACHE_FILE` in `DEFAULT_CACHE_DIR` is used.
+            `":memory:"` can be used for a cache that only lasts as long as the process.
+        [`max_verses` : `int`]
+            The most verses to keep before evicting chapters. `None` means the cache is never evicted.
+
+        Example
+        -------
+        VerseCache("/tmp/verses.db", 50000)
+            This creates a cache in /tmp holding at most 50000 verses
+        """
+
+        if path is None:
+            os.makedirs(DEFAULT_CACHE_DIR, exist_ok=True)
+            path = os.path.join(DEFAULT_CACHE_DIR, DEFAULT_CACHE_FILE)
+        self.path = path
+        self.max_verses = max_verses
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS chapters (
+                fileset TEXT NOT NULL,
+                book TEXT NOT NULL,
+                chapter INTEGER NOT NULL,
+                verse_count INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (fileset, book, chapter)
+            );
+            CREATE TABLE IF NOT EXISTS verses (
+                fileset TEXT NOT NULL,
+                book TEXT NOT NULL,
+                chapter INTEGER NOT NULL,
+                verse INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (fileset, book, chapter, verse)
+            );
+            CREATE INDEX IF NOT EXISTS chapters_by_use ON chapters (last_used);
+            CREATE TABLE IF NOT EXISTS book_catalogs (
+                fileset TEXT PRIMARY KEY,
+                books TEXT NOT NULL,
+                fetched REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS mirrors (
+                fileset TEXT PRIMARY KEY,
+                started REAL NOT NULL,
+                completed REAL
+            );
+        """)
+        self.connection.commit()
+
+    def get_chapter(self, fileset_id : str, book : str, chapter : int):
+        """
+        Looks up a whole chapter, counting it as a hit or a miss
+
+        Returns
+        -------
+        `list` : `[(int, str)]`
+            The (verse number, verse text) pairs of the chapter in verse order, or `None` if the chapter is not cached
+        """
+
+        with self.lock:
+            found = self.connection.execute("SELECT 1 FROM chapters WHERE fileset = ? AND book = ? AND chapter = ?",
+                                            (fileset_id, book, chapter)).fetchone()
+            if found is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute("UPDATE chapters SET last_used = ? WHERE fileset = ? AND book = ? AND chapter = ?",
+                                    (time.time(), fileset_id, book, chapter))
+            self.connection.commit()
+            rows = self.connection.execute("SELECT verse, text FROM verses WHERE fileset = ? AND book = ? AND chapter = ? ORDER BY verse",
+                                           (fileset_id, book, chapter)).fetchall()
+        return rows
+
+    def has_chapter(self, fileset_id : str, book : str, chapter : int):
+        """
+        Returns True if the given chapter is cached, without affecting the hit/miss counters or the eviction order
+        """
+
+        with self.lock:
+            found = self.connection.execute("SELECT 1 FROM chapters WHERE fileset = ? AND book = ? AND chapter = ?",
+                                            (fileset_id, book, chapter)).fetchone()
+        return found is not None
+
+    def put_chapter(self, fileset_id : str, book : str, chapter : int, verses):
+        """
+        Stores a whole chapter, replacing whatever was cached for it before, and evicts old chapters if the cache is now too big
+
+        Parameters
+        ----------
+        `verses` : `[(int, str)]`
+            The (verse number, verse text) pairs making up the chapter
+        """
+
+        with self.lock:
+            self.connection.execute("DELETE FROM verses WHERE fileset = ? AND book = ? AND chapter = ?", (fileset_id, book, chapter))
+            self.connection.executemany("INSERT OR REPLACE INTO verses VALUES (?, ?, ?, ?, ?)",
+                                        [(fileset_id, book, chapter, verse, text) for (verse, text) in verses])
+            self.connection.execute("INSERT OR REPLACE INTO chapters VALUES (?, ?, ?, ?, ?)",
+                                    (fileset_id, book, chapter, len(verses), time.time()))
+            self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        # Called with the lock held. Drop least recently used chapters until we are within the verse limit.
+        # Mirrored filesets (even ones still being mirrored) are kept whole, and don't count towards the limit.
+        if self.max_verses is None:
+            return
+        (total,) = self.connection.execute("SELECT COALESCE(SUM(verse_count), 0) FROM chapters WHERE fileset NOT IN (SELECT fileset FROM mirrors)").fetchone()
+        if total <= self.max_verses:
+            return
+        oldest = self.connection.execute("SELECT fileset, book, chapter, verse_count FROM chapters WHERE fileset NOT IN (SELECT fileset FROM mirrors) ORDER BY last_used").fetchall()
+        for (fileset_id, book, chapter, verse_count) in oldest:
+            if total <= self.max_verses:
+                break
+            self.connection.execute("DELETE FROM verses WHERE fileset = ? AND book = ? AND chapter = ?", (fileset_id, book, chapter))
+            self.connection.execute("DELETE FROM chapters WHERE fileset = ? AND book = ? AND chapter = ?", (fileset_id, book, chapter))
+            total -= verse_count
+            self.evictions += 1
+
+    def get_book_catalog(self, fileset_id : str):
+        """
+        Returns the stored information about every book of the given filesetID (see `DBPManager.book_catalog()`), or `None`
+        """
+
+        with self.lock:
+            found = self.connection.execute("SELECT books FROM book_catalogs WHERE fileset = ?", (fileset_id,)).fetchone()
+        return json.loads(found[0]) if found is not None else None
+
+    def put_book_catalog(self, fileset_id : str, books):
+        """
+        Stores the information about every book of the given filesetID, in the fileset's order
+        """
+
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO book_catalogs VALUES (?, ?, ?)", (fileset_id, json.dumps(books), time.time()))
+            self.connection.commit()
+
+    def start_mirror(self, fileset_id : str):
+        """
+        Records that the whole of the given filesetID is being stored, so none of it is evicted from now on
+        """
+
+        with self.lock:
+            self.connection.execute("INSERT OR IGNORE INTO mirrors VALUES (?, ?, NULL)", (fileset_id, time.time()))
+            self.connection.commit()
+
+    def finish_mirror(self, fileset_id : str):
+        """
+        Records that the whole of the given filesetID is stored, so it can be served without the API
+        """
+
+        with self.lock:
+            self.connection.execute("UPDATE mirrors SET completed = ? WHERE fileset = ?", (time.time(), fileset_id))
+            self.connection.commit()
+
+    def is_mirrored(self, fileset_id : str):
+        """
+        Returns True if the whole of the given filesetID is stored (see `DBPManager.mirror()`)
+        """
+
+        with self.lock:
+            found = self.connection.execute("SELECT completed FROM mirrors WHERE fileset = ?", (fileset_id,)).fetchone()
+        return found is not None and found[0] is not None
+
+    def cached_chapters(self, fileset_id : str):
+        """
+        Yields every chapter of the given filesetID that is cached, without affecting the hit/miss counters or the eviction order
+
+        Returns
+        -------
+        `generator` : `(str, int, [(int, str)])`
+            The book, chapter number and (verse number, verse text) pairs of each chapter, in no particular order
+        """
+
+        with self.lock:
+            rows = self.connection.execute("SELECT book, chapter, verse, text FROM verses WHERE fileset = ? ORDER BY book, chapter, verse",
+                                           (fileset_id,)).fetchall()
+        chapter_key = None
+        verses = []
+        for (book, chapter, verse, text) in rows:
+            if (book, chapter) != chapter_key:
+                if chapter_key is not None:
+                    yield (chapter_key[0], chapter_key[1], verses)
+                (chapter_key, verses) = ((book, chapter), [])
+            verses.append((verse, text))
+        if chapter_key is not None:
+            yield (chapter_key[0], chapter_key[1], verses)
+
+    def chapter_count(self, fileset_id : str):
+        """
+        Returns the number of chapters of the given filesetID currently stored
+        """
+
+        with self.lock:
+            (total,) = self.connection.execute("SELECT COUNT(*) FROM chapters WHERE fileset = ?", (fileset_id,)).fetchone()
+        return total
+
+    def verse_count(self):
+        """
+        Returns the number of verses currently stored
+        """
+
+        with self.lock:
+            (total,) = self.connection.execute("SELECT COALESCE(SUM(verse_count), 0) FROM chapters").fetchone()
+        return total
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and current size of the cache
+
+        Returns
+        -------
+        dict
+            Object with the number of hits, misses, evictions, stored verses, and the hit ratio
+        """
+
+        lookups = self.hits + self.misses
+        return {
+            "hits" : self.hits,
+            "misses" : self.misses,
+            "hit-ratio" : self.hits / lookups if lookups > 0 else 0.0,
+            "evictions" : self.evictions,
+            "verses" : self.verse_count(),
+            "max-verses" : self.max_verses
+        }
+
+    def clear(self, fileset_id : str = None):
+        """
+        Removes everything from the cache, or only the content of the given filesetID
+        """
+
+        with self.lock:
+            for table in ("verses", "chapters", "book_catalogs", "mirrors"):
+                if fileset_id is None:
+                    self.connection.execute("DELETE FROM " + table)
+                else:
+                    self.connection.execute("DELETE FROM " + table + " WHERE fileset = ?", (fileset_id,))
+            self.connection.commit()
+
+    def compact(self):
+        """
+        Gives the space left by evicted or replaced chapters back, so the file is as small as its content
+        """
+
+        with self.lock:
+            self.connection.execute("VACUUM")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -1,4 +1,24 @@
+import math
+from collections import Counter
 from Utils import *
+from ContextIndex import ContextIndex
+from IntervalIndex import IntervalIndex
+from ReferenceScanner import referenceScanner
+from Passage import Passage
+from Trace import TraceEvent, ListSink, ScratchMap
+from Profile import profiler, profiled
+import re
+import scriptures
+
+# The most a single question type of a passage can score in the QuestionTypeFilter: 1 for the type, and at most 2 each for the subject and action
+QUESTION_TYPE_MAX_SCORE = 5
+
+# What the VerseInQuestionFilter adds to a passage containing the whole of a verse referenced in the question, or only part of it
+VERSE_CONTAINED_SCORE = 3
+VERSE_OVERLAP_SCORE = 1
+
+# A reference in OSIS format, e.g. John.3.16 or John.3.16-John.3.18
+OSIS_REFERENCE = re.compile(r"^[^.\s]+\.\d+\.\d+(-[^.\s]+\.\d+\.\d+)?$")
 
 # -----
 # Base filter class, should not be instantiated directly
@@ -8,6 +28,14 @@ class Filter:
         self.scripture_contexts = scripture_contexts
         self.scripture_map = scripture_map
         self.sub_filters = []
+        # Where to emit why scores change (see Trace); nothing is emitted (or even worked out) if None
+        self.trace = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Every filter is timed and counted while profiling is enabled (see Profile)
+        if "process" in cls.__dict__:
+            cls.process = profiled(cls.process)
 
     '''
     Given a particular question context, apply filter to it
@@ -18,6 +46,116 @@ class Filter:
         for filter in self.sub_filters:
             filter.process(question_context)
 
+    '''
+    Emits a change to a passage's score to the trace. Only call it if there is a trace, so nothing is done when tracing is off.
+    '''
+    def emit(self, passage, delta, reason, *arguments):
+        self.trace.emit(TraceEvent(passage.reference, type(self).__name__, delta, reason, arguments))
+
+    '''
+    Sets (or, with None, removes) the sink that this filter and its sub-filters emit changes to scores to
+    '''
+    def setTrace(self, sink):
+        self.trace = sink
+        for filter in self.sub_filters:
+            filter.setTrace(sink)
+
+    '''
+    Returns why this filter (and its sub-filters) would change the scores of just the given passages for the given question context,
+    as a list of TraceEvents, without changing any scores. The filter is applied again with a scratch scripture map, so this should only
+    be used for a few passages (e.g. the top ones), and not while the filter is being used by another thread.
+    '''
+    def explain(self, question_context, passage_refs):
+        sink = ListSink(passage_refs)
+        filters = self.allFilters()
+        saved = [(filter.scripture_map, filter.trace) for filter in filters]
+        scratch_map = ScratchMap()
+        try:
+            for filter in filters:
+                (filter.scripture_map, filter.trace) = (scratch_map, sink)
+            self.process(question_context)
+        finally:
+            for (filter, (scripture_map, trace)) in zip(filters, saved):
+                (filter.scripture_map, filter.trace) = (scripture_map, trace)
+        return sink.events
+
+    def allFilters(self):
+        # This filter and all of its sub-filters
+        filters = [self]
+        for filter in self.sub_filters:
+            filters.extend(filter.allFilters())
+        return filters
+
+    '''
+    Returns the (lowest, highest) amount that this filter, together with its sub-filters, can change the score of any one passage by
+    for the given question context. This lets a pipeline stop early once the remaining filters can't change which passages are on top.
+    '''
+    def scoreBounds(self, question_context):
+        (lowest, highest) = self.ownScoreBounds(question_context)
+        for filter in self.sub_filters:
+            (sub_lowest, sub_highest) = filter.scoreBounds(question_context)
+            lowest += sub_lowest
+            highest += sub_highest
+        return (lowest, highest)
+
+    '''
+    The bounds of this filter's own scoring, not counting its sub-filters.
+    A filter which doesn't override this is assumed to be able to change a score by any amount.
+    '''
+    def ownScoreBounds(self, question_context):
+        return (-math.inf, math.inf)
+
+    '''
+    Returns the members of question contexts that this filter, together with its sub-filters, reads, or None if that isn't known.
+    Questions which are the same in these members are scored the same, so their results can be shared (see ResultCache).
+    '''
+    def questionFields(self):
+        fields = self.ownQuestionFields()
+        if fields is None:
+            return None
+        fields = set(fields)
+        for filter in self.sub_filters:
+            sub_fields = filter.questionFields()
+            if sub_fields is None:
+                return None
+            fields.update(sub_fields)
+        return fields
+
+    '''
+    The members this filter reads itself, not counting its sub-filters.
+    A filter which doesn't override this is assumed to read anything.
+    '''
+    def ownQuestionFields(self):
+        return None
+
+    '''
+    Returns what this filter, together with its sub-filters, makes of the given question from members it reads but leaves out of
+    `questionFields()`, such as references found in its text. Questions which are the same in these values and in the members
+    listed by `questionFields()` are scored the same, even where those other members differ.
+    '''
+    def questionValues(self, question_context):
+        values = dict(self.ownQuestionValues(question_context))
+        for filter in self.sub_filters:
+            values.update(filter.questionValues(question_context))
+        return values
+
+    '''
+    The values this filter makes of the question itself, not counting its sub-filters; keyed by names that aren't question members
+    '''
+    def ownQuestionValues(self, question_context):
+        return {}
+
+    '''
+    Returns a description of the settings this filter (and its sub-filters) score with: its class and its simple settings (names,
+    thresholds, etc.), so that filters which would score differently are told apart (see ResultCache)
+    '''
+    def configuration(self):
+        settings = sorted((name, value) for (name, value) in vars(self).items() if type(value) in (str, int, float, bool))
+        return [type(self).__name__, settings, [filter.configuration() for filter in self.sub_filters]]
+
+# Filters which only have sub-filters are measured too
+Filter.process = profiled(Filter.process)
+
 # -----
 # Simple Comparison Filter
 # Scores all passages which have a member whose values appear in a corresponding/similar member in the question context. 
@@ -31,81 +169,102 @@ class Filter:
 # Example 2: Questions contain a list of significant words, and scriptures contain a list of questions the passage can address.
 # We can use this filter to search for the significant words in the questions associated with the passage.
 # Here, "question_key_name" is "significant-words" and "scripture_key_name" is "questions"
+#
+# Rather than comparing against every passage, the filter looks the question's values up in a ContextIndex, so only the passages
+# which can score are touched. The same index should be given to all the filters; if none is given, the filter creates its own.
 # -----
 class SimpleComparisonFilter(Filter):
-    def __init__(self, question_key_name, scripture_key_name, only_exact, scripture_contexts, scripture_map):
+    def __init__(self, question_key_name, scripture_key_name, only_exact, scripture_contexts, scripture_map, index = None):
         super().__init__(scripture_contexts, scripture_map)
         self.question_key_name = question_key_name
         self.scripture_key_name = scripture_key_name
         self.only_exact = only_exact
         self.scripture_contexts = scripture_contexts
         self.scripture_map = scripture_map
+        self.index = index if index is not None else ContextIndex(scripture_contexts)
 
     def process(self, question_context):
         # All the key types/entities mentioned in this question (e.g. people, places, etc.)
         question_keys = question_context[self.question_key_name]
-        # Go through all the scriptures
-        for scripture_context in self.scripture_contexts:
-            passage = self.scripture_map[scripture_context["passage"]]
-            # Go through all the key type/entities mentioned in the question
-            for question_key in question_keys:
-                # If a key in the question is also in this verse, then increase verse score
-                for scripture_key in scripture_context[self.scripture_key_name]:
-                    if self.only_exact:
-                        if question_key == scripture_key:
-                            passage.score += 1
-                            print(passage.reference + "(" + str(passage.score) + "): +1 because " + question_key + " == " + scripture_key)
-                    else:
-                        if question_key in scripture_key:
-                            print(passage.reference + "(" + str(passage.score) + "): +1 because " + question_key + " is in " + scripture_key)
-                            passage.score += 1
-        
+        scored = 0
+        # Go through all the key type/entities mentioned in the question
+        for question_key in question_keys:
+            # Find the scripture keys matching it, and increase the score of every verse having them (once per occurrence)
+            for scripture_key in self.index.matchingValues(self.scripture_key_name, question_key, self.only_exact):
+                postings = self.index.postings(self.scripture_key_name, scripture_key)
+                scored += len(postings)
+                for (passage_ref, count) in postings.items():
+                    passage = self.scripture_map[passage_ref]
+                    passage.score += count
+                    if self.trace is not None:
+                        self.emit(passage, count, "{} == {}" if self.only_exact else "{} is in {}", question_key, scripture_key)
+        # Only the passages with a matching value are looked at
+        profiler.count(self, scored, scored)
+
         super().process(question_context)
 
+    def ownScoreBounds(self, question_context):
+        # A passage can at most have every matching value, as many times as any passage has it
+        highest = 0
+        for question_key in question_context[self.question_key_name]:
+            for scripture_key in self.index.matchingValues(self.scripture_key_name, question_key, self.only_exact):
+                highest += max(self.index.postings(self.scripture_key_name, scripture_key).values())
+        return (0, highest)
+
+    def ownQuestionFields(self):
+        return (self.question_key_name,)
+
 # -----
 # People Filter
 # Scores all passages which contain the same people as the given question
 # -----
 class PeopleFilter(SimpleComparisonFilter):
-    def __init__(self, scripture_contexts, scripture_map):
-        super().__init__("people", "people", True, scripture_contexts, scripture_map)
+    def __init__(self, scripture_contexts, scripture_map, index = None):
+        super().__init__("people", "people", True, scripture_contexts, scripture_map, index)
 
 # -----
 # Places Filter
 # Scores all passages which contain the same places as the given question
 # -----
 class PlacesFilter(SimpleComparisonFilter):
-    def __init__(self, scripture_contexts, scripture_map):
-        super().__init__("places", "places", True, scripture_contexts, scripture_map)
+    def __init__(self, scripture_contexts, scripture_map, index = None):
+        super().__init__("places", "places", True, scripture_contexts, scripture_map, index)
 
 # -----
 # Actions Filter
 # Scores all passages which contain the same actions as the given question
 # -----
 class ActionsFilter(SimpleComparisonFilter):
-    def __init__(self, scripture_contexts, scripture_map):
-        super().__init__("actions", "actions", True, scripture_contexts, scripture_map)
+    def __init__(self, scripture_contexts, scripture_map, index = None):
+        super().__init__("actions", "actions", True, scripture_contexts, scripture_map, index)
 
 # -----
 # Signficant Words Question Filter
 # Scores all passages which are associated with questions containing the same significant word(s) as in the given question
 # # -----
 class QuestionWordsFilter(SimpleComparisonFilter):
-    def __init__(self, scripture_contexts, scripture_map):
-        super().__init__("signficant-words", "questions", False, scripture_contexts, scripture_map)
+    def __init__(self, scripture_contexts, scripture_map, index = None):
+        super().__init__("signficant-words", "questions", False, scripture_contexts, scripture_map, index)
 
 # -----
 # Question Comparison Filter
 # A combination of the Significant Words Question Filter and the Question Similarity Filter
 # -----
 class QuestionComparisonFilter(Filter):
-    def __init__(self, threshold, scripture_contexts, scripture_map):
+    def __init__(self, threshold, scripture_contexts, scripture_map, index = None, similarity = None):
         super().__init__(scripture_contexts, scripture_map)
         self.sub_filters = [ 
-            QuestionWordsFilter(scripture_contexts, scripture_map),
-            QuestionSimilarityFilter(threshold, scripture_contexts, scripture_map)
+            QuestionWordsFilter(scripture_contexts, scripture_map, index),
+            QuestionSimilarityFilter(threshold, scripture_contexts, scripture_map, similarity)
         ]
 
+    def ownScoreBounds(self, question_context):
+        # All the scoring is done by the sub-filters
+        return (0, 0)
+
+    def ownQuestionFields(self):
+        return ()
+
 # -----
 # Scripture Section Filter
 # Scores passages based on whether they are in the OT or NT, given the Scripture section in the given question
@@ -114,6 +273,8 @@ class QuestionComparisonFilter(Filter):
 class ScriptureSectionFilter(Filter):
     def __init__(self, scripture_contexts, scripture_map):
         super().__init__(scripture_contexts, scripture_map)
+        # A passage listed more than once is scored once per listing
+        self.max_listings = max(Counter(scripture_context["passage"] for scripture_context in scripture_contexts).values(), default=0)
 
     def process(self, question_context):
         question_section = question_context["scripture-section"]
@@ -126,17 +287,34 @@ class ScriptureSectionFilter(Filter):
             # If the question section is Neither, then don't change the score, as it's not applicable
             if scripture_section == "NT" and (question_section == "NT" or question_section == "Both"):
                 passage.score += 1
-                print(passage.reference + "(" + str(passage.score) + "): +1 " + "because " + scripture_section + " == " + question_section)
+                if self.trace is not None:
+                    self.emit(passage, 1, "{} == {}", scripture_section, question_section)
             elif scripture_section == "OT" and (question_section == "OT" or question_section == "Both"):
                 passage.score += 1
-                print(passage.reference + "(" + str(passage.score) + "): +1 " + "because " + scripture_section + " == " + question_section)
+                if self.trace is not None:
+                    self.emit(passage, 1, "{} == {}", scripture_section, question_section)
             elif (scripture_section == "NT" and question_section == "OT") or \
                  (scripture_section == "OT" and question_section == "NT"):
                 passage.score -= 1
-                print(passage.reference + "(" + str(passage.score) + "): -1 " + "because " + scripture_section + " != " + question_section)
+                if self.trace is not None:
+                    self.emit(passage, -1, "{} != {}", scripture_section, question_section)
+        # Every passage is scored, one way or the other, unless the question is for Neither
+        scanned = len(self.scripture_contexts)
+        profiler.count(self, scanned, scanned if question_section in ("OT", "NT", "Both") else 0)
 
         super().process(question_context)
 
+    def ownScoreBounds(self, question_context):
+        question_section = question_context["scripture-section"]
+        if question_section == "Both":
+            return (0, self.max_listings)
+        elif question_section == "NT" or question_section == "OT":
+            return (-self.max_listings, self.max_listings)
+        return (0, 0)
+
+    def ownQuestionFields(self):
+        return ("scripture-section",)
+
 # TODO
 # -----
 # Relating-to Filter
@@ -151,62 +329,89 @@ class RelatingToFilter(Filter):
         # TODO
         super().process(question_context)
 
-# TODO
+    def ownScoreBounds(self, question_context):
+        # Doesn't score anything yet
+        return (0, 0)
+
+    def ownQuestionFields(self):
+        return ()
+
 # -----
 # Question Similarity Filter
 # Does a similarity search on the questions associated with passages, comparing them to the given question;
-# Scores all passages which match at or above a given threshold
+# Scores all passages which match at or above a given threshold, however many there are (though with many questions, only those in the
+# clusters of the index nearest the question are searched, see Similarity.IVFIndex)
 # -----
 class QuestionSimilarityFilter(Filter):
-    def __init__(self, threshold, scripture_contexts, scripture_map):
+    def __init__(self, threshold, scripture_contexts, scripture_map, similarity = None):
         super().__init__(scripture_contexts, scripture_map)
         self.threshold = threshold
+        self.similarity = similarity
+        self.similarityPrep()
 
     def process(self, question_context):
-        # TODO
         # Go through the passages. For every passage, extract its list of associated questions
-        # Then run a similarity searching algorithm with input as the list of associated questions, and the new given question
-        # The output should be an indication of which associated question the given question is most similar to.
-        # That level of similarity is represented by a percentage or other number.
-        # If it larger than or equal to the given threshold, we'll score that passage
+        # Then run a similarity search with input as the list of associated questions, and the new given question
+        # The output is how similar the given question is to the most similar associated question of each passage, from 0 to 1
+        # If it is larger than or equal to the given threshold, we'll score that passage by that similarity
+        similarities = self.similarityScores(question_context)
+        for (passage_ref, similarity) in similarities.items():
+            passage = self.scripture_map[passage_ref]
+            passage.score += similarity
+            if self.trace is not None:
+                self.emit(passage, similarity, "the question is similar to one of its questions")
+        # The similarity index only gives back the passages that are similar enough
+        profiler.count(self, len(similarities), len(similarities))
 
-        self.similarityPrep()
-        results = self.runSimilaritySearch(self.textToVector(question_context["question-text"]))
+        super().process(question_context)
 
-        # TODO Look through the results and only extract those above threshold, then score those passages
+    def similarityScores(self, question_context):
+        """
+        Returns what each passage scores for the given question: the similarity of its most similar question, if at least the threshold
 
-        super().process(question_context)
+        Returns
+        -------
+        `dict`
+            Passage reference -> score
+        """
+        return self.runSimilaritySearch(self.textToVector(question_context["question-text"]))
+
+    def ownScoreBounds(self, question_context):
+        # A passage scores once, by a similarity of at most 1
+        return (0, 1)
+
+    def ownQuestionFields(self):
+        return ("question-text",)
 
     def runSimilaritySearch(self, question):
-        # TODO Use seeded Pinecone model and return the results
-        return None
+        return self.similarity.passageSimilarities(question, self.threshold)
 
-    # TODO: Is this what we really need, is it right?
     def textToVector(self, text_str):
-        vector_list = []
-        # Convert every character into a numeric representation, and return a list of those numbers
-        for character in text_str:
-            vector_list.append(int(character))
-        return vector_list
+        # The TF-IDF vector of the words of the text, in the same space as the associated questions
+        return self.similarity.vector(text_str)
 
     def similarityPrep(self):
-        # Make array of pairs, each pair being a question, and its associated passage
-        association_list = []
-        for scripture in self.scripture_contexts:
-            associated_questions = scripture["questions"]
-            for question in associated_questions:
-                association_list.append((scripture["passage"], question))
-        
-        # TODO Transform list of pairs into a vector of numerical data that can seed the similarity algorithm
-        # TODO Seed the Pinecone algorithm with this data and save as a member variable
+        # The associated questions of every passage are vectorised once (and saved), and shared by every filter over the same passages
+        if self.similarity is None:
+            # Only this filter needs numpy, so the other filters work without it
+            from Similarity import similarityIndex
+            self.similarity = similarityIndex(self.scripture_contexts)
 
 # -----
 # Question Type Filter
 # Scores all passages which have a question type that matches to the question type of the given question
 # -----
 class QuestionTypeFilter(Filter):
-    def __init__(self, scripture_contexts, scripture_map):
+    def __init__(self, scripture_contexts, scripture_map, synonyms = None):
         super().__init__(scripture_contexts, scripture_map)
+        # Expand the scripture side words up front, so only new words from questions ever need WordNet
+        self.synonyms = synonyms if synonyms is not None else defaultSynonyms()
+        self.synonyms.precompute(scripture_contexts)
+        # The most question types any one passage has (counting every listing of the passage)
+        question_type_counts = Counter()
+        for scripture_context in scripture_contexts:
+            question_type_counts[scripture_context["passage"]] += len(scripture_context["question-types"])
+        self.max_question_types = max(question_type_counts.values(), default=0)
 
     def process(self, question_context):
         # Go through all the passages and extract the "question-types" objects
@@ -216,34 +421,48 @@ class QuestionTypeFilter(Filter):
         # or it could mean they are "close enough". Similar words are used
         # TODO: Get this working for things like "gay" and "homosexual" getting a positive score
         given_question_type = question_context["question-type"]
+        scored = 0
         for scripture in self.scripture_contexts:
             passage = self.scripture_map[scripture["passage"]]
             scripture_question_types = scripture["question-types"]
             # For each question type, see if it matches the one from the given question
             for scripture_question_type in scripture_question_types:
-                match_score = self.match(given_question_type, scripture_question_type)
+                # What matched is only collected when it will be traced
+                matches = [] if self.trace is not None else None
+                match_score = self.match(given_question_type, scripture_question_type, matches)
                 if match_score > 0:
                     passage.score += match_score
-                    print(passage.reference + "(" + str(passage.score) + "): +" + str(match_score) + " because question types 'match': " + str(given_question_type) + " ~~ " + str(scripture_question_type))
+                    scored += 1
+                    if self.trace is not None:
+                        self.emit(passage, match_score, "question types match ({})", ", ".join(matches))
+        profiler.count(self, len(self.scripture_contexts), scored)
 
         super().process(question_context)
 
-    def match(self, given_question_type, scripture_question_type):
+    def match(self, given_question_type, scripture_question_type, matches = None):
+        # If a list of matches is given, what matched is added to it
         match_score = 0
         
         # 1. Do the types match; these are a strict set of strings so can just directly compare
         if given_question_type["type"] == scripture_question_type["type"]:
             match_score += 1
-            print("Increment score (" + str(match_score) + ") because types are equal: " + given_question_type["type"])
+            if matches is not None:
+                matches.append("type " + given_question_type["type"])
 
         # 2. Do any of the subjects match, also testing similar words
-        match_score += compareEntries(given_question_type["subject"], scripture_question_type["subject"], True, 0.5, 2, True)
+        match_score += compareEntries(given_question_type["subject"], scripture_question_type["subject"], True, 0.5, 2, matches, self.synonyms)
 
         # 3. Do any of the actions match, also testing similar words
-        match_score += compareEntries(given_question_type["action"], scripture_question_type["action"], True, 0.5, 2, True)
+        match_score += compareEntries(given_question_type["action"], scripture_question_type["action"], True, 0.5, 2, matches, self.synonyms)
 
         return match_score
 
+    def ownScoreBounds(self, question_context):
+        return (0, self.max_question_types * QUESTION_TYPE_MAX_SCORE)
+
+    def ownQuestionFields(self):
+        return ("question-type",)
+
 # TODO
 # -----
 # Situation Filter
@@ -273,23 +492,185 @@ class SituationFilter(Filter):
 
         super().process(question_context)
 
-# TODO
+    def ownScoreBounds(self, question_context):
+        # Doesn't score anything yet
+        return (0, 0)
+
+    def ownQuestionFields(self):
+        return ()
+
 # -----
 # Verse in Question Filter
 # If the question contains a Scripture reference, then it's highly likely that we should return that verse for them.
 # So if we have that verse in our index, we should score it higher. A consideration though here is that we probably
 # want to return at least 2 verses to the user in this case, because just returning the verse they are asking about
-# is quite probably not helpful to them; they probably know it already.
+# is quite probably not helpful to them; they probably know it already. So passages which contain the referenced verse(s)
+# get the most, but any passage which overlaps it (and so is likely about the same thing) still gets something.
+#
+# The references are taken from the "verse-in-the-question" member, which can be one reference or a list of them, either in
+# OSIS format (e.g. John.3.16-John.3.18) or written out as usual (e.g. John 3:16-18). Passages are found through an IntervalIndex,
+# so this stays fast however many passages there are.
 #
-# One way to enhance this would be on the initial question processing, when we're creating the question context,
-# to see if phrases from Scriptures are included, and not just Scripture references. That is another way to reference
-# a passage, by quoting the text, and should be recognized as well
+# The question's text is scanned too (see ReferenceScanner), for references written in it (e.g. "What does John 3:16 mean?"), and,
+# if the scanner is given a QuoteIndex of the text of a Bible, for phrases quoted from Scripture, as that is another way to
+# reference a passage. A passage both named in "verse-in-the-question" and found in the text is only counted once.
 # -----
 class VerseInQuestionFilter(Filter):
-    def __init__(self, scripture_contexts, scripture_map):
+    def __init__(self, scripture_contexts, scripture_map, passage_index = None, scanner = None):
         super().__init__(scripture_contexts, scripture_map)
+        # Recognises references (and, with a QuoteIndex, quotations) in the question's text; the shared one only recognises references
+        self.scanner = scanner if scanner is not None else referenceScanner()
+        self.passage_index = passage_index if passage_index is not None else passageIndex(scripture_contexts)
 
     def process(self, question_context):
-        # TODO Search for that verse in the index
+        scores = self.referenceScores(question_context)
+        for (passage_ref, score) in scores.items():
+            passage = self.scripture_map[passage_ref]
+            passage.score += score
+            if self.trace is not None:
+                self.emit(passage, score, "the question references it")
+        # Only the passages overlapping a referenced verse are looked at
+        profiler.count(self, len(scores), len(scores))
 
         super().process(question_context)
+
+    def questionReferences(self, question_context):
+        # The passages referenced by the question, as Passages
+        references = question_context.get("verse-in-the-question", "")
+        references = [references] if type(references) == str else references
+        passages = []
+        for reference in references:
+            reference = reference.strip()
+            if reference == "":
+                continue
+            if OSIS_REFERENCE.match(reference):
+                passages.append(Passage(reference))
+            else:
+                # Not OSIS, so try it as a reference (or several) written out in the usual way
+                passages.extend(Passage(extracted) for extracted in scriptures.extract(reference))
+        passages.extend(self.scanner.passages(question_context.get("question-text", "")))
+        # Each passage once, however many ways it was referenced
+        unique = {}
+        for passage in passages:
+            if passage.resolved():
+                unique.setdefault((passage.startOrdinal, passage.endOrdinal), passage)
+        return list(unique.values())
+
+    def referenceScores(self, question_context):
+        """
+        Returns how much each passage should be scored for the references in the given question
+
+        Returns
+        -------
+        `dict`
+            Passage reference -> score to add
+        """
+        scores = {}
+        for reference in self.questionReferences(question_context):
+            for passage in self.passage_index.overlapping(reference.startOrdinal, reference.endOrdinal):
+                score = VERSE_CONTAINED_SCORE if passage.includes(reference) else VERSE_OVERLAP_SCORE
+                scores[passage.reference] = scores.get(passage.reference, 0) + score
+        return scores
+
+    def ownScoreBounds(self, question_context):
+        return (0, VERSE_CONTAINED_SCORE * len(self.questionReferences(question_context)))
+
+    def ownQuestionFields(self):
+        # "verse-in-the-question" and "question-text" only count through the verses referenced in them (see `ownQuestionValues()`),
+        # so questions worded differently but referencing the same verses share their results
+        return ()
+
+    def configuration(self):
+        # Scores change with the verses quotations are recognised from
+        return super().configuration() + [self.scanner.quotes.fingerprint() if self.scanner.quotes is not None else None]
+
+    def ownQuestionValues(self, question_context):
+        return {"referenced-verses" : [[passage.startOrdinal, passage.endOrdinal] for passage in self.questionReferences(question_context)]}
+
+# -----
+# Text Relevance Filter
+# Scores passages by what they actually say: how well their text (from a TextIndex of a Bible's text) matches the question's
+# significant words, by BM25, with the passage's verses together counting as one text.
+#
+# Scores are divided by the most any text could score for the words, so a passage scores between 0 and 1 however many words there are,
+# and only passages containing at least one of the words are looked at.
+# -----
+class TextRelevanceFilter(Filter):
+    def __init__(self, scripture_contexts, scripture_map, text_index, passage_index = None):
+        super().__init__(scripture_contexts, scripture_map)
+        self.text_index = text_index
+        self.passage_index = passage_index if passage_index is not None else passageIndex(scripture_contexts)
+
+    def process(self, question_context):
+        (scores, scanned) = self.textScoresScanned(question_context)
+        for (passage_ref, score) in scores.items():
+            passage = self.scripture_map[passage_ref]
+            passage.score += score
+            if self.trace is not None:
+                self.emit(passage, score, "its text matches {}", ", ".join(self.significantWords(question_context)))
+        # Only the verses containing one of the words are looked at
+        profiler.count(self, scanned, len(scores))
+
+        super().process(question_context)
+
+    def significantWords(self, question_context):
+        words = question_context.get("signficant-words", [])
+        return [words] if type(words) == str else list(words)
+
+    def textScores(self, question_context):
+        """
+        Returns how much each passage should be scored for how well its text matches the question's significant words
+
+        Returns
+        -------
+        `dict`
+            Passage reference -> score to add
+        """
+        return self.textScoresScanned(question_context)[0]
+
+    def textScoresScanned(self, question_context):
+        # The scores, and how many verses were looked at
+        words = self.significantWords(question_context)
+        most = self.text_index.maxScore(words)
+        if most <= 0:
+            return ({}, 0)
+        (scores, scanned) = self.text_index.passageScores(words, self.passage_index)
+        return ({passage_ref : score / most for (passage_ref, score) in scores.items()}, scanned)
+
+    def ownScoreBounds(self, question_context):
+        return (0, 1)
+
+    def ownQuestionFields(self):
+        return ("signficant-words",)
+
+    def configuration(self):
+        # Scores change whenever more chapters are indexed
+        return super().configuration() + [self.text_index.fingerprint()]
+
+def passageIndex(scripture_contexts):
+    # An IntervalIndex of every distinct passage of the given scripture contexts
+    passages = {}
+    for scripture_context in scripture_contexts:
+        passage_ref = scripture_context["passage"]
+        if passage_ref not in passages:
+            passages[passage_ref] = Passage(passage_ref)
+    return IntervalIndex(passages.values())
+
+# -----
+# The filters main.py answers questions with, sharing the given index and similar words (which are created if not given).
+# The TextRelevanceFilter is only used if a text index is given.
+# -----
+def defaultFilters(scripture_contexts, scripture_map, index = None, synonyms = None, text_index = None, scanner = None):
+    if index is None:
+        index = ContextIndex(scripture_contexts)
+    filters = [
+        PeopleFilter(scripture_contexts, scripture_map, index),
+        PlacesFilter(scripture_contexts, scripture_map, index),
+        ActionsFilter(scripture_contexts, scripture_map, index),
+        ScriptureSectionFilter(scripture_contexts, scripture_map),
+        QuestionTypeFilter(scripture_contexts, scripture_map, synonyms),
+        VerseInQuestionFilter(scripture_contexts, scripture_map, None, scanner)
+    ]
+    if text_index is not None:
+        filters.append(TextRelevanceFilter(scripture_contexts, scripture_map, text_index, filters[-1].passage_index))
+    return filters
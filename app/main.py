@@ -2,17 +2,30 @@ from os.path import realpath
 from random import randint
 import nltk
 import Utils
-from Passage import Passage, passageKey
+from Passage import passageTexts
+from Pipeline import rankPassages, explainPassages
 from filters import *
+from Corpus import loadCorpus
+from Profile import profiler
+from TextIndex import loadTextIndex
+from ReferenceScanner import quoteScanner
 
-question_contexts_full = Utils.readJson(Utils.datasetsPath(realpath(__file__), "Contexts.json", "hack2021"))
-scripture_contexts_full = Utils.readJson(Utils.datasetsPath(realpath(__file__), "Scriptures.json", "hack2021"))
-question_contexts = question_contexts_full["context"]
-scripture_contexts = scripture_contexts_full["scripture"]
-scripture_score_map = {}
-for scripture_context in scripture_contexts:
-    passage_text = scripture_context["passage"]
-    scripture_score_map[passage_text] = Passage(passage_text)
+# WordNet is needed to compile the scriptures (for similar words), the first time or whenever Scriptures.json changes
+nltk.download('wordnet')
+
+# The data files are compiled into binary corpora (in the cache folder) which are only mapped into memory, not decoded.
+# Each is compiled again whenever its JSON changes.
+question_corpus = loadCorpus(Utils.datasetsPath(realpath(__file__), "Contexts.json", "hack2021"))
+scripture_corpus = loadCorpus(Utils.datasetsPath(realpath(__file__), "Scriptures.json", "hack2021"))
+question_contexts = question_corpus.records("context")
+scripture_contexts = scripture_corpus.scriptureContexts()
+scripture_score_map = scripture_corpus.scoreMap()
+scripture_index = scripture_corpus.index()
+scripture_synonyms = scripture_corpus.synonyms()
+# If the text of the ESV has been indexed (see TextIndex.py), passages are also scored by what they say
+scripture_text_index = loadTextIndex("ENGESV")
+# If any of the ESV is in the verse cache, verses quoted from it in the question are recognised too
+scripture_scanner = quoteScanner("ENGESV")
 
 # TODO Define situation table for the SituationFilter
 # situation_table = {
@@ -41,36 +54,38 @@ def selectQuestion(question_contexts, index = -1):
 # Main Method
 # ----------
 
-nltk.download('wordnet')
-
 # First, get a question
 question_context = selectQuestion(question_contexts)
 print("Question is: " + question_context["question-text"])
 
 # Define the filters we'll use
-filters = []
-filters.append(PeopleFilter(scripture_contexts, scripture_score_map))
-filters.append(PlacesFilter(scripture_contexts, scripture_score_map))
-filters.append(ActionsFilter(scripture_contexts, scripture_score_map))
-filters.append(ScriptureSectionFilter(scripture_contexts, scripture_score_map))
-filters.append(QuestionTypeFilter(scripture_contexts, scripture_score_map))
+filters = defaultFilters(scripture_contexts, scripture_score_map, scripture_index, scripture_synonyms, scripture_text_index, scripture_scanner)
 
-# Go through each filter, which will adjust the scores of the passages in the map
-for filter in filters:
-    filter.process(question_context)
-    scriptures = sorted(scripture_score_map.values(), key=passageKey, reverse=True)
+# Go through each filter, which will adjust the scores of the passages in the map,
+# then determine which verses have the highest scores (without sorting all of them)
+topThreePassages = rankPassages(filters, question_context, scripture_score_map.values(), 3)
 
-# Now determine which verses have the highest scores
-# Sort verses in 'scripture_score_map' in descending order based on the "score" member
-scriptures = sorted(scripture_score_map.values(), key=passageKey, reverse=True)
+# Get the text of all three together, so they only cost about one round trip to the DBP
+topThreeTexts = passageTexts(topThreePassages)
 topThreePassagesStr = ""
-for i in range(0, 3):
-    passage = scriptures[i]
-    topThreePassagesStr += passage.reference + " (" + str(passage.score) + ")"
+for i in range(0, len(topThreePassages)):
+    passage = topThreePassages[i]
+    topThreePassagesStr += passage.reference + " (" + str(passage.score) + ") - " + topThreeTexts[i]
     topThreePassagesStr += "\n" if i < 2 else "" 
 print("Top three results:\n" + topThreePassagesStr)
-scripture_to_show = scriptures[0]
 
-print("Answer is: " + scripture_to_show.reference + " - " + scripture_to_show.text())
+# Scoring is silent; why each of the top three scored as it did is worked out just for them
+explanations = explainPassages(filters, question_context, topThreePassages)
+for passage in topThreePassages:
+    print("Why " + passage.reference + ":")
+    for event in explanations[passage.reference]:
+        print("  " + str(event))
+scripture_to_show = topThreePassages[0]
+
+print("Answer is: " + scripture_to_show.reference + " - " + topThreeTexts[0])
+
+# With FILTER_PROFILE=1, show how long each filter took and how much work it did
+if profiler.enabled:
+    print("Filter profile:\n" + profiler.report())
 
 # Done
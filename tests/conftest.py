@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The app's modules import each other by name, as when run from app/ (the tools add it to the path the same way)
+sys.path.insert(0, os.path.abspath(__file__+"/../../app"))
+sys.path.insert(0, os.path.abspath(__file__+"/../../tools"))
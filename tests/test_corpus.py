@@ -0,0 +1,84 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import Corpus
+import Utils
+from ContextIndex import ContextIndex
+from Corpus import loadCorpus
+from Synonyms import SynonymCache
+
+DATA = os.path.abspath(__file__+"/../../data")
+
+def questionTypeWords(scripture_contexts):
+    for scripture_context in scripture_contexts:
+        for question_type in scripture_context["question-types"]:
+            for member in ("subject", "action"):
+                words = question_type[member]
+                yield from [words] if type(words) == str else words
+
+@pytest.fixture
+def source(tmp_path):
+    # A copy of Scriptures.json, so it can be changed
+    path = str(tmp_path / "Scriptures.json")
+    shutil.copy(os.path.join(DATA, "Scriptures.json"), path)
+    return path
+
+@pytest.fixture
+def synonyms():
+    # Made up similar words for every question type word, so WordNet is never asked
+    synonyms = SynonymCache(":memory:")
+    scripture_contexts = Utils.readJson(os.path.join(DATA, "Scriptures.json"))["scripture"]
+    synonyms.table = {word : frozenset((word, word + "s")) for word in questionTypeWords(scripture_contexts)}
+    return synonyms
+
+@pytest.fixture
+def compiles(monkeypatch):
+    # Counts how many times a corpus is compiled
+    calls = []
+    compileCorpus = Corpus.compileCorpus
+    def counted(*arguments):
+        calls.append(arguments[0])
+        compileCorpus(*arguments)
+    monkeypatch.setattr(Corpus, "compileCorpus", counted)
+    return calls
+
+def test_scriptures_round_trip(source, synonyms, tmp_path):
+    scripture_contexts = Utils.readJson(source)["scripture"]
+    corpus = loadCorpus(source, str(tmp_path / "Scriptures.corpus"), synonyms)
+
+    assert [dict(record) for record in corpus.scriptureContexts()] == scripture_contexts
+    assert [passage.reference for passage in corpus.passages()] == list(dict.fromkeys(entry["passage"] for entry in scripture_contexts))
+    index = ContextIndex(scripture_contexts)
+    for member in ("people", "places", "actions", "questions"):
+        assert corpus.index().memberPostings(member) == index.memberPostings(member)
+    assert corpus.synonyms().table == synonyms.table
+
+def test_contexts_round_trip(tmp_path):
+    source = os.path.join(DATA, "Contexts.json")
+    corpus = loadCorpus(source, str(tmp_path / "Contexts.corpus"))
+    assert [dict(record) for record in corpus.records("context")] == Utils.readJson(source)["context"]
+
+def test_compiled_once_until_the_source_changes(source, synonyms, tmp_path, compiles):
+    path = str(tmp_path / "Scriptures.corpus")
+    loadCorpus(source, path, synonyms)
+    loadCorpus(source, path, synonyms)
+    assert len(compiles) == 1
+
+    document = Utils.readJson(source)
+    document["scripture"] = document["scripture"][:-1]
+    with open(source, "w") as handle:
+        json.dump(document, handle)
+    corpus = loadCorpus(source, path, synonyms)
+    assert len(compiles) == 2
+    assert [dict(record) for record in corpus.scriptureContexts()] == document["scripture"]
+
+def test_unreadable_corpus_compiled_again(source, synonyms, tmp_path, compiles):
+    path = str(tmp_path / "Scriptures.corpus")
+    with open(path, "wb") as handle:
+        handle.write(b"not a corpus")
+    corpus = loadCorpus(source, path, synonyms)
+    assert len(compiles) == 1
+    assert len(corpus.scriptureContexts()) == len(Utils.readJson(source)["scripture"])
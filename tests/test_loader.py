@@ -0,0 +1,64 @@
+import json
+import os
+
+import pytest
+
+import Utils
+from Loader import LoaderException, iterEntries, streamIndex
+
+DATA = os.path.abspath(__file__+"/../../data")
+
+@pytest.fixture(scope="module")
+def scripture_contexts():
+    return Utils.readJson(os.path.join(DATA, "Scriptures.json"))["scripture"]
+
+def writeLines(path, lines):
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write("\n".join(lines) + "\n")
+    return str(path)
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_json_entries_match_the_whole_file(scripture_contexts, chunk_size):
+    path = os.path.join(DATA, "Scriptures.json")
+    assert list(iterEntries(path, "scripture", chunk_size=chunk_size)) == scripture_contexts
+
+def test_json_first_list_when_no_key(tmp_path):
+    path = tmp_path / "entries.json"
+    path.write_text(json.dumps({"version": 2.5, "meta": {"list": [0]}, "items": [{"a": 1}, {"a": [1, 2.0e3]}, {"a": "]}"}]}))
+    assert list(iterEntries(str(path), chunk_size=3)) == [{"a": 1}, {"a": [1, 2000.0]}, {"a": "]}"}]
+
+def test_json_invalid_raises(tmp_path):
+    path = tmp_path / "entries.json"
+    path.write_text('{"scripture": [{"passage": "Gen.1.1"}, {"passage": }]}')
+    with pytest.raises(LoaderException):
+        list(iterEntries(str(path), "scripture", schema={}, chunk_size=5))
+
+def test_jsonl_entries_match_the_whole_file(tmp_path, scripture_contexts):
+    path = writeLines(tmp_path / "Scriptures.jsonl", [json.dumps(entry) for entry in scripture_contexts] + ["   "])
+    assert list(iterEntries(path, "scripture", chunk_size=7)) == scripture_contexts
+
+def test_jsonl_invalid_line_raises_with_path_and_line(tmp_path, scripture_contexts):
+    path = writeLines(tmp_path / "Scriptures.jsonl", [json.dumps(scripture_contexts[0]), "", "{\"passage\": ", json.dumps(scripture_contexts[1])])
+    with pytest.raises(LoaderException) as e:
+        list(iterEntries(path, "scripture"))
+    assert path + ", line 3" in str(e.value)
+
+def test_jsonl_invalid_lines_skipped(tmp_path, scripture_contexts):
+    lines = [json.dumps(scripture_contexts[0]), "not json", json.dumps({"passage": "Gen.1.1"}), json.dumps(scripture_contexts[1])]
+    path = writeLines(tmp_path / "Scriptures.jsonl", lines)
+    # The line that isn't JSON and the entry that doesn't match the schema are both left out
+    assert list(iterEntries(path, "scripture", skip_invalid=True)) == scripture_contexts[:2]
+
+def test_invalid_entry_raises_with_path_and_entry(tmp_path, scripture_contexts):
+    path = writeLines(tmp_path / "Scriptures.jsonl", [json.dumps(scripture_contexts[0]), json.dumps({"passage": "Gen.1.1"})])
+    with pytest.raises(LoaderException) as e:
+        list(iterEntries(path, "scripture"))
+    assert path + ", entry 2" in str(e.value)
+
+def test_stream_index_from_json_and_jsonl(tmp_path, scripture_contexts):
+    (index, passages) = streamIndex(os.path.join(DATA, "Scriptures.json"))
+    path = writeLines(tmp_path / "Scriptures.jsonl", [json.dumps(entry) for entry in scripture_contexts])
+    (jsonl_index, jsonl_passages) = streamIndex(path)
+    expected = list(dict.fromkeys(entry["passage"] for entry in scripture_contexts))
+    assert [passage.reference for passage in passages] == expected
+    assert [passage.reference for passage in jsonl_passages] == expected
@@ -0,0 +1,39 @@
+import os
+
+import pytest
+from nltk.corpus import wordnet
+
+try:
+    wordnet.ensure_loaded()
+except LookupError:
+    pytest.skip("WordNet isn't installed (nltk.download('wordnet'))", allow_module_level=True)
+
+import Utils
+from filters import defaultFilters
+from MatrixScorer import MatrixScorer
+from Passage import Passage
+from Pipeline import rankPassages
+from Synonyms import SynonymCache
+
+# MatrixScorer is meant to score exactly as the filters do; this checks it still does on the data in data/
+
+DATA = os.path.abspath(__file__+"/../../data")
+K = 5
+
+@pytest.fixture(scope="module")
+def data():
+    scripture_contexts = Utils.readJson(os.path.join(DATA, "Scriptures.json"))["scripture"]
+    question_contexts = Utils.readJson(os.path.join(DATA, "Contexts.json"))["context"]
+    return (scripture_contexts, question_contexts, SynonymCache(":memory:"))
+
+def pipelineRanking(scripture_contexts, question_context, synonyms):
+    scripture_map = {scripture_context["passage"] : Passage(scripture_context["passage"]) for scripture_context in scripture_contexts}
+    filters = defaultFilters(scripture_contexts, scripture_map, None, synonyms)
+    return [(passage.reference, passage.score) for passage in rankPassages(filters, question_context, scripture_map.values(), K)]
+
+def test_matrix_scorer_ranks_as_the_filters_do(data):
+    (scripture_contexts, question_contexts, synonyms) = data
+    ranked = MatrixScorer(scripture_contexts, None, synonyms).rank(question_contexts, K)
+    assert len(ranked) == len(question_contexts)
+    for (question_context, passages) in zip(question_contexts, ranked):
+        assert [(passage_ref, float(score)) for (passage_ref, score) in passages] == pipelineRanking(scripture_contexts, question_context, synonyms)
@@ -0,0 +1,76 @@
+import pytest
+
+import Canon
+from ReferenceScanner import Automaton, QuoteIndex, ReferenceScanner, referenceScanner
+
+# Made-up verse text for the quotation tests, so that they don't need the DBP
+GENESIS_1 = [(1, "In the beginning, God created the heavens and the earth."),
+             (2, "The earth was without form and void, and darkness was over the face of the deep."),
+             (3, "And God said, Let there be light, and there was light.")]
+JOHN_3 = [(16, "For God so loved the world, that he gave his only Son, that whoever believes in him should not perish but have eternal life."),
+          (17, "For God did not send his Son into the world to condemn the world, but in order that the world might be saved through him.")]
+
+def found(text, scanner = None):
+    # The OSIS reference of everything found in the text, in order
+    return [reference.reference() for reference in (scanner or referenceScanner()).scan(text)]
+
+@pytest.fixture(scope="module")
+def quote_scanner():
+    quotes = QuoteIndex()
+    assert quotes.addChapter("Gen", 1, GENESIS_1) and quotes.addChapter("John", 3, JOHN_3)
+    assert not quotes.addChapter("Nope", 1, [(1, "no such book")])
+    return ReferenceScanner(quotes)
+
+def test_automaton_finds_every_overlapping_word():
+    automaton = Automaton({"he" : 1, "she" : 2, "his" : 3, "hers" : 4})
+    assert sorted(automaton.matches("ushers")) == [(1, 4, 2), (2, 4, 1), (2, 6, 4)]
+    assert list(automaton.matches("")) == []
+
+def test_book_names_and_abbreviations():
+    assert found("What does John 3:16 mean?") == ["John.3.16"]
+    assert found("1 Cor. 13:4-7 and 1 John 4:8") == ["1Cor.13.4-1Cor.13.7", "1John.4.8"]
+    assert found("Song of Songs 2:4, Revelations 21:4 and Psalm 23") == ["Song.2.4", "Rev.21.4", "Ps.23.1-Ps.23.6"]
+    # A name inside another word isn't a book
+    assert found("Johnny 3:16 and Marked 2:1") == []
+
+def test_reference_tails():
+    assert found("Ps 23:1-24:2") == ["Ps.23.1-Ps.24.2"]
+    assert found("Matt 5-7") == ["Matt.5.1-Matt.7.29"]
+    assert found("Rom 8:28–30") == ["Rom.8.28-Rom.8.30"]
+    # Books of one chapter are referred to by verse alone
+    assert found("Jude 3") == ["Jude.1.3"]
+    assert found("Jude 3-5") == ["Jude.1.3-Jude.1.5"]
+    # Past the end of the book, or running backwards
+    assert found("John 22:1") == [] and found("John 3:40") == [] and found("John 4-3") == []
+
+def test_lower_case_chapters_are_only_references_with_a_verse():
+    assert found("Job 2") == ["Job.2.1-Job.2.13"]
+    assert found("my job 2 days a week") == []
+    assert found("job 2:3") == ["Job.2.3"]
+
+def test_quotations(quote_scanner):
+    assert found("He said: for god so loved the world that he gave his only son.", quote_scanner) == ["John.3.16"]
+    # Too short to tell which verse it is
+    assert found("the world", quote_scanner) == []
+
+def test_quotations_running_into_the_next_verse_are_one_passage(quote_scanner):
+    text = "in the beginning God created the heavens and the earth. The earth was without form and void"
+    assert found(text, quote_scanner) == ["Gen.1.1-Gen.1.2"]
+    # Verses quoted apart are separate passages, even when one follows the other
+    assert found("in the beginning God created the heavens, he said, and then: the earth was without form and void", quote_scanner) == ["Gen.1.1", "Gen.1.2"]
+
+def test_references_and_quotations_together(quote_scanner):
+    text = "Is John 3:17 about the same as for god so loved the world that he gave?"
+    assert found(text, quote_scanner) == ["John.3.17", "John.3.16"]
+    assert [passage.reference for passage in quote_scanner.passages(text + " John 3:16")] == ["John.3.17", "John.3.16"]
+
+def test_quote_scanner_uses_the_cached_fileset():
+    from VerseCache import VerseCache
+    from ReferenceScanner import quoteScanner
+    cache = VerseCache(":memory:")
+    # Nothing cached: references only
+    assert quoteScanner("ENGESV", cache) is referenceScanner()
+    cache.put_chapter("ENGESV", "GEN", 1, GENESIS_1)
+    scanner = quoteScanner("ENGESV", cache)
+    assert scanner.quotes.verse_count == 3
+    assert found("and God said, let there be light", scanner) == ["Gen.1.3"]
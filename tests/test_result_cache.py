@@ -0,0 +1,117 @@
+import os
+
+import pytest
+
+import Utils
+from filters import PeopleFilter, PlacesFilter, ActionsFilter, ScriptureSectionFilter, VerseInQuestionFilter
+from Passage import Passage
+from Pipeline import rankPassages
+import ResultCache as result_cache
+from ResultCache import ResultCache, questionKey
+
+DATA = os.path.abspath(__file__+"/../../data")
+
+@pytest.fixture(scope="module")
+def data():
+    return (Utils.readJson(os.path.join(DATA, "Scriptures.json"))["scripture"], Utils.readJson(os.path.join(DATA, "Contexts.json"))["context"])
+
+def scriptureMap(scripture_contexts):
+    return {scripture_context["passage"] : Passage(scripture_context["passage"]) for scripture_context in scripture_contexts}
+
+def filtersFor(scripture_contexts, scripture_map):
+    # The default filters that don't need WordNet
+    return [PeopleFilter(scripture_contexts, scripture_map), PlacesFilter(scripture_contexts, scripture_map),
+            ActionsFilter(scripture_contexts, scripture_map), ScriptureSectionFilter(scripture_contexts, scripture_map),
+            VerseInQuestionFilter(scripture_contexts, scripture_map)]
+
+def ranking(passages):
+    return [(passage.reference, passage.score) for passage in passages]
+
+def test_questions_ranked_in_turn_through_one_cache(data):
+    (scripture_contexts, question_contexts) = data
+    # What each question gets on a scripture map of its own
+    expected = []
+    for question_context in question_contexts:
+        scripture_map = scriptureMap(scripture_contexts)
+        expected.append(ranking(rankPassages(filtersFor(scripture_contexts, scripture_map), question_context, scripture_map.values(), 3)))
+
+    # The same, one after the other on one scripture map, scored and then taken from the cache
+    cache = ResultCache()
+    scripture_map = scriptureMap(scripture_contexts)
+    filters = filtersFor(scripture_contexts, scripture_map)
+    for _ in range(2):
+        for (question_context, top) in zip(question_contexts, expected):
+            assert ranking(rankPassages(filters, question_context, scripture_map.values(), 3, cache=cache)) == top
+    assert cache.stats()["hits"] == len(question_contexts)
+
+@pytest.fixture
+def clock(monkeypatch):
+    # A clock for the cache which only moves when told to
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, "monotonic", lambda: now[0])
+    return now
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = ResultCache(ttl=10)
+    cache.put("a", [1])
+    clock[0] += 9.9
+    assert cache.get("a") == [1]
+    clock[0] += 0.2
+    assert cache.get("a") is None
+    assert len(cache) == 0 and cache.stats()["misses"] == 1
+
+def test_entries_without_a_ttl_are_kept(clock):
+    cache = ResultCache(ttl=None)
+    cache.put("a", [1])
+    clock[0] += 1e9
+    assert cache.get("a") == [1]
+
+def test_least_recently_used_evicted():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", [1])
+    cache.put("b", [2])
+    # "a" is used, so "b" is the least recently used when "c" comes in
+    assert cache.get("a") == [1]
+    cache.put("c", [3])
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ([1], [3])
+    assert cache.stats()["evictions"] == 1 and len(cache) == 2
+
+def test_other_scope_drops_entries():
+    cache = ResultCache()
+    cache.use("one")
+    cache.put("a", [1])
+    cache.use("one")
+    assert cache.get("a") == [1]
+    cache.use("two")
+    assert cache.get("a") is None
+
+def test_changed_filters_or_contexts_drop_entries(data):
+    (scripture_contexts, question_contexts) = data
+    scripture_contexts = [dict(scripture_context) for scripture_context in scripture_contexts]
+    scripture_map = scriptureMap(scripture_contexts)
+    filters = filtersFor(scripture_contexts, scripture_map)
+    cache = ResultCache()
+    fields = cache.useFilters(filters)
+    key = questionKey(question_contexts[0], fields, filters)
+    cache.put(key, [1])
+
+    cache.useFilters(filters)
+    assert cache.get(key) == [1]
+    # Different weights are a different scope
+    cache.useFilters(filters, [2] * len(filters))
+    assert cache.get(key) is None
+
+    cache.useFilters(filters)
+    cache.put(key, [1])
+    # So are scripture contexts changed in place
+    scripture_contexts[0]["people"] = scripture_contexts[0]["people"] + ["Somebody"]
+    cache.useFilters(filters)
+    assert cache.get(key) is None
+
+def test_question_key_ignores_order_and_unread_members(data):
+    (_, question_contexts) = data
+    question_context = dict(question_contexts[0], people=["Peter", "John"])
+    reordered = dict(question_context, people=["John", "Peter"], unread="anything")
+    assert questionKey(question_context, ["people"]) == questionKey(reordered, ["people"])
+    assert questionKey(question_context, ["people"]) != questionKey(dict(question_context, people=["Peter"]), ["people"])
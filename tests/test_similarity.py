@@ -0,0 +1,31 @@
+import numpy as np
+
+from Similarity import NEAREST_QUESTIONS, SimilarityIndex
+
+def scriptureContexts(count):
+    # Passages whose questions differ only in one rare word, so all are about as similar to a question sharing the rest
+    return [{"passage" : "Gen.1." + str(i + 1), "questions" : ["who made the heavens and the earth in the beginning " + "w" + str(i)]}
+            for i in range(count)]
+
+def test_every_passage_over_the_threshold_past_the_nearest_questions():
+    scripture_contexts = scriptureContexts(NEAREST_QUESTIONS * 3)
+    index = SimilarityIndex(scripture_contexts, ":memory:")
+    similarities = index.passageSimilarities(index.vector("who made the heavens and the earth"), 0.4)
+    assert len(similarities) == len(scripture_contexts)
+
+def test_nothing_under_the_threshold():
+    scripture_contexts = scriptureContexts(NEAREST_QUESTIONS * 3)
+    index = SimilarityIndex(scripture_contexts, ":memory:")
+    vector = index.vector("who made the heavens and the earth w7")
+    similarities = index.passageSimilarities(vector, 0.5)
+    assert list(similarities) == ["Gen.1.8"]
+    assert all(similarity >= 0.5 for similarity in similarities.values())
+
+def test_saved_vectors_reloaded(tmp_path):
+    scripture_contexts = scriptureContexts(10)
+    path = str(tmp_path / "similarity.npz")
+    index = SimilarityIndex(scripture_contexts, path)
+    reloaded = SimilarityIndex(scripture_contexts, path)
+    assert np.array_equal(index.matrix, reloaded.matrix)
+    vector = index.vector("the earth w3")
+    assert reloaded.nearest(vector, 3) == index.nearest(vector, 3)
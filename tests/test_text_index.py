@@ -0,0 +1,79 @@
+from Passage import Passage
+from TextIndex import TextIndex, textIndex
+from VerseCache import VerseCache
+
+# Made up chapters, so nothing needs to be fetched
+JOHN_13 = [(33, "Little children, yet a little while I am with you."),
+           (34, "A new commandment I give to you, that you love one another: just as I have loved you, you also are to love one another."),
+           (35, "By this all people will know that you are my disciples, if you have love for one another.")]
+FIRST_JOHN_4 = [(7, "Beloved, let us love one another, for love is from God."),
+                (8, "Anyone who does not love does not know God, because God is love."),
+                (11, "Beloved, if God so loved us, we also ought to love one another.")]
+
+def indexOf(*chapters, path = None):
+    index = TextIndex(path)
+    for (book, chapter, verses) in chapters:
+        index.addChapter(book, chapter, verses)
+    return index
+
+def references(results):
+    return [reference for (reference, _) in results]
+
+def test_search_words_and_phrases():
+    index = indexOf(("JHN", 13, JOHN_13), ("1JN", 4, FIRST_JOHN_4))
+    # "loved" and "love" are the same term
+    assert set(references(index.search("loved", k=10))) == {"John.13.34", "John.13.35", "1John.4.7", "1John.4.8", "1John.4.11"}
+    assert set(references(index.search("\"one another\""))) == {"John.13.34", "John.13.35", "1John.4.7", "1John.4.11"}
+    # The words of a phrase must be next to each other and in order
+    assert references(index.search("\"love does not\"")) == ["1John.4.8"]
+    assert index.search("\"another one\"") == []
+    assert set(references(index.search("love \"one another\"", within=Passage("1John.4.1-1John.4.10")))) == {"1John.4.7"}
+    # The verse saying "love" most often, for its length, scores highest
+    assert references(index.search("love"))[0] == "1John.4.7"
+
+def test_unchanged_chapter_not_indexed_again():
+    index = indexOf(("JHN", 13, JOHN_13))
+    assert not index.addChapter("John", 13, JOHN_13)
+    assert index.addChapter("John", 13, JOHN_13[:2])
+    assert index.verseCount() == 2
+
+def test_saved_index_reloaded(tmp_path):
+    path = str(tmp_path / "text.index")
+    index = indexOf(("JHN", 13, JOHN_13), ("1JN", 4, FIRST_JOHN_4))
+    expected = index.search("love \"one another\"")
+    index.save(path)
+    # The saved index gives the same results, mapped from the file
+    assert index.search("love \"one another\"") == expected
+    reloaded = TextIndex(path)
+    assert reloaded.search("love \"one another\"") == expected
+    assert reloaded.chapters == index.chapters and reloaded.fingerprint() == index.fingerprint()
+    assert reloaded.verseCount() == 6
+
+def test_replaced_chapter_after_reloading(tmp_path):
+    path = str(tmp_path / "text.index")
+    indexOf(("JHN", 13, JOHN_13), ("1JN", 4, FIRST_JOHN_4)).save(path)
+    index = TextIndex(path)
+    fingerprint = index.fingerprint()
+    assert index.addChapter("JHN", 13, [(34, "A new commandment I give to you, that you care for each other.")])
+    assert index.fingerprint() != fingerprint
+
+    # The saved postings of the chapter are left out, and the new ones found, before and after saving again
+    def check(current):
+        assert set(references(current.search("\"one another\""))) == {"1John.4.7", "1John.4.11"}
+        assert references(current.search("\"each other\"")) == ["John.13.34"]
+        assert current.verseCount() == 4
+    check(index)
+    index.save()
+    check(index)
+    check(TextIndex(path))
+
+def test_text_index_of_cached_chapters(tmp_path):
+    cache = VerseCache(":memory:")
+    cache.put_chapter("ENGESV", "JHN", 13, JOHN_13)
+    path = str(tmp_path / "text.index")
+    index = textIndex(cache, "ENGESV", path)
+    assert index.verseCount() == 3
+    # Chapters cached since are added, and the index saved again
+    cache.put_chapter("ENGESV", "1JN", 4, FIRST_JOHN_4)
+    assert textIndex(cache, "ENGESV", path) is index
+    assert TextIndex(path).verseCount() == 6
@@ -0,0 +1,89 @@
+import pytest
+
+import DBPManager
+from Catalog import Catalog
+from DBPManager import DBPManager as Manager
+from VerseCache import VerseCache
+from dbpstub import DBPStubServer
+
+# The verse cache, tested through DBPManager against the local stand-in for the DBP (see tools/dbpstub.py)
+
+@pytest.fixture
+def server(monkeypatch):
+    server = DBPStubServer().start()
+    monkeypatch.setattr(DBPManager, "API_HOST", server.url())
+    monkeypatch.setattr(DBPManager, "KEY", "stub")
+    yield server
+    server.stop()
+
+def manager(version, cache):
+    # A manager of its own (not the shared one), with a catalog of languages and versions that isn't saved
+    return Manager("ENG", version, cache, Catalog(":memory:"))
+
+def test_misses_then_hits(server):
+    cache = VerseCache(":memory:")
+    esv = manager("ESV", cache)
+    (text, verses) = esv.passages_many([("JHN", 3, 3, 16, 17)])[0]
+    assert len(verses) == 1 and len(verses[0]) == 2
+    assert cache.stats()["misses"] == 1 and cache.stats()["hits"] == 0
+    requests = server.request_count
+
+    # Any part of a cached chapter, under any name of its book, is served from the cache
+    assert esv.passages_many([("John", 3, 3, 16, 17)])[0][0] == text
+    assert esv.passages_many([("John", 3, 3, 1, 36)])[0][0].startswith(esv.passages_many([("JHN", 3, 3, 1, 15)])[0][0])
+    assert server.request_count == requests
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 1
+
+def test_whole_book_comes_from_the_catalog(server):
+    cache = VerseCache(":memory:")
+    esv = manager("ESV", cache)
+    # From John 21:24 to the end of the book, which is the end of chapter 21
+    (_, verses) = esv.passages_many([("JHN", 21, None, 24)])[0]
+    assert [len(chapter) for chapter in verses] == [2]
+    (_, verses) = esv.passages_many([("Jude",)])[0]
+    assert [len(chapter) for chapter in verses] == [25]
+    assert cache.get_book_catalog("ENGESV") is not None
+
+def test_least_recently_used_chapters_are_evicted(server):
+    cache = VerseCache(":memory:", max_verses=60)
+    esv = manager("ESV", cache)
+    # Jude (25 verses) and Obadiah (21) fit, then Jude is used again, so Obadiah is the least recently used
+    esv.passages_many([("JUD", 1), ("OBA", 1)])
+    esv.passages_many([("JUD", 1)])
+    # Philemon (25 verses) takes the cache over 60 verses
+    esv.passages_many([("PHM", 1)])
+    assert cache.stats()["evictions"] == 1
+    assert not cache.has_chapter("ENGESV", "OBA", 1)
+    assert cache.has_chapter("ENGESV", "JUD", 1) and cache.has_chapter("ENGESV", "PHM", 1)
+    assert cache.stats()["verses"] <= 60
+
+def test_mirrored_filesets_are_not_evicted(server):
+    cache = VerseCache(":memory:", max_verses=60)
+    (esv, kjv) = (manager("ESV", cache), manager("KJV", cache))
+    # Chapters of a fileset being mirrored are kept, however many there are, and don't count towards the limit
+    cache.start_mirror("ENGKJV")
+    kjv.passages_many([("JHN", 3), ("JHN", 4)])
+    esv.passages_many([("JUD", 1), ("OBA", 1)])
+    assert cache.stats()["evictions"] == 0
+    esv.passages_many([("PHM", 1)])
+    assert cache.stats()["evictions"] == 1
+    assert all(cache.has_chapter("ENGKJV", "JHN", chapter) for chapter in (3, 4))
+
+def test_prefetched_chapters_are_served_from_the_cache(server):
+    cache = VerseCache(":memory:")
+    kjv = manager("KJV", cache)
+    result = kjv.prefetch(["Jude", "RUT"])
+    assert result == {"chapters" : 5, "fetched" : 5, "failed" : []}
+    requests = server.request_count
+    assert len(kjv.passages_many([("Ruth", 1, None)])[0][1]) == 4
+    assert server.request_count == requests
+    assert kjv.prefetch(["Jude", "RUT"])["fetched"] == 0
+
+def test_rate_limited_requests_are_retried(server):
+    # Every third request is turned away with a 429, to be retried after the time the server asks for
+    server.rate_limit_every = 3
+    cache = VerseCache(":memory:")
+    esv = manager("ESV", cache)
+    results = esv.passages_many([("MRK", chapter, chapter, 1, 2) for chapter in range(1, 9)])
+    assert all(len(verses) == 1 and len(verses[0]) == 2 for (_, verses) in results)
+    assert all(cache.has_chapter("ENGESV", "MRK", chapter) for chapter in range(1, 9))
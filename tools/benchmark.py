@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.abspath(__file__+"/../../app"))
+from synthcorpus import Generator, generateCorpus
+
+# Measures the matching pipeline on synthetic corpora (see synthcorpus.py) of increasing size: how long it takes to build the
+# index and filters, each filter and the whole pipeline per question, and the batch (MatrixScorer) scorer, as throughput and
+# p50/p99 latency, along with the peak memory of each size. Fetching passage text is measured against the local stand-in
+# DBP server (see dbpstub.py), with an empty verse cache and then again once the verses are cached.
+#
+# With --profile, the pipeline is run once more with the filter profiler enabled (see Profile), adding how much work each filter
+# did (passages looked at and scored, similar word lookups) to the results; its timings are measured with profiling off.
+#
+# Each size is measured in its own process, so that its peak memory is its own. The results are saved as JSON, and can be
+# compared with an earlier run's to find regressions.
+#
+# Usage:
+#   python3 benchmark.py [--scales <passages> ...] [--questions <count>] [--seed <seed>] [--output <results file>]
+#                        [--compare <earlier results file>] [--dbp-batches <count>] [--dbp-delay <seconds>] [--profile]
+# Example:
+#   python3 benchmark.py --scales 1000 10000 100000 --output before.json
+#   python3 benchmark.py --scales 1000 10000 100000 --output after.json --compare before.json
+#       Exits with 1 if any stage's p50 latency got more than REGRESSION_TOLERANCE slower
+
+DEFAULT_SCALES = [1000, 10000, 100000]
+DEFAULT_QUESTIONS = 50
+DEFAULT_DBP_BATCHES = 20
+# Seconds the stand-in DBP server waits before each answer, roughly a round trip to the real API
+DEFAULT_DBP_DELAY = 0.02
+# How many passages are returned (and have their text fetched) for each question
+K = 3
+# How many questions the batch scorer scores at once
+BATCH_SIZE = 16
+# How much slower (as a fraction) a stage's p50 latency can get before it is reported as a regression
+REGRESSION_TOLERANCE = 0.1
+
+def percentile(samples, q):
+    # The nearest-rank percentile of the given (sorted) samples
+    if len(samples) == 0:
+        return None
+    return samples[min(len(samples) - 1, max(0, int(round(q * len(samples))) - 1))]
+
+def summarise(samples, items_per_sample = 1):
+    """
+    Returns the count, throughput (items per second), mean and p50/p99 latency (in seconds) of the given timings
+    """
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        "count" : len(samples),
+        "throughput" : len(samples) * items_per_sample / total if total > 0 else None,
+        "mean" : total / len(samples) if samples else None,
+        "p50" : percentile(samples, 0.5),
+        "p99" : percentile(samples, 0.99)
+    }
+
+def peakMemory():
+    # Peak resident memory of this process so far, in MB
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+def timed(function, *arguments):
+    started = time.perf_counter()
+    result = function(*arguments)
+    return (result, time.perf_counter() - started)
+
+def benchmarkScale(passages, questions, seed, profile = False):
+    """
+    Measures every stage on a synthetic corpus of the given size. Run in its own process (see `isolated()`).
+    """
+    from ContextIndex import ContextIndex
+    from MatrixScorer import MatrixScorer
+    from Passage import Passage, topPassages
+    from Pipeline import rankPassages
+    from Profile import profiler
+    from Synonyms import SynonymCache
+    from filters import defaultFilters
+
+    results = {"passages" : passages, "questions" : questions}
+    ((scripture_contexts, question_contexts), results["generate"]) = timed(generateCorpus, passages, questions, seed)
+
+    started = time.perf_counter()
+    scripture_map = {scripture_context["passage"] : Passage(scripture_context["passage"]) for scripture_context in scripture_contexts}
+    index = ContextIndex(scripture_contexts)
+    # Similar words are expanded ahead of time, as they are when the corpus is compiled
+    synonyms = SynonymCache(":memory:")
+    filters = defaultFilters(scripture_contexts, scripture_map, index, synonyms)
+    results["build"] = time.perf_counter() - started
+    results["distinct-passages"] = len(scripture_map)
+
+    def resetScores():
+        for passage in scripture_map.values():
+            passage.score = 0
+
+    # Each filter on its own, one question at a time
+    filter_timings = {type(filter).__name__ : [] for filter in filters}
+    top_timings = []
+    for question_context in question_contexts:
+        resetScores()
+        for filter in filters:
+            (_, seconds) = timed(filter.process, question_context)
+            filter_timings[type(filter).__name__].append(seconds)
+        (_, seconds) = timed(topPassages, scripture_map.values(), K)
+        top_timings.append(seconds)
+    for (name, timings) in filter_timings.items():
+        results["filter." + name] = summarise(timings)
+    results["top"] = summarise(top_timings)
+
+    # The whole pipeline, as main.py runs it
+    pipeline_timings = []
+    for question_context in question_contexts:
+        resetScores()
+        (_, seconds) = timed(rankPassages, filters, question_context, scripture_map.values(), K)
+        pipeline_timings.append(seconds)
+    results["pipeline"] = summarise(pipeline_timings)
+
+    if profile:
+        profiler.reset()
+        profiler.enable()
+        for question_context in question_contexts:
+            resetScores()
+            rankPassages(filters, question_context, scripture_map.values(), K)
+        profiler.disable()
+        results["profile"] = profiler.snapshot()
+
+    # The batch scorer, as the answering service runs it
+    (scorer, results["matrix-build"]) = timed(MatrixScorer, scripture_contexts, index, synonyms)
+    matrix_filters = scorer.defaultFilters()
+    batch_timings = []
+    for start in range(0, len(question_contexts), BATCH_SIZE):
+        batch = question_contexts[start:start + BATCH_SIZE]
+        started = time.perf_counter()
+        for question_scores in scorer.scoreBatch(matrix_filters, batch):
+            scorer.top(question_scores, K)
+        batch_timings.append(time.perf_counter() - started)
+    results["matrix"] = summarise(batch_timings, BATCH_SIZE)
+
+    results["peak-memory-mb"] = peakMemory()
+    return results
+
+def benchmarkDBP(batches, delay, seed):
+    """
+    Measures fetching the text of `batches` sets of K passages from the stand-in DBP server, first with an empty verse cache,
+    then again with the verses cached. Run in its own process (see `isolated()`), as the server's address is read on import.
+    """
+    from dbpstub import DBPStubServer
+    server = DBPStubServer(delay=delay).start()
+    os.environ["DBP_HOST"] = server.url()
+    os.environ.setdefault("DBP_KEY", "stub")
+    from Catalog import Catalog
+    from DBPManager import DBPManager
+    from Passage import Passage, passageTexts
+    from VerseCache import VerseCache
+
+    try:
+        generator = Generator(0, seed)
+        passage_batches = [[Passage(generator.passage()[0]) for _ in range(K)] for _ in range(batches)]
+        with tempfile.TemporaryDirectory() as folder:
+            manager = DBPManager("ENG", "ESV", VerseCache(":memory:"), Catalog(os.path.join(folder, "catalog.json")))
+            # Finding the fileset is paid once per manager, not per batch, so it is measured on its own
+            (_, validate_seconds) = timed(manager.validate)
+            results = {"batches" : batches, "delay" : delay, "validate" : validate_seconds}
+            for stage in ("cold", "warm"):
+                requests_before = server.request_count
+                timings = [timed(passageTexts, passages, manager)[1] for passages in passage_batches]
+                results[stage] = dict(summarise(timings, K), requests=server.request_count - requests_before)
+        return results
+    finally:
+        server.stop()
+
+def isolated(function, *arguments):
+    # Runs the function in a new process, so that nothing (memory, imports, caches) is carried over between measurements
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(function, *arguments).result()
+
+def compareResults(earlier, later, tolerance = REGRESSION_TOLERANCE):
+    """
+    Returns a description of every stage whose p50 latency is more than `tolerance` slower in the later results than the earlier ones
+    """
+    regressions = []
+    stages = [(name, earlier_scale, later["scales"][name]) for (name, earlier_scale) in earlier.get("scales", {}).items() if name in later.get("scales", {})]
+    if "dbp" in earlier and "dbp" in later:
+        stages.append(("dbp", earlier["dbp"], later["dbp"]))
+    for (name, earlier_stages, later_stages) in stages:
+        for (stage, earlier_stage) in earlier_stages.items():
+            later_stage = later_stages.get(stage)
+            if type(earlier_stage) != dict or type(later_stage) != dict or not earlier_stage.get("p50") or later_stage.get("p50") is None:
+                continue
+            change = later_stage["p50"] / earlier_stage["p50"] - 1
+            if change > tolerance:
+                regressions.append(name + " " + stage + ": p50 " + format(earlier_stage["p50"] * 1000, ".3f") + "ms -> " +
+                                   format(later_stage["p50"] * 1000, ".3f") + "ms (+" + format(change * 100, ".0f") + "%)")
+    return regressions
+
+def report(name, results):
+    print(name + ":")
+    for (stage, value) in results.items():
+        if stage == "profile":
+            for (name, counters) in value.items():
+                print("  " + ("profile." + name).ljust(36) + " " + str(counters["calls"]) + " calls, " + str(counters["scanned"]) + " scanned, " +
+                      str(counters["scored"]) + " scored, " + str(counters["synonym-lookups"]) + " synonym lookups (" +
+                      str(counters["synonym-hits"]) + " cached)")
+        elif type(value) == dict:
+            print("  " + stage.ljust(36) + " p50 " + format((value["p50"] or 0) * 1000, "9.3f") + "ms  p99 " +
+                  format((value["p99"] or 0) * 1000, "9.3f") + "ms  " + format(value["throughput"] or 0, "10.1f") + "/s" +
+                  ("  " + str(value["requests"]) + " requests" if "requests" in value else ""))
+        elif type(value) == float:
+            print("  " + stage.ljust(36) + " " + format(value, ".3f"))
+        else:
+            print("  " + stage.ljust(36) + " " + str(value))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the matching pipeline on synthetic corpora")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="How many scripture contexts to generate for each run")
+    parser.add_argument("--questions", type=int, default=DEFAULT_QUESTIONS, help="How many questions to score at each scale")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Where to save the results, as JSON")
+    parser.add_argument("--compare", default=None, help="Earlier results to compare with")
+    parser.add_argument("--dbp-batches", type=int, default=DEFAULT_DBP_BATCHES, help="How many sets of passages to fetch text for; 0 to skip")
+    parser.add_argument("--dbp-delay", type=float, default=DEFAULT_DBP_DELAY)
+    parser.add_argument("--profile", action="store_true", help="Also count how much work each filter does")
+    arguments = parser.parse_args()
+
+    results = {
+        "environment" : {"python" : platform.python_version(), "platform" : platform.platform(), "cpus" : os.cpu_count()},
+        "settings" : {"questions" : arguments.questions, "seed" : arguments.seed, "k" : K, "batch-size" : BATCH_SIZE},
+        "scales" : {}
+    }
+    for passages in arguments.scales:
+        results["scales"][str(passages)] = isolated(benchmarkScale, passages, arguments.questions, arguments.seed, arguments.profile)
+        report(str(passages) + " passages", results["scales"][str(passages)])
+    if arguments.dbp_batches > 0:
+        results["dbp"] = isolated(benchmarkDBP, arguments.dbp_batches, arguments.dbp_delay, arguments.seed)
+        report("DBP", results["dbp"])
+
+    if arguments.output is not None:
+        with open(arguments.output, "w") as handle:
+            json.dump(results, handle, indent=2)
+
+    if arguments.compare is not None:
+        with open(arguments.compare, "r") as handle:
+            regressions = compareResults(json.load(handle), results)
+        print(("Regressions:\n  " + "\n  ".join(regressions)) if regressions else "No regressions")
+        sys.exit(1 if regressions else 0)
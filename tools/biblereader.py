@@ -11,19 +11,66 @@ import os
 #   python3 biblereader.py John.3.16 ENG ESV
 #   python3 biblereader.py John.3.16-John.3.18 ENG NIV output.txt
 # Note that passage references are in OSIS format
+#
+# With --mirror, whole filesets (a language followed by a version, e.g. ENGESV) are downloaded into the verse cache instead, so that
+# they are served from then on without calling the API at all (see DBPManager.mirror()). Run it again to resume one that was
+# interrupted, or that had failures; whatever is already stored isn't fetched again.
+#
+# Usage:
+#   python3 biblereader.py --mirror <fileset> [<fileset> ...] [--cache <verse cache file>] [--rate <requests per second>]
+# Example:
+#   python3 biblereader.py --mirror ENGESV ENGKJV SPNRVR --rate 10
+#       Stores all three Bibles in the shared verse cache (data/cache/verses.db), starting at most 10 requests each second
 
 sys.path.insert(0, os.path.abspath(__file__+"/../../app"))
 from Passage import Passage
-from DBPManager import DBPManager
+from DBPManager import DBPManager, get_manager
+from VerseCache import VerseCache
+
+def mirror(fileset_ids, cache_path = None, rate = None):
+    # Mirrors each fileset in turn, returning whether all of them are now complete
+    cache = VerseCache(cache_path) if cache_path is not None else None
+    complete = True
+    for fileset_id in fileset_ids:
+        (language, version) = (fileset_id[:3], fileset_id[3:])
+        manager = DBPManager(language, version, cache) if cache is not None else get_manager(language, version)
+
+        def progress(stored, total):
+            if stored % 50 == 0 or stored == total:
+                print("\r" + fileset_id + ": " + str(stored) + "/" + str(total) + " chapters", end="", flush=True)
+
+        result = manager.mirror(rate, progress)
+        print("\r" + fileset_id + ": " + str(result["chapters"]) + " chapters, " + str(result["fetched"]) + " fetched" +
+              (", " + str(len(result["failed"])) + " failed" if result["failed"] else ", complete"))
+        for (book, chapter, error) in result["failed"]:
+            print("  " + book + " " + str(chapter) + ": " + error)
+        complete = complete and len(result["failed"]) == 0
+    (cache if cache is not None else manager.cache).compact()
+    return complete
+
+parser = argparse.ArgumentParser(description="Retrieves Scripture text, or mirrors whole filesets into the verse cache")
+parser.add_argument("passage", nargs="?", help="The passage, in OSIS format")
+parser.add_argument("language", nargs="?")
+parser.add_argument("version", nargs="?")
+parser.add_argument("filename", nargs="?", help="Where to write the passage text as well")
+parser.add_argument("--mirror", nargs="+", metavar="FILESET", help="Store these whole filesets (e.g. ENGESV) instead")
+parser.add_argument("--cache", default=None, help="The verse cache to mirror into, if not the shared one")
+parser.add_argument("--rate", type=float, default=None, help="The most requests to start each second while mirroring")
+arguments = parser.parse_args()
+
+if arguments.mirror is not None:
+    sys.exit(0 if mirror(arguments.mirror, arguments.cache, arguments.rate) else 1)
+if arguments.version is None:
+    parser.error("a passage, language and version are needed")
 
-passage_ref = sys.argv[1]
-language = sys.argv[2]
-version = sys.argv[3]
-filename = sys.argv[4] if len(sys.argv) == 5 else None
+passage_ref = arguments.passage
+language = arguments.language
+version = arguments.version
+filename = arguments.filename
 print(passage_ref + " " + language + " " + version)
 
 passage = Passage(passage_ref)
-text = passage.text(DBPManager(language, version))
+text = passage.text(get_manager(language, version))
 
 print(passage_ref + ":")
 print(text)
@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.abspath(__file__+"/../../app"))
+import Canon
+
+# A local stand-in for the parts of the Digital Bible Platform API that DBPManager uses, serving made-up verse text
+# with the real shape of the canon. Point DBPManager at it with the DBP_HOST environment variable.
+#
+# Usage:
+#   python3 dbpstub.py [--port <port>] [--delay <seconds>] [--filesets ENGESV ENGKJV ...]
+# Example:
+#   python3 dbpstub.py --port 8700 --delay 0.05
+#   DBP_HOST=http://localhost:8700 DBP_KEY=stub python3 biblereader.py John.3.16 ENG ESV
+#
+# It can also be started from Python (e.g. in a benchmark):
+#   server = DBPStubServer(delay=0.05).start()
+#   ...
+#   server.stop()
+
+WORDS = ["the", "lord", "said", "unto", "his", "people", "and", "they", "went", "up", "to", "the", "city", "of", "god",
+         "in", "that", "day", "light", "was", "upon", "earth", "for", "love", "is", "patient", "kind", "heaven", "faith"]
+
+def book_index(book):
+    # Accept full names, abbreviations, and DBP style (USFM) ids alike; -1 if the book isn't in the canon
+    return Canon.bookIndex(book)
+
+def verse_text(fileset_id, book, chapter, verse):
+    # Deterministic text, so that the same verse always reads the same
+    generator = random.Random(fileset_id + book + str(chapter) + "." + str(verse))
+    words = [generator.choice(WORDS) for _ in range(generator.randint(8, 24))]
+    return " ".join(words) + ". "
+
+class DBPStubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        # Keep the console quiet
+        pass
+
+    def do_GET(self):
+        server = self.server.stub
+        with server.lock:
+            server.request_count += 1
+            request_number = server.request_count
+        if server.delay > 0:
+            time.sleep(server.delay)
+        if server.rate_limit_every > 0 and request_number % server.rate_limit_every == 0:
+            self.reply(429, {"error": "Too many requests"}, {"Retry-After": "0"})
+            return
+
+        url = urlparse(self.path)
+        query = {key : values[0] for (key, values) in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split("/") if part != ""]
+        if len(parts) > 0 and parts[0] == "api":
+            parts = parts[1:]
+
+        if parts == ["languages"]:
+            self.reply(200, self.paginate([{"iso" : iso} for iso in server.languages()], query, "total_pages"))
+        elif parts == ["bibles"]:
+            language = query.get("language_code", "").upper()
+            bibles = [{"filesets" : {"dbp-prod" : [{"id" : fileset_id, "type" : "text_plain"}]}} for fileset_id in server.filesets if fileset_id.startswith(language)]
+            self.reply(200, self.paginate(bibles, query, "last_page"))
+        elif len(parts) == 2 and parts[1] == "book" and parts[0] in server.filesets:
+            books = [self.book_data(book_index(query["book_id"]))] if "book_id" in query else \
+                    [self.book_data(index) for index in range(len(Canon.BOOKS))]
+            if None in books:
+                self.reply(404, {"error" : "Unknown book"})
+            else:
+                self.reply(200, {"data" : books})
+        elif len(parts) == 5 and parts[:2] == ["bibles", "filesets"] and parts[2] in server.filesets:
+            self.chapter(parts[2], parts[3], parts[4], query)
+        else:
+            self.reply(404, {"error" : "Unknown endpoint " + url.path})
+
+    def paginate(self, items, query, last_page_name):
+        limit = int(query.get("limit", 150))
+        page = int(query.get("page", 1))
+        last_page = max(1, (len(items) + limit - 1) // limit)
+        return {"data" : items[(page - 1) * limit : page * limit], "meta" : {"pagination" : {last_page_name : last_page}}}
+
+    def book_data(self, index):
+        if index < 0:
+            return None
+        (name, _, verse_counts) = Canon.BOOKS[index]
+        return {
+            "book_id" : Canon.USFM_IDS[index],
+            "name" : name,
+            "testament" : "OT" if index < 39 else "NT",
+            "chapters" : list(range(1, len(verse_counts) + 1)),
+            "verses_count" : [{"chapter" : chapter + 1, "verses" : verses} for (chapter, verses) in enumerate(verse_counts)]
+        }
+
+    def chapter(self, fileset_id, book, chapter, query):
+        index = book_index(book)
+        chapter = int(chapter)
+        if index < 0 or chapter < 1 or chapter > len(Canon.BOOKS[index][2]):
+            self.reply(404, {"error" : "Unknown chapter"})
+            return
+        (_, abbreviation, verse_counts) = Canon.BOOKS[index]
+        book_id = Canon.USFM_IDS[index]
+        last_verse = verse_counts[chapter - 1]
+        verse_start = int(query.get("verse_start", 1))
+        verse_end = int(query.get("verse_end", last_verse))
+        if verse_end == -1:
+            verse_end = last_verse
+        missing = self.server.stub.missing_verses.get(fileset_id, set())
+        verses = []
+        for verse in range(verse_start, min(verse_end, last_verse) + 1):
+            if (book_id, chapter, verse) in missing:
+                continue
+            verses.append({"book_id" : book_id, "chapter" : chapter, "verse_start" : verse, "verse_end" : verse,
+                           "verse_text" : verse_text(fileset_id, abbreviation, chapter, verse)})
+        self.reply(200, {"data" : verses})
+
+    def reply(self, status, body, headers = None):
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for (name, value) in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+class DBPStubServer:
+    def __init__(self, port = 0, delay = 0.0, filesets = ("ENGESV", "ENGKJV", "SPNRVR"), rate_limit_every = 0, missing_verses = None):
+        """
+        Parameters
+        ----------
+        [`port` : `int`]
+            The port to listen on; 0 picks a free one
+        [`delay` : `float`]
+            Seconds to wait before answering each request, to imitate network latency
+        [`filesets` : `tuple`]
+            The filesetIDs that are served (the language is the first 3 characters of each)
+        [`rate_limit_every` : `int`]
+            If more than 0, every Nth request is answered with a 429 (Too Many Requests)
+        [`missing_verses` : `dict`]
+            For each filesetID, a set of (book id, chapter, verse) that the fileset doesn't contain, to imitate versification differences.
+            Book ids are USFM ids (e.g. "JHN"), as the DBP names books.
+        """
+
+        self.delay = delay
+        self.filesets = list(filesets)
+        self.rate_limit_every = rate_limit_every
+        self.missing_verses = missing_verses if missing_verses is not None else {}
+        self.request_count = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), DBPStubHandler)
+        self.httpd.stub = self
+        self.thread = None
+
+    def languages(self):
+        return sorted(set(fileset_id[:3].lower() for fileset_id in self.filesets))
+
+    def url(self):
+        return "http://127.0.0.1:" + str(self.httpd.server_address[1])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Digital Bible Platform API")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--filesets", nargs="+", default=["ENGESV", "ENGKJV", "SPNRVR"])
+    arguments = parser.parse_args()
+    server = DBPStubServer(arguments.port, arguments.delay, arguments.filesets)
+    print("Serving stand-in DBP API at " + server.url())
+    server.httpd.serve_forever()
@@ -0,0 +1,196 @@
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.abspath(__file__+"/../../app"))
+import Canon
+
+# Generates synthetic scripture contexts and question contexts, with the same members as Scriptures.json and Contexts.json,
+# at any scale, so the matching pipeline can be measured on far more than the few dozen real entries (see benchmark.py).
+#
+# People, places, actions and question types are drawn from vocabularies with a Zipf distribution (a few are very common,
+# most are rare), like the words of the real data: the real entries' most common values head each vocabulary, followed by
+# made-up ones. Passages are single verses or short ranges, anywhere in the canon (books weighted by their length).
+# The same seed always generates the same entries.
+#
+# Usage:
+#   python3 synthcorpus.py <passages> <questions> <output folder> [--seed <seed>] [--jsonl]
+# Example:
+#   python3 synthcorpus.py 100000 1000 /tmp/synthetic
+#       Writes /tmp/synthetic/Scriptures.json (100,000 scripture contexts) and /tmp/synthetic/Contexts.json (1,000 questions)
+
+# How steeply the vocabularies' frequencies fall off: the nth most common value is drawn about 1/n^ZIPF_EXPONENT as often as the first
+ZIPF_EXPONENT = 1.1
+
+PEOPLE = ["God", "Jesus", "Lord", "husbands", "wives", "men", "Jonah", "brother", "we", "Hannah", "Peter", "Paul", "Moses", "David",
+          "Abraham", "Mary", "disciples", "Pharisees", "children", "father"]
+PLACES = ["heaven", "belly of the great fish", "heart of the earth", "throne", "under heaven", "Bethlehem Ephrathah", "Judah", "Israel",
+          "Jerusalem", "Father's house", "Egypt", "Galilee", "temple", "wilderness", "sea"]
+ACTIONS = ["forgive", "abide", "ask", "born", "given", "produces", "gained", "gathers", "live", "crying", "love", "pray", "believe",
+           "repent", "follow", "serve", "give thanks", "wipe every tear", "making everything new", "save"]
+QUESTION_TYPES = ["clarification", "moral", "understanding", "apologetical", "doctrine", "factual", "scientific"]
+SUBJECTS = ["crying", "salvation", "eternal life", "forgiveness", "marriage", "suffering", "prayer", "creation", "sin", "heaven",
+            "money", "worry", "death", "love", "faith"]
+WORDS = ["why", "does", "God", "Bible", "say", "sin", "how", "can", "I", "know", "what", "happens", "when", "we", "die", "is",
+         "it", "wrong", "to", "the", "pray", "love", "forgive", "heaven", "real"]
+
+# How many of each made-up value follow the real ones, per 1,000 passages (but at least MIN_SYNTHETIC_VALUES)
+SYNTHETIC_VALUES_PER_THOUSAND = 50
+MIN_SYNTHETIC_VALUES = 50
+
+# The chance of a passage being a range of verses rather than a single verse, and the longest range
+RANGE_CHANCE = 0.4
+MAX_RANGE = 12
+# The chance of a question naming a verse in "verse-in-the-question"
+VERSE_IN_QUESTION_CHANCE = 0.1
+
+# Books from here on are in the New Testament
+NT_START = Canon.bookIndex("Matthew")
+
+class Vocabulary:
+    def __init__(self, real, prefix, synthetic_count, generator):
+        # The real values (most common first) followed by made-up ones, each drawn with Zipf weights
+        self.values = list(real) + [prefix + "-" + str(i) for i in range(1, synthetic_count + 1)]
+        self.cumulative_weights = []
+        total = 0.0
+        for rank in range(1, len(self.values) + 1):
+            total += 1 / rank ** ZIPF_EXPONENT
+            self.cumulative_weights.append(total)
+        self.generator = generator
+
+    def draw(self, count):
+        # `count` values, without repeats
+        if count <= 0:
+            return []
+        values = self.generator.choices(self.values, cum_weights=self.cumulative_weights, k=count)
+        return list(dict.fromkeys(values))
+
+    def one(self):
+        return self.draw(1)[0]
+
+class Generator:
+    def __init__(self, passages, seed = 0):
+        """
+        Parameters
+        ----------
+        `passages` : `int`
+            How many scripture contexts will be generated; the vocabularies grow with it, as a larger corpus mentions more people, places, etc.
+        [`seed` : `int`]
+            The seed of the random generator, so that the same entries are generated every time
+        """
+        self.random = random.Random(seed)
+        synthetic_count = max(MIN_SYNTHETIC_VALUES, passages * SYNTHETIC_VALUES_PER_THOUSAND // 1000)
+        self.people = Vocabulary(PEOPLE, "person", synthetic_count, self.random)
+        self.places = Vocabulary(PLACES, "place", synthetic_count, self.random)
+        self.actions = Vocabulary(ACTIONS, "action", synthetic_count, self.random)
+        self.subjects = Vocabulary(SUBJECTS, "subject", synthetic_count, self.random)
+        self.question_types = Vocabulary(QUESTION_TYPES, "type", 0, self.random)
+        self.words = Vocabulary(WORDS, "word", synthetic_count, self.random)
+        # Books are chosen in proportion to how many verses they have
+        self.book_weights = []
+        total = 0
+        for (_, _, verse_counts) in Canon.BOOKS:
+            total += sum(verse_counts)
+            self.book_weights.append(total)
+
+    def passage(self):
+        # (OSIS reference, "OT" or "NT") of a random verse or range of verses within one chapter
+        book = self.random.choices(range(len(Canon.BOOKS)), cum_weights=self.book_weights)[0]
+        (_, abbreviation, verse_counts) = Canon.BOOKS[book]
+        chapter = self.random.randint(1, len(verse_counts))
+        verse = self.random.randint(1, verse_counts[chapter - 1])
+        reference = abbreviation + "." + str(chapter) + "." + str(verse)
+        if self.random.random() < RANGE_CHANCE:
+            end_verse = min(verse + self.random.randint(1, MAX_RANGE), verse_counts[chapter - 1])
+            if end_verse > verse:
+                reference += "-" + abbreviation + "." + str(chapter) + "." + str(end_verse)
+        return (reference, "OT" if book < NT_START else "NT")
+
+    def questionType(self):
+        return {
+            "type" : self.question_types.one(),
+            "subject" : self.subjects.one() if self.random.random() < 0.7 else self.subjects.draw(2),
+            "action" : self.actions.draw(self.random.randint(1, 3))
+        }
+
+    def questionText(self, words):
+        text = " ".join(words)
+        return text[:1].upper() + text[1:] + "?"
+
+    def scriptureContext(self):
+        (reference, section) = self.passage()
+        return {
+            "passage" : reference,
+            "score" : 0,
+            "scripture-section" : section,
+            "questions" : [self.questionText(self.words.draw(self.random.randint(4, 10))) for _ in range(self.random.randint(1, 3))],
+            "question-types" : [self.questionType() for _ in range(self.random.randint(1, 2))],
+            "people" : self.people.draw(self.random.randint(0, 3)),
+            "places" : self.places.draw(self.random.randint(0, 2)),
+            "actions" : self.actions.draw(self.random.randint(1, 4)),
+            "believer" : self.random.choice(["both", "believer", "unbeliever"])
+        }
+
+    def questionContext(self):
+        words = self.words.draw(self.random.randint(4, 10))
+        verse = ""
+        if self.random.random() < VERSE_IN_QUESTION_CHANCE:
+            verse = self.passage()[0]
+        return {
+            "question-text" : self.questionText(words),
+            "signficant-words" : words[:3],
+            "relates-to" : [],
+            "scripture-section" : self.random.choice(["OT", "NT", "Both", "Both"]),
+            "people" : self.people.draw(self.random.randint(0, 2)),
+            "places" : self.places.draw(self.random.randint(0, 1)),
+            "actions" : self.actions.draw(self.random.randint(0, 3)),
+            "believer" : self.random.random() < 0.5,
+            "question-type" : self.questionType(),
+            "verse-in-the-question" : verse
+        }
+
+def generateCorpus(passages, questions, seed = 0):
+    """
+    Returns (scripture contexts, question contexts): `passages` scripture contexts and `questions` question contexts,
+    as they would be read from Scriptures.json and Contexts.json
+    """
+    generator = Generator(passages, seed)
+    scripture_contexts = [generator.scriptureContext() for _ in range(passages)]
+    question_contexts = [generator.questionContext() for _ in range(questions)]
+    return (scripture_contexts, question_contexts)
+
+def writeEntries(path, key, entries):
+    """
+    Writes the given entries as a data file: like Scriptures.json (an object with a list in the given member), or as JSON Lines if
+    the path ends in .jsonl. Entries are written one at a time, so they can come from a generator.
+    """
+    with open(path, "w", encoding="utf-8") as handle:
+        if path.endswith(".jsonl"):
+            for entry in entries:
+                handle.write(json.dumps(entry) + "\n")
+            return
+        handle.write("{\"" + key + "\": [\n")
+        for (i, entry) in enumerate(entries):
+            handle.write((",\n" if i > 0 else "") + json.dumps(entry))
+        handle.write("\n]}\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates synthetic scripture and question contexts")
+    parser.add_argument("passages", type=int, help="How many scripture contexts to generate")
+    parser.add_argument("questions", type=int, help="How many question contexts to generate")
+    parser.add_argument("output", help="The folder to write Scriptures.json and Contexts.json to")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--jsonl", action="store_true", help="Write JSON Lines (Scriptures.jsonl and Contexts.jsonl) instead")
+    arguments = parser.parse_args()
+
+    os.makedirs(arguments.output, exist_ok=True)
+    extension = ".jsonl" if arguments.jsonl else ".json"
+    generator = Generator(arguments.passages, arguments.seed)
+    # Generated as they are written, so even a very large corpus is never held in memory
+    writeEntries(os.path.join(arguments.output, "Scriptures" + extension), "scripture",
+                 (generator.scriptureContext() for _ in range(arguments.passages)))
+    writeEntries(os.path.join(arguments.output, "Contexts" + extension), "context",
+                 (generator.questionContext() for _ in range(arguments.questions)))
+    print("Wrote " + str(arguments.passages) + " scripture contexts and " + str(arguments.questions) + " questions to " + arguments.output)